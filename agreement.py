@@ -0,0 +1,113 @@
+import numpy as np
+
+from normalize import MISSING, parse_numbers, parse_yes_no
+
+
+def encode_ordinal(frames):
+    """
+    Encodes Documents x Properties frames (one per rater) as integer label codes
+    shared by all raters. Non-numeric cells become MISSING.
+    Returns (list of code arrays, sorted label values).
+    """
+    numeric = [parse_numbers(df) for df in frames]
+
+    values = np.concatenate([v.ravel() for v in numeric])
+    labels = np.unique(values[~np.isnan(values)])
+
+    codes = []
+    for v in numeric:
+        c = np.full(v.shape, MISSING, dtype=np.int64)
+        valid = ~np.isnan(v)
+        c[valid] = np.searchsorted(labels, v[valid])
+        codes.append(c)
+    return codes, labels
+
+
+def encode_yes_no(frames):
+    """
+    Encodes Y/N (or YES/NO) cells as 1/0; everything else becomes MISSING.
+    """
+    return [parse_yes_no(df) for df in frames]
+
+
+def confusion_tensor(codes1, codes2, n_labels, unit_weights=None):
+    """
+    Properties x K x K confusion counts for two raters in one bincount pass.
+    codes are Units x Properties; units missing for either rater are left out.
+    unit_weights (e.g. bootstrap multiplicities) scales each unit's contribution.
+    A 2-D unit_weights (Resamples x Units) gives one tensor per row,
+    Resamples x Properties x K x K, from a single sparse product.
+    """
+    n_units, n_props = codes1.shape
+    valid = (codes1 != MISSING) & (codes2 != MISSING)
+    cell = (np.arange(n_props)[None, :] * n_labels + codes1) * n_labels + codes2
+
+    if unit_weights is not None and np.ndim(unit_weights) == 2:
+        from scipy import sparse
+
+        units = np.nonzero(valid)[0]
+        onehot = sparse.csr_matrix((np.ones(len(units)), (units, cell[valid])),
+                                   shape=(n_units, n_props * n_labels * n_labels))
+        counts = np.asarray(onehot.T @ np.asarray(unit_weights, dtype=float).T).T
+        return counts.reshape(-1, n_props, n_labels, n_labels)
+
+    weights = None
+    if unit_weights is not None:
+        weights = np.broadcast_to(np.asarray(unit_weights, dtype=float)[:, None], codes1.shape)[valid]
+    counts = np.bincount(cell[valid], weights=weights, minlength=n_props * n_labels * n_labels)
+    return counts.reshape(n_props, n_labels, n_labels)
+
+
+def disagreement_weights(confusion, weights=None):
+    """
+    Per-property K x K disagreement weights. Distances are measured between
+    the ranks of the labels each property actually uses, as sklearn's
+    cohen_kappa_score does.
+    """
+    used = (confusion.sum(axis=-1) + confusion.sum(axis=-2)) > 0
+    rank = np.cumsum(used, axis=-1) - 1
+    diff = rank[..., :, None] - rank[..., None, :]
+
+    if weights is None:
+        return (diff != 0).astype(float)
+    if weights == 'linear':
+        return np.abs(diff).astype(float)
+    if weights == 'quadratic':
+        return (diff ** 2).astype(float)
+    raise ValueError(f"Unknown weighting '{weights}'")
+
+
+def kappa_from_confusion(confusion, weights=None):
+    """
+    Cohen's kappa for every property of a Properties x K x K tensor.
+    Properties without any rated pair are NaN. When both raters used a
+    single identical label throughout, kappa is 1.0 (perfect agreement).
+    """
+    confusion = np.asarray(confusion, dtype=float)
+    n = confusion.sum(axis=(-2, -1))
+    w = disagreement_weights(confusion, weights)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected = confusion.sum(axis=-1)[..., :, None] * confusion.sum(axis=-2)[..., None, :] / n[..., None, None]
+        observed_dis = (w * confusion).sum(axis=(-2, -1))
+        expected_dis = (w * expected).sum(axis=(-2, -1))
+        kappa = 1 - observed_dis / expected_dis
+
+    kappa = np.where(expected_dis == 0, np.where(observed_dis == 0, 1.0, 0.0), kappa)
+    return np.where(n > 0, kappa, np.nan)
+
+
+def cohen_kappa_all(codes1, codes2, n_labels, weights=None):
+    """
+    Unweighted, linear or quadratic kappa for every property at once.
+    """
+    return kappa_from_confusion(confusion_tensor(codes1, codes2, n_labels), weights)
+
+
+def kappa_replicates(data, unit_weights):
+    """
+    Kappa for every property under each row of unit_weights (Resamples x Units).
+    data is (codes1, codes2, n_labels, weights); used by bootstrap.py.
+    """
+    codes1, codes2, n_labels, weights = data
+    return kappa_from_confusion(confusion_tensor(codes1, codes2, n_labels, unit_weights), weights)
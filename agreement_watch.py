@@ -0,0 +1,303 @@
+import os
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from agreement import MISSING, confusion_tensor, kappa_from_confusion
+from icc import icc_values, mean_squares_from_sums
+from kappa import ICC_RECODING, RATER_FILES, common_documents
+from normalize import parse_numbers, recode
+from results_store import record
+
+TOP_DISAGREEMENTS = 10
+KAPPA_FILE = 'output_kappa_updated.csv'
+ICC_FILE = 'output_icc_updated.csv'
+DISAGREEMENTS_FILE = 'disagreements.csv'
+
+
+def kappa_labels(columns):
+    return [label for label in columns
+            if not (label == 'ID' or str(label).startswith("EX") or label == 'rater')]
+
+
+def _value_key(value):
+    """
+    Hashable form of a raw cell; every kind of blank is one value, as for nunique(dropna=False).
+    """
+    return None if pd.isna(value) else value
+
+
+class IncrementalAgreement:
+    """
+    Weighted kappa and ICC3 per property, plus a per-guideline disagreement
+    score, for two raters on their common documents. Everything is kept as
+    running totals, so folding in an edited cell only touches that cell's
+    target and property:
+
+    - kappa: Properties x K x K confusion counts over the numeric values
+      seen so far (K grows when a new value appears)
+    - ICC: per property, the number of targets rated by both and the sums
+      of their ratings, squared ratings, squared target sums and per-rater
+      sums (ratings collapsed as in kappa.icc_analysis)
+    - the distinct raw values of each rater and property, which decide
+      whether a property varies at all and gets an ICC
+    - per guideline, how many properties the raters rate differently and
+      the summed squared difference
+    """
+
+    def __init__(self, df1, df2):
+        self.targets = df1.index
+        self.labels = kappa_labels(df1.columns)
+        self.raw = np.stack([df1[self.labels].to_numpy(dtype=object),
+                             df2[self.labels].to_numpy(dtype=object)])
+        n_labels = len(self.labels)
+
+        self.scores = parse_numbers(self.raw)
+        self.values = np.unique(self.scores[~np.isnan(self.scores)]).tolist()
+        self.code_of = {v: i for i, v in enumerate(self.values)}
+        self.codes = np.full(self.raw.shape, MISSING, dtype=np.int64)
+        valid = ~np.isnan(self.scores)
+        self.codes[valid] = np.searchsorted(self.values, self.scores[valid])
+        self.confusion = confusion_tensor(self.codes[0], self.codes[1], len(self.values))
+
+        self.icc_scores = recode(self.scores, ICC_RECODING)
+        complete = ~np.isnan(self.icc_scores).any(axis=0)
+        y = np.where(complete, self.icc_scores, 0.0)
+        self.n = complete.sum(axis=0)
+        self.total = y.sum(axis=(0, 1))
+        self.total_sq = (y ** 2).sum(axis=(0, 1))
+        self.target_sq = (y.sum(axis=0) ** 2).sum(axis=0)
+        self.rater_sums = y.sum(axis=1).T
+        self.n_numeric = (~np.isnan(self.icc_scores)).sum(axis=(0, 1))
+        self.distinct = [[Counter(map(_value_key, self.raw[r, :, l])) for l in range(n_labels)]
+                         for r in range(2)]
+
+        both = ~np.isnan(self.scores).any(axis=0)
+        diff = np.where(both, self.scores[0] - self.scores[1], 0.0)
+        self.discord_count = (diff != 0).sum(axis=1)
+        self.discord_sq = (diff ** 2).sum(axis=1)
+
+        self.kappa = np.full(n_labels, np.nan)
+        self.icc = np.full(n_labels, np.nan)
+        self._refresh(range(n_labels))
+
+    def _code(self, score):
+        if np.isnan(score):
+            return MISSING
+        if score not in self.code_of:
+            self.code_of[score] = len(self.values)
+            self.values.append(score)
+            self.confusion = np.pad(self.confusion, ((0, 0), (0, 1), (0, 1)))
+        return self.code_of[score]
+
+    def _pair(self, t, l, sign):
+        """
+        Adds (sign=1) or removes (sign=-1) the two raters' cells at target t,
+        property l from every running total.
+        """
+        c1, c2 = self.codes[:, t, l]
+        if c1 != MISSING and c2 != MISSING:
+            self.confusion[l, c1, c2] += sign
+
+        y = self.icc_scores[:, t, l]
+        if not np.isnan(y).any():
+            self.n[l] += sign
+            self.total[l] += sign * y.sum()
+            self.total_sq[l] += sign * (y ** 2).sum()
+            self.target_sq[l] += sign * y.sum() ** 2
+            self.rater_sums[l] += sign * y
+
+        s = self.scores[:, t, l]
+        if not np.isnan(s).any() and s[0] != s[1]:
+            self.discord_count[t] += sign
+            self.discord_sq[t] += sign * (s[0] - s[1]) ** 2
+
+    def _refresh(self, labels):
+        """
+        Recomputes kappa and ICC3 of the given properties from their totals.
+        """
+        labels = np.array(sorted(labels), dtype=np.int64)
+        if not len(labels):
+            return
+        order = np.argsort(self.values)  # kappa ranks labels by value
+        confusion = self.confusion[labels][:, order][:, :, order]
+        self.kappa[labels] = kappa_from_confusion(confusion, 'quadratic')
+
+        ms = mean_squares_from_sums(self.n[labels], self.total[labels], self.total_sq[labels],
+                                    self.target_sq[labels], self.rater_sums[labels], 2)
+        varies = np.array([len(self.distinct[0][l]) > 1 or len(self.distinct[1][l]) > 1 for l in labels])
+        self.icc[labels] = np.where(varies & (self.n_numeric[labels] > 0), icc_values(ms)['ICC3'], np.nan)
+
+    def set_cells(self, rater, targets, labels, values):
+        """
+        Replaces one rater's cells (parallel arrays of target and property
+        positions and new raw values) and updates the statistics they touch.
+        Returns the positions of the properties whose results changed.
+        """
+        scores = parse_numbers(values)
+        icc_scores = recode(scores, ICC_RECODING)
+        for t, l, value, score, icc_score in zip(targets, labels, values, scores, icc_scores):
+            self._pair(t, l, -1)
+
+            counter = self.distinct[rater][l]
+            old = _value_key(self.raw[rater, t, l])
+            counter[old] -= 1
+            if not counter[old]:
+                del counter[old]
+            counter[_value_key(value)] += 1
+
+            self.n_numeric[l] += int(not np.isnan(icc_score)) - int(not np.isnan(self.icc_scores[rater, t, l]))
+            self.raw[rater, t, l] = value
+            self.scores[rater, t, l] = score
+            self.icc_scores[rater, t, l] = icc_score
+            self.codes[rater, t, l] = self._code(score)
+
+            self._pair(t, l, 1)
+
+        touched = np.unique(np.asarray(labels, dtype=np.int64))
+        self._refresh(touched)
+        return touched
+
+    def update(self, df1, df2):
+        """
+        Folds re-read frames into the state, cell by changed cell.
+        Returns (number of changed cells, touched property positions), or
+        None when documents or properties differ and a rebuild is needed.
+        """
+        same_shape = (df1.index.equals(self.targets) and df2.index.equals(self.targets)
+                      and kappa_labels(df1.columns) == self.labels
+                      and pd.Index(self.labels).isin(df2.columns).all())
+        if not same_shape:
+            return None
+
+        n_changed, touched = 0, []
+        for rater, df in enumerate((df1, df2)):
+            new = df[self.labels].to_numpy(dtype=object)
+            old = self.raw[rater]
+            changed = ~((old == new) | (pd.isna(old) & pd.isna(new)))
+            targets, labels = np.nonzero(changed)
+            if len(targets):
+                touched.append(self.set_cells(rater, targets, labels, new[targets, labels]))
+                n_changed += len(targets)
+        return n_changed, np.unique(np.concatenate(touched)) if touched else np.array([], dtype=np.int64)
+
+    def results(self):
+        index = pd.Index(self.labels, name='Property')
+        return (pd.DataFrame({'Weighted_Kappa': self.kappa}, index=index),
+                pd.DataFrame({'ICC3': self.icc}, index=index))
+
+    def disagreements(self, top=TOP_DISAGREEMENTS):
+        """
+        The guidelines the raters disagree on most (largest summed squared
+        difference, then most properties), with the properties involved.
+        """
+        order = np.lexsort((-self.discord_count, -self.discord_sq))
+        order = order[self.discord_count[order] > 0][:top]
+        rows = []
+        for t in order:
+            s = self.scores[:, t]
+            differ = ~np.isnan(s).any(axis=0) & (s[0] != s[1])
+            rows.append({'Guideline': self.targets[t], 'Properties': int(self.discord_count[t]),
+                         'Squared_Difference': self.discord_sq[t],
+                         'Differing': ', '.join(str(self.labels[l]) for l in np.nonzero(differ)[0])})
+        return pd.DataFrame(rows, columns=['Guideline', 'Properties', 'Squared_Difference', 'Differing'])
+
+    def write(self, output_dir='.', top=TOP_DISAGREEMENTS, inputs=RATER_FILES):
+        """
+        Rewrites the kappa and ICC tables with the current point estimates,
+        keeping the confidence-interval columns kappa.py last wrote, stores
+        them as the 'kappa' and 'icc' statistics and saves the disagreement list.
+        """
+        for statistic, name, frame in zip(['kappa', 'icc'], [KAPPA_FILE, ICC_FILE], self.results()):
+            path = os.path.join(output_dir, name)
+            frame = _keep_intervals(path, frame)
+            frame.to_csv(path)
+            record(statistic, frame, inputs)
+        self.disagreements(top).to_csv(os.path.join(output_dir, DISAGREEMENTS_FILE), index=False)
+
+
+def _keep_intervals(path, frame):
+    """
+    frame plus the other columns of the table already at path (kappa.py's
+    bootstrap intervals), so a rewrite only replaces the point estimates.
+    """
+    if not os.path.exists(path):
+        return frame
+    try:
+        existing = pd.read_csv(path, index_col=0, float_precision='round_trip')
+    except (OSError, ValueError):
+        return frame
+    extra = existing.columns.difference(frame.columns, sort=False)
+    if not len(extra) or existing.index.has_duplicates:
+        return frame
+    return frame.join(existing[extra])
+
+
+def _stamps(filenames):
+    return [(os.stat(f).st_mtime_ns, os.stat(f).st_size) if os.path.exists(f) else None for f in filenames]
+
+
+def watch(filenames=RATER_FILES, output_dir='.', interval=1.0, top=TOP_DISAGREEMENTS, once=False):
+    """
+    Writes kappa, ICC (see IncrementalAgreement.write) and the disagreement list, then polls the workbooks and
+    rewrites them whenever a workbook is saved, folding in only the cells
+    that changed. Re-reading a saved workbook is the only full pass.
+    """
+    state = IncrementalAgreement(*common_documents(filenames))
+    state.write(output_dir, top, filenames)
+    print(f"Tracking {len(state.targets)} guidelines x {len(state.labels)} properties; "
+          f"wrote {KAPPA_FILE}, {ICC_FILE} and {DISAGREEMENTS_FILE}")
+    print(state.disagreements(top).to_string(index=False))
+    if once:
+        return state
+
+    stamps = _stamps(filenames)
+    while True:
+        time.sleep(interval)
+        current = _stamps(filenames)
+        if current == stamps:
+            continue
+        try:
+            df1, df2 = common_documents(filenames)
+        except Exception as e:  # e.g. a workbook caught halfway through saving
+            print(f"Could not read the workbooks yet ({e}); retrying")
+            continue
+        stamps = current
+
+        start = time.perf_counter()
+        before = state.kappa.copy(), state.icc.copy()
+        update = state.update(df1, df2)
+        if update is None:
+            print("Documents or properties changed; rebuilding")
+            state = IncrementalAgreement(df1, df2)
+            touched = []
+        else:
+            n_changed, touched = update
+            print(f"{n_changed} cells changed, statistics updated in {time.perf_counter() - start:.4f}s")
+        state.write(output_dir, top, filenames)
+
+        for l in touched:
+            print(f"  {state.labels[l]}: kappa {before[0][l]:.4f} -> {state.kappa[l]:.4f}, "
+                  f"ICC3 {before[1][l]:.4f} -> {state.icc[l]:.4f}")
+        print(state.disagreements(top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Keep kappa, ICC and the disagreement list current while the workbooks are edited.")
+    parser.add_argument('workbooks', nargs='*', default=RATER_FILES, help="The two raters' workbooks")
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--interval', type=float, default=1.0, help="Seconds between checks for saved workbooks")
+    parser.add_argument('--top', type=int, default=TOP_DISAGREEMENTS, help="Guidelines in the disagreement list")
+    parser.add_argument('--once', action='store_true', help="Write the outputs once and exit")
+    args = parser.parse_args()
+
+    if len(args.workbooks) != 2:
+        parser.error("expected two workbooks")
+    try:
+        watch(args.workbooks, args.output_dir, args.interval, args.top, args.once)
+    except KeyboardInterrupt:
+        pass
@@ -1,194 +1,97 @@
 import pandas as pd
-import numpy as np
-import sys
-
-
-def normalize_column_name(col):
-    try:
-        num = float(col)
-        # If it's an integer like 4.0 → store as int
-        if num.is_integer():
-            return int(num)
-        return num
-    except:
-        # Not numeric → keep as string
-        return str(col)
-    
-def normalize_value(v):
-    try:
-        num = float(v)
-        if num.is_integer():
-            return str(int(num))   # "4.0" → "4"
-        return str(num)            # "4.5" → "4.5"
-    except:
-        return str(v).strip() 
-    
-r1 = pd.read_excel("Validation Study_Sophie.xlsx")
-r1.set_index(r1.columns[0], inplace=True)
 
-r2 = pd.read_excel("CN_processed.xlsx")
-r2.set_index(r2.columns[0], inplace=True)
-
-r1.columns = [normalize_column_name(c) for c in r1.columns]
-r2.columns = [normalize_column_name(c) for c in r2.columns]
-
-
-# Combine unique columns from both
-all_cols = set(r1.columns).union(r2.columns)
-
-df = pd.DataFrame(index=r1.index)  # start empty with same index
-
-for col in all_cols:
-    if col in r1.columns:
-        if r1[col].astype(str).str.isnumeric().all():
-            r1[col] = pd.to_numeric(r1[col])
-
-    if col in r2.columns:
-        if r2[col].astype(str).str.isnumeric().all():
-            r2[col] = pd.to_numeric(r2[col])
-    if col in r1.columns and col in r2.columns:
-        # Average only where both are numeric
-        df[col] = r1[col].combine(
-            r2[col], lambda a, b: np.nanmean([pd.to_numeric(a, errors="coerce"), pd.to_numeric(b, errors="coerce")])
-            if pd.notna(a) or pd.notna(b)
-            else np.nan
-            )
-
-    elif col in r1.columns:
-        df[col] = r1[col]
-    else:
-        df[col] = r2[col]
-
-#df.to_csv("full.csv")
-
-df_groups = {letter: df[[c for c in df.columns if c.startswith(letter)]]
-              for letter in df.columns.str[0].unique()}
-
-desired_cols = ['1','1.5','2','2.5','3','3.5','4','4.5']
-
-# Compute frequencies within each group
-freqs_by_group = {}
-for letter, subdf in df_groups.items():
-    freq_df = (
-        subdf.apply(
-            lambda row: row.apply(normalize_value).value_counts(),
-            axis=1
-        )
-        .fillna(0)
-    )
-    # Add missing desired columns
-    for col in desired_cols:
-        if col not in freq_df.columns:
-            freq_df[col] = 0
-    freq_df = freq_df[desired_cols] 
-    freqs_by_group[letter] = freq_df
-print("Frequencies for group V:")
-print(freqs_by_group['V'])
-
-freqs_by_group['V'].to_csv('vis_frequencies.csv')
-
-print("Frequencies for group C:")
-print(freqs_by_group['C'])
-
-freqs_by_group['C'].to_csv('forum_frequencies.csv')
-
-print("Frequencies for group W:")
-print(freqs_by_group['W'])
-
-freqs_by_group['W'].to_csv('blog_frequencies.csv')
-
-print("Frequencies for group B:")
-print(freqs_by_group['B'])
-
-freqs_by_group['B'].to_csv('book_frequencies.csv')
-
-
-rows_to_compare = freqs_by_group['V'].index  # Assuming all have the same rows
-
-# Optional: combine into one dictionary for easy looping
-dfs = {'VIS': freqs_by_group['V'], 'FORUM': freqs_by_group['C'], 'WEB': freqs_by_group['W'], 'BOOKS': freqs_by_group['B']}
-
-normalized_dfs = {}
-for name, df in dfs.items():
-    df.columns = pd.to_numeric(df.columns, errors='coerce')
-
-    df.dropna(axis=1)
-    norm_df = df.div(df.sum(axis=1), axis=0)
-    normalized_dfs[name] = norm_df.fillna(0)  # replace NaNs with 0
-
-    print(f"{name} normalized, columns used: {df.columns.tolist()}")
-    print(norm_df.head())
-
-
-import matplotlib
-matplotlib.use('Agg')  # avoid GUI issues
-import matplotlib.pyplot as plt
-import os
-
-
-# Prepare output folder
-output_folder = 'row_distributions'
-os.makedirs(output_folder, exist_ok=True)
-
-# Plot all rows
-def numeric_columns(df):
-    return [c for c in df.columns if isinstance(c, (int, float))]
-
-output_folder = 'row_distributions'
-
-# ---- PLOT FOR EACH ROW ----
-for row_name in dfs["VIS"].index:  # assume same index across all dfs
-    plt.figure(figsize=(8, 5))
-
-    for label, df in dfs.items():
-        num_cols = numeric_columns(df)
-        plt.plot(num_cols, df.loc[row_name, num_cols], marker="o", label=label)
-
-    plt.title(f"Scores for: {row_name}")
-    plt.xlabel("Rating")
-    plt.ylabel("Frequency")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    
-    safe_name = "".join(c for c in str(row_name) if c.isalnum() or c in (" ", "_")).rstrip()
-    file_path = os.path.join(output_folder, f"{safe_name}.png")
-
-    plt.savefig(file_path, dpi=150)
-    plt.close()   # close figure to prevent memory buildup
-
-    print(f"Saved: {file_path}")
-
-
-
-# Example: freqs_by_group = {'VIS': df_vis, 'FORUM': df_forum, ...}
-
-# Compute row averages per dataset
-row_avg_by_dataset = {}
-for name, df in freqs_by_group.items():
-    # Ensure numeric columns only
-    numeric_cols = [c for c in df.columns if isinstance(c, (int, float))]
-    
-    # Compute row-wise average
-    row_avg = df[numeric_cols].multiply(df[numeric_cols].columns, axis=1).sum(axis=1) / df[numeric_cols].sum(axis=1)
-    row_avg_by_dataset[name] = row_avg
-
-# Combine into a single DataFrame
-avg_df = pd.DataFrame(row_avg_by_dataset)
-
-avg_df = avg_df.loc[(avg_df != 0).any(axis=1)]
-avg_df = avg_df.dropna(how='all')
-# Compute average across all datasets
-avg_df['Overall'] = avg_df.mean(axis=1)
-
-# Plot bar chart
-plt.figure(figsize=(10, 6))
-avg_df['Overall'].plot(kind='bar')
-plt.ylabel("Average Rating")
-plt.xlabel("Row / Item")
-plt.title("Average Rating per Code Across All Guidelines")
-plt.xticks(rotation=45, ha='right')
-plt.tight_layout()
-#plt.show()
-
-plt.savefig('averages.png', dpi=150)
\ No newline at end of file
+import profiler
+from coding_cache import load_workbooks
+from id_index import source_letters, unify_ids
+from normalize import parse_labels
+from rater_merge import merge_raters
+from rating_hist import average_table, frequency_table, group_rating_counts, normalized
+from results_store import record
+from row_plots import plot_averages, render_rows
+
+RATER_FILES = ["Validation Study_Sophie.xlsx", "CN_processed.xlsx"]
+DESIRED_CODES = range(2, 10)  # 1, 1.5, ..., 4.5
+
+# Output name, frequency file and group letter of each source
+SOURCES = {'VIS': ('vis_frequencies.csv', 'V'), 'FORUM': ('forum_frequencies.csv', 'C'),
+           'WEB': ('blog_frequencies.csv', 'W'), 'BOOKS': ('book_frequencies.csv', 'B')}
+
+
+@profiler.timed
+def load_merged(filenames=RATER_FILES):
+    """
+    Properties x Documents frame of all raters, averaged where they overlap;
+    single-rater documents are kept as-is. Spellings of one document ID
+    ('VIS-6: VIS-GL-15', 'VIS-6 : VIS-GL-15') become the first one seen;
+    a document repeated within one workbook keeps its first column.
+    """
+    coded = load_workbooks(filenames)
+    frames = []
+    for df, ids in zip(coded, unify_ids([df.index for df in coded])):
+        r = df.T
+        r.columns = parse_labels(ids)
+        frames.append(r.loc[:, ~r.columns.duplicated()])
+    return merge_raters(frames)
+
+
+@profiler.timed
+def write_frequencies(df, inputs=RATER_FILES):
+    """
+    Half-point rating counts for every source group in one pass (Groups x
+    Properties x Codes); prints and saves each source's frequency table,
+    and stores them together as the 'frequencies' statistic.
+    Returns (counts, group letters, {source name: frequency table}).
+    """
+    counts, letters = group_rating_counts(df, source_letters(df.columns))
+    freqs_by_group = {letter: frequency_table(counts[g], df.index, DESIRED_CODES)
+                      for g, letter in enumerate(letters)}
+
+    for file_name, letter in SOURCES.values():
+        print(f"Frequencies for group {letter}:")
+        print(freqs_by_group[letter])
+
+        freqs_by_group[letter].to_csv(file_name)
+
+    dfs = {name: freqs_by_group[letter] for name, (_, letter) in SOURCES.items()}
+    record('frequencies', pd.concat(dfs, names=['Source', 'Property']), inputs)
+    return counts, letters, dfs
+
+
+def normalized_tables(counts, letters, dfs):
+    normalized_dfs = {}
+    for name, df in dfs.items():
+        df.columns = pd.to_numeric(df.columns, errors='coerce')
+
+        group_counts = counts[letters.index(SOURCES[name][1])][:, DESIRED_CODES]
+        norm_df = pd.DataFrame(normalized(group_counts), index=df.index, columns=df.columns)
+        normalized_dfs[name] = norm_df.fillna(0)  # replace NaNs with 0
+
+        print(f"{name} normalized, columns used: {df.columns.tolist()}")
+        print(norm_df.head())
+    return normalized_dfs
+
+
+def write_averages(counts, letters, index, file_path='averages.png'):
+    """
+    Row averages per source, plus their mean across all sources, as a bar chart.
+    """
+    avg_df = average_table(counts, letters, index, DESIRED_CODES)
+    plot_averages(avg_df, file_path)
+    return avg_df
+
+
+if __name__ == "__main__":
+    df = load_merged()
+
+    df.to_csv("full.csv")  # input of correl.py
+
+    counts, letters, dfs = write_frequencies(df)
+
+    normalized_dfs = normalized_tables(counts, letters, dfs)
+
+    # ---- PLOT FOR EACH ROW ----
+    # Only rows whose counts changed since the last run are redrawn, in parallel
+    render_rows(dfs, 'row_distributions')
+
+    rows_to_compare = dfs['VIS'].index  # Assuming all have the same rows
+    write_averages(counts, letters, rows_to_compare, 'averages.png')
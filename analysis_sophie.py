@@ -1,100 +1,97 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
+from coding_cache import load_workbooks
+from coding_matrix import CodingMatrix
+from contingency import association_tests, contingency_tensor, source_table
+from results_store import record
 
-def load_and_transpose(filename, label):
+def load_coders(filenames, names):
     """
-    Loads an Excel file and transposes it so Rows=Documents and Columns=Properties.
-    Does NOT filter by intersection, preserving all data in the file.
+    Loads each coder's Excel file (all of its documents, no intersection)
+    into one CodingMatrix.
     """
-    print(f"Loading {label} data from {filename}...")
+    for filename, label in zip(filenames, names):
+        print(f"Loading {label} data from {filename}...")
     try:
-        df = pd.read_excel(filename)
-    except FileNotFoundError:
-        print(f"Error: Could not find {filename}")
+        frames = load_workbooks(filenames)
+    except FileNotFoundError as e:
+        print(f"Error: Could not find {e.filename}")
         return None
 
-    df_T = df.T
-    df_T.columns = df_T.iloc[0]
-    df_T = df_T[1:].reset_index()
-    df_T.rename(columns={'index': 'DocID'}, inplace=True)
-    
-    return df_T
+    return CodingMatrix.from_frames(frames, names)
 
-def get_pivot_data(df, target_col="Goal of articulation"):
+def get_pivot_data(matrix, counts, target_col="Goal of articulation"):
     """
-    Creates a count matrix (Source Type vs Goal).
+    Source Type vs category count matrix of every coder, all sharing the
+    same sources and categories, sliced from the contingency tensor.
     """
-    if target_col not in df.columns:
+    if target_col not in matrix.categorical_names:
         print(f"Warning: '{target_col}' not found in data.")
         return None
 
-    df['SourceType'] = df['DocID'].astype(str).str[0].str.upper()
-
-    name_map = {
-        'V': 'VIS Papers',
-        'B': 'Books',
-        'C': 'Crowdsourced',
-        'W': 'Web Blogs'
-    }
-    df['SourceName'] = df['SourceType'].map(name_map)
+    return {coder: source_table(matrix, counts, target_col, coder) for coder in matrix.raters}
 
-    pivot = pd.crosstab(df['SourceName'], df[target_col])
-    
-    return pivot
+def generate_aligned_chart(matrix, counts, target_col="Goal of articulation", filename="combined_goals_chart.png",
+                           legend_title="Goal of Articulation"):
+    import matplotlib.pyplot as plt
 
-def generate_aligned_chart(df1, df2, name1="Sophie", name2="Cat"):
     print("Aligning data and generating chart...")
 
-    pivot1 = get_pivot_data(df1)
-    pivot2 = get_pivot_data(df2)
+    pivots = get_pivot_data(matrix, counts, target_col)
 
-    if pivot1 is None or pivot2 is None:
+    if pivots is None:
         return
 
-    all_goals = sorted(list(set(pivot1.columns) | set(pivot2.columns)))
-    
-    all_sources = ['VIS Papers', 'Books', 'Crowdsourced', 'Web Blogs']
-
-    pivot1 = pivot1.reindex(index=all_sources, columns=all_goals, fill_value=0)
-    pivot2 = pivot2.reindex(index=all_sources, columns=all_goals, fill_value=0)
-
-
-    fig, axes = plt.subplots(1, 2, figsize=(14, 6), sharey=True)
+    fig, axes = plt.subplots(1, len(pivots), figsize=(7 * len(pivots), 6), sharey=True, squeeze=False)
+    axes = axes[0]
     
     cmap = 'tab20' 
 
-    # Plot 1: Sophie
-    pivot1.plot(kind='bar', stacked=True, ax=axes[0], colormap=cmap, 
-                edgecolor='black', linewidth=0.5, legend=False)
-    axes[0].set_title(f"Coder: {name1}", fontsize=14)
-    axes[0].set_xlabel("")
+    # One panel per coder
+    for i, (coder, pivot) in enumerate(pivots.items()):
+        pivot.plot(kind='bar', stacked=True, ax=axes[i], colormap=cmap, 
+                   edgecolor='black', linewidth=0.5, legend=False)
+        axes[i].set_title(f"Coder: {coder}", fontsize=14)
+        axes[i].set_xlabel("")
+        axes[i].tick_params(axis='x', rotation=0)
+        axes[i].grid(axis='y', linestyle='--', alpha=0.3)
     axes[0].set_ylabel("Number of Documents", fontsize=12)
-    axes[0].tick_params(axis='x', rotation=0)
-    axes[0].grid(axis='y', linestyle='--', alpha=0.3)
-
-    # Plot 2: Cat
-    pivot2.plot(kind='bar', stacked=True, ax=axes[1], colormap=cmap, 
-                edgecolor='black', linewidth=0.5, legend=False)
-    axes[1].set_title(f"Coder: {name2}", fontsize=14)
-    axes[1].set_xlabel("")
-    axes[1].tick_params(axis='x', rotation=0)
-    axes[1].grid(axis='y', linestyle='--', alpha=0.3)
 
     handles, labels = axes[0].get_legend_handles_labels()
     
-    fig.legend(handles, labels, title="Goal of Articulation", 
+    fig.legend(handles, labels, title=legend_title, 
                loc='center right', bbox_to_anchor=(1.12, 0.5))
 
     plt.tight_layout()
     
-    filename = "combined_goals_chart.png"
     plt.savefig(filename, dpi=150, bbox_inches='tight')
+    plt.close(fig)
     print(f"Saved chart to {filename}")
 
 if __name__ == "__main__":
-    df_sophie = load_and_transpose("Validation Study_Sophie - UPDATED.xlsx", "Sophie")
-    df_cat = load_and_transpose("v3_CN_processed.xlsx", "Cat")
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Categorical fields by source type, per coder, with association tests.")
+    parser.add_argument('--all-fields', action='store_true',
+                        help="Also chart every other categorical field into category_charts/")
+    args = parser.parse_args()
+
+    filenames = ["Validation Study_Sophie - UPDATED.xlsx", "v3_CN_processed.xlsx"]
+    matrix = load_coders(filenames, ["Sophie", "Cat"])
     
-    if df_sophie is not None and df_cat is not None:
-        generate_aligned_chart(df_sophie, df_cat)
\ No newline at end of file
+    if matrix is not None:
+        # Coder x Source x Category counts of every categorical field in one pass
+        counts = contingency_tensor(matrix)
+        generate_aligned_chart(matrix, counts)
+
+        tests = association_tests(matrix, counts)
+        print(tests[tests['Property'] == "Goal of articulation"].to_string(index=False))
+        tests.to_csv("categorical_tests.csv", index=False)
+        record('categorical_tests', tests, filenames)
+        print("Saved tests for every categorical field to categorical_tests.csv")
+
+        if args.all_fields:
+            os.makedirs("category_charts", exist_ok=True)
+            for field, categories in zip(matrix.categorical_names, matrix.categories):
+                if field != "Goal of articulation" and categories:
+                    name = "".join(c for c in field if c.isalnum() or c in " _").strip().replace(" ", "_")
+                    generate_aligned_chart(matrix, counts, field, os.path.join("category_charts", f"{name}.png"), field)
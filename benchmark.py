@@ -0,0 +1,381 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_FILE = os.path.join(REPO_DIR, 'benchmark_history.json')
+REGRESSION_THRESHOLD = 0.2  # flag stages more than 20% slower than the last comparable run
+
+INDEX_NAME = 'Document ID : Guideline ID'
+SOURCES = {'VIS': 27, 'BK': 10, 'CS': 16, 'WB': 20}  # prefix -> relative share, as in the real workbooks
+PROPERTIES = ['Intuition-building', 'Clearly Articulated', 'Credible', 'Scoped', 'Trade-Offs', 'Strictness',
+              'Actionable', 'Discoverable', 'Relationships', 'Updateable', 'Permanence']
+ELEMENTS = ['Example Present', 'Counter-example Present', 'Slogan Present', 'Action Present']
+GOALS = ['Comprehensive guidance text', 'Rule of thumb', 'Checklist item']
+EXAMPLE_TEXT = ['Example', 'Counter-example', 'Slogan', 'Generic Text', 'Action or Instruction']
+
+# File names the scripts read; rater 0 and 1 are written under all of their aliases
+RATER_FILES = [
+    ['SS_Updated_Coding.xlsx', 'Validation Study_Sophie.xlsx'],
+    ['CN_Updated_Coding.xlsx', 'CN_processed.xlsx', 'CN_processed_FIXED.xlsx'],
+]
+
+PRESETS = {
+    'small': {'n_documents': 12, 'guidelines_per_document': 6, 'n_properties': 11, 'n_raters': 2},
+    'medium': {'n_documents': 120, 'guidelines_per_document': 8, 'n_properties': 20, 'n_raters': 3},
+    'large': {'n_documents': 600, 'guidelines_per_document': 10, 'n_properties': 40, 'n_raters': 5},
+}
+DEFAULTS = {
+    'rating_probs': [0.05, 0.1, 0.2, 0.3, 0.35],  # P(1..5) of the latent rating
+    'half_point_rate': 0.1,  # share of ratings a rater gives between two grades
+    'disagreement': 0.3,  # chance a rater moves a full point away from the latent rating
+    'missing_rate': 0.05,
+    'element_rate': 0.6,  # P(Y) for the element columns
+    'seed': 0,
+}
+
+
+def document_ids(n_documents, guidelines_per_document, rng):
+    """
+    'VIS-3 : VIS-GL-2' style IDs, sources drawn with the real workbooks' mix.
+    """
+    prefixes = list(SOURCES)
+    weights = np.array(list(SOURCES.values()), dtype=float)
+    sources = rng.choice(prefixes, size=n_documents, p=weights / weights.sum())
+    # analysis.py writes one frequency file per source, so every source gets a document while there are enough
+    for prefix in [p for p in prefixes if p not in sources]:
+        counts = {p: int((sources == p).sum()) for p in prefixes}
+        common = max(counts, key=counts.get)
+        if counts[common] < 2:
+            break
+        sources[np.flatnonzero(sources == common)[-1]] = prefix
+    numbers = {p: 0 for p in prefixes}
+    ids = []
+    for source in sources:
+        numbers[source] += 1
+        ids += [f"{source}-{numbers[source]} : {source}-GL-{g}" for g in range(1, guidelines_per_document + 1)]
+    return ids
+
+
+def property_names(n_properties):
+    extra = [f"Property-{i}" for i in range(len(PROPERTIES) + 1, n_properties + 1)]
+    return (PROPERTIES + extra)[:n_properties]
+
+
+def generate_coding(n_documents=12, guidelines_per_document=6, n_properties=11, n_raters=2,
+                    rating_probs=DEFAULTS['rating_probs'], half_point_rate=DEFAULTS['half_point_rate'],
+                    disagreement=DEFAULTS['disagreement'], missing_rate=DEFAULTS['missing_rate'],
+                    element_rate=DEFAULTS['element_rate'], seed=DEFAULTS['seed']):
+    """
+    Synthetic coding workbooks, one Properties x Documents frame per rater,
+    laid out like the real ones: goal row, ratings, EX: rows, Y/N element
+    rows and 'Other Elements'. Raters share a latent rating per cell and
+    each deviates from it by half or full points.
+    """
+    rng = np.random.default_rng(seed)
+    ids = document_ids(n_documents, guidelines_per_document, rng)
+    props = property_names(n_properties)
+    n = len(ids)
+
+    latent = rng.choice(np.arange(1, 6), size=(len(props), n), p=rating_probs)
+    latent_elements = rng.random((len(ELEMENTS), n)) < element_rate
+
+    frames = []
+    for _ in range(n_raters):
+        ratings = latent.astype(float)
+        full = rng.random(ratings.shape) < disagreement
+        ratings += np.where(full, rng.choice([-1.0, 1.0], size=ratings.shape), 0.0)
+        half = rng.random(ratings.shape) < half_point_rate
+        ratings += np.where(half, rng.choice([-0.5, 0.5], size=ratings.shape), 0.0)
+        ratings = np.clip(ratings, 1, 5)
+
+        # Whole grades are stored as ints and half points as floats, like the workbooks
+        cells = ratings.astype(object)
+        whole = ratings == np.round(ratings)
+        cells[whole] = ratings[whole].astype(int)
+        cells[rng.random(ratings.shape) < missing_rate] = np.nan
+
+        flips = rng.random(latent_elements.shape) < disagreement / 2
+        elements = np.where(latent_elements ^ flips, 'Y', 'N').astype(object)
+
+        examples = rng.choice(EXAMPLE_TEXT, size=(len(props), n)).astype(object)
+        examples[rng.random(examples.shape) < 0.5] = np.nan
+
+        rows = ([rng.choice(GOALS, size=n).astype(object)] + list(cells) + list(examples) + list(elements)
+                + [np.full(n, np.nan, dtype=object)])
+        index = (['Goal of articulation'] + props + [f"EX: {p}" for p in props] + ELEMENTS + ['Other Elements'])
+        frames.append(pd.DataFrame(rows, index=pd.Index(index, name=INDEX_NAME), columns=ids))
+    return frames
+
+
+def write_workbooks(frames, folder):
+    """
+    Writes each rater's frame as a workbook under the file names the scripts use.
+    Returns the paths, one list per rater.
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for r, frame in enumerate(frames):
+        names = RATER_FILES[r] if r < len(RATER_FILES) else [f"coder_{r + 1}.xlsx"]
+        first = os.path.join(folder, names[0])
+        frame.reset_index().to_excel(first, index=False)
+        for alias in names[1:]:
+            shutil.copyfile(first, os.path.join(folder, alias))
+        paths.append([os.path.join(folder, name) for name in names])
+    return paths
+
+
+# ---- Stages: each runs the code path of one script on the workbooks in the cwd ----
+
+def stage_load(ctx):
+    from coding_cache import load_coding
+
+    ctx['coded'] = [load_coding(paths[0], cache_dir=ctx['cache_dir']) for paths in ctx['paths']]
+
+
+def stage_merge_frequencies(ctx):
+    """
+    analysis.py: merge the raters, frequency tables per source, averages.
+    """
+    import analysis
+
+    df = analysis.load_merged()
+    df.to_csv('full.csv')
+    counts, letters, dfs = analysis.write_frequencies(df)
+    analysis.normalized_tables(counts, letters, dfs)
+    analysis.write_averages(counts, letters, df.index)
+    ctx['tables'] = dfs
+
+
+def stage_icc(ctx):
+    import kappa
+
+    df1, df2 = kappa.data_preprocess()
+    kappa.icc_analysis(df1, df2, ctx['n_boot'], 0, 1)
+
+
+def stage_weighted_kappa(ctx):
+    import kappa
+
+    df1, df2 = kappa.data_preprocess()
+    kappa.weighted_kappa_analysis(df1, df2, ctx['n_boot'], 0, 1)
+
+
+def stage_elements(ctx):
+    import irr_elements
+
+    df1, df2 = irr_elements.load_and_preprocess("Validation Study_Sophie.xlsx", "CN_processed_FIXED.xlsx")
+    irr_elements.calculate_binary_kappa(df1, df2, ctx['n_boot'], 0, 1)
+
+
+def stage_reliability(ctx):
+    from reliability import reliability_table
+
+    reliability_table(ctx['coded'])
+
+
+def stage_mca(ctx):
+    """
+    correl.py's filtering of full.csv, then mcaCalc.py's MCA fit (uncached).
+    """
+    from correl import filter_properties, load_full
+    from mca import SparseMCA
+
+    df = filter_properties(load_full())
+    model = SparseMCA(n_components=3, n_iter=3, random_state=42).fit(df)
+    model.transform(df)
+    model.column_coordinates()
+
+
+def stage_row_plots(ctx):
+    from row_plots import render_rows
+
+    folder = 'row_distributions'
+    shutil.rmtree(folder, ignore_errors=True)
+    render_rows(ctx['tables'], folder, n_jobs=ctx['jobs'])
+
+
+STAGES = {
+    'load': stage_load,
+    'merge_frequencies': stage_merge_frequencies,
+    'icc': stage_icc,
+    'weighted_kappa': stage_weighted_kappa,
+    'elements': stage_elements,
+    'reliability': stage_reliability,
+    'mca': stage_mca,
+    'row_plots': stage_row_plots,
+}
+# Stages that leave data in ctx for later ones
+REQUIRES = {'reliability': 'load', 'mca': 'merge_frequencies', 'row_plots': 'merge_frequencies'}
+
+
+def _timed(func, ctx, trace=False):
+    """
+    Runs one stage with its output silenced. Returns (seconds, peak traced MB or None).
+    """
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(ctx)
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def run_benchmarks(config, stages=None, repeat=3, n_boot=200, jobs=1, workdir=None):
+    """
+    Generates the synthetic workbooks for config, then times every stage
+    (best of `repeat`) and measures its peak Python/NumPy allocation in one
+    more traced run. The row plots' worker processes are not traced.
+    Returns {stage: {'seconds': ..., 'peak_mb': ...}}.
+    """
+    stages = [s for s in STAGES if stages is None or s in stages]
+    for stage in list(stages):
+        need = REQUIRES.get(stage)
+        if need and need not in stages:
+            stages.insert(stages.index(stage), need)
+
+    own_dir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='coding_bench_')
+    old_cwd = os.getcwd()
+    try:
+        frames = generate_coding(**config)
+        paths = write_workbooks(frames, workdir)
+        os.chdir(workdir)
+        ctx = {'paths': paths, 'n_boot': n_boot, 'jobs': jobs, 'cache_dir': '.coding_cache'}
+
+        results = {}
+        for stage in stages:
+            func = STAGES[stage]
+            if stage == 'load':
+                shutil.rmtree(ctx['cache_dir'], ignore_errors=True)  # time the cold parse
+            times = []
+            for _ in range(repeat):
+                times.append(_timed(func, ctx)[0])
+                if stage == 'load':
+                    shutil.rmtree(ctx['cache_dir'], ignore_errors=True)
+            _, peak = _timed(func, ctx, trace=True)
+            results[stage] = {'seconds': min(times), 'peak_mb': peak}
+            print(f"  {stage:<18} {min(times):9.4f}s  peak {peak:9.2f} MB")
+        return results
+    finally:
+        os.chdir(old_cwd)
+        if own_dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip() != ''
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def load_history(path=HISTORY_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+
+
+def compare_to_previous(history, entry, threshold=REGRESSION_THRESHOLD):
+    """
+    Stages slower than the latest earlier run with the same preset, config
+    and n_boot by more than threshold: {stage: (old seconds, new seconds)}.
+    """
+    previous = [h for h in history if (h['preset'], h['config'], h['n_boot'])
+                == (entry['preset'], entry['config'], entry['n_boot'])]
+    if not previous:
+        return {}
+    last = previous[-1]['results']
+    slower = {}
+    for stage, res in entry['results'].items():
+        if stage in last and res['seconds'] > last[stage]['seconds'] * (1 + threshold):
+            slower[stage] = (last[stage]['seconds'], res['seconds'])
+    return slower
+
+
+def record(entry, path=HISTORY_FILE):
+    history = load_history(path)
+    slower = compare_to_previous(history, entry)
+    history.append(entry)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(path + '.tmp', path)
+    return slower
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time the analysis stages on synthetic coding workbooks.")
+    parser.add_argument('--preset', choices=list(PRESETS), default='small')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), help="Default: all")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--n-boot', type=int, default=200, help="Bootstrap resamples in the kappa/ICC stages")
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes for the row plots")
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--no-record', action='store_true', help="Do not append to the history")
+    parser.add_argument('--generate-only', metavar='DIR', help="Only write the synthetic workbooks to DIR")
+    for key in ['n_documents', 'guidelines_per_document', 'n_properties', 'n_raters']:
+        parser.add_argument(f"--{key.replace('_', '-')}", type=int, help="Override the preset")
+    for key in ['half_point_rate', 'disagreement', 'missing_rate', 'element_rate']:
+        parser.add_argument(f"--{key.replace('_', '-')}", type=float)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    config = dict(PRESETS[args.preset])
+    for key in list(DEFAULTS) + list(config):
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+        else:
+            config.setdefault(key, DEFAULTS.get(key))
+
+    if args.generate_only:
+        paths = write_workbooks(generate_coding(**config), args.generate_only)
+        print("Wrote " + ", ".join(p[0] for p in paths))
+        sys.exit(0)
+
+    sys.path.insert(0, REPO_DIR)
+    print(f"Benchmarking preset '{args.preset}': {config}")
+    results = run_benchmarks(config, args.stages, args.repeat, args.n_boot, args.jobs)
+
+    commit, dirty = git_revision()
+    entry = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'dirty': dirty,
+        'preset': args.preset,
+        'config': config,
+        'n_boot': args.n_boot,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'results': results,
+    }
+    if not args.no_record:
+        slower = record(entry, args.history)
+        for stage, (old, new) in slower.items():
+            print(f"REGRESSION {stage}: {old:.4f}s -> {new:.4f}s")
+        print(f"Appended to {args.history}")
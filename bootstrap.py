@@ -0,0 +1,128 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import special
+
+import profiler
+
+N_BOOT = 2000
+CHUNK_SIZE = 250
+
+
+def resample_weights(n_units, size, seed_seq):
+    """
+    Draws `size` bootstrap resamples of n_units units and returns them as a
+    Resamples x Units matrix of multiplicities (how often each unit was drawn).
+    """
+    rng = np.random.default_rng(seed_seq)
+    picks = rng.integers(0, n_units, size=(size, n_units))
+    rows = np.repeat(np.arange(size), n_units)
+    counts = np.bincount(rows * n_units + picks.ravel(), minlength=size * n_units)
+    return counts.reshape(size, n_units).astype(float)
+
+
+def jackknife_weights(n_units):
+    """
+    Leave-one-out weights: row i drops unit i.
+    """
+    return 1.0 - np.eye(n_units)
+
+
+def _run_chunk(task):
+    statistic, data, n_units, size, seed_seq = task
+    return statistic(data, resample_weights(n_units, size, seed_seq))
+
+
+@profiler.timed
+def bootstrap_replicates(statistic, data, n_units, n_boot=N_BOOT, seed=0, n_jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    Evaluates statistic(data, weights) on n_boot resamples, chunk by chunk.
+    statistic gets a Resamples x Units weight matrix and must return one row
+    per resample (e.g. Resamples x Properties), so every property is done in
+    the same pass. Each chunk has its own child seed spawned from `seed`, so
+    the replicates are identical whatever n_jobs is.
+    """
+    sizes = [min(chunk_size, n_boot - start) for start in range(0, n_boot, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(statistic, data, n_units, size, s) for size, s in zip(sizes, seeds)]
+
+    if n_jobs == 1:
+        results = [_run_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_run_chunk, tasks))
+    profiler.count('bootstrap resamples', n_boot)
+    return np.concatenate(results, axis=0)
+
+
+def percentile_interval(replicates, alpha=0.05):
+    """
+    Percentile CI per column, ignoring NaN replicates.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns
+        low, high = np.nanquantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+    return low, high
+
+
+def _column_quantiles(replicates, probs):
+    """
+    Quantile of each column at its own probability (NaNs ignored, linear interpolation).
+    """
+    ordered = np.sort(replicates, axis=0)  # NaNs sort last
+    valid = (~np.isnan(replicates)).sum(axis=0)
+    pos = probs * (valid - 1)
+    lo = np.clip(np.floor(pos), 0, None).astype(int)
+    hi = np.clip(np.ceil(pos), 0, None).astype(int)
+    lo_val = np.take_along_axis(ordered, lo[None, :], axis=0)[0]
+    hi_val = np.take_along_axis(ordered, hi[None, :], axis=0)[0]
+    out = lo_val + (pos - lo) * (hi_val - lo_val)
+    return np.where(valid > 0, out, np.nan)
+
+
+def bca_interval(replicates, estimate, jackknife, alpha=0.05):
+    """
+    Bias-corrected and accelerated CI per column. jackknife holds the
+    leave-one-out estimates (Units x Columns) used for the acceleration.
+    Columns where the bias correction is undefined (every replicate on one
+    side of the estimate) are NaN.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valid = ~np.isnan(replicates)
+        below = ((replicates < estimate) & valid).sum(axis=0) / valid.sum(axis=0)
+        z0 = special.ndtri(below)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns
+            d = np.nanmean(jackknife, axis=0) - jackknife
+        acc = np.nansum(d ** 3, axis=0) / (6 * np.nansum(d ** 2, axis=0) ** 1.5)
+        acc = np.where(np.isfinite(acc), acc, 0.0)
+
+        bounds = []
+        for z in special.ndtri([alpha / 2, 1 - alpha / 2]):
+            probs = special.ndtr(z0 + (z0 + z) / (1 - acc * (z0 + z)))
+            ok = np.isfinite(z0) & np.isfinite(probs)
+            q = _column_quantiles(replicates, np.where(ok, probs, 0.5))
+            bounds.append(np.where(ok, q, np.nan))
+    return bounds[0], bounds[1]
+
+
+def confidence_intervals(statistic, data, n_units, estimate, n_boot=N_BOOT, seed=0,
+                         n_jobs=1, alpha=0.05, chunk_size=CHUNK_SIZE):
+    """
+    Percentile and BCa intervals for every column of a vectorized statistic.
+    Returns a DataFrame with pct_low, pct_high, bca_low and bca_high columns.
+    """
+    replicates = bootstrap_replicates(statistic, data, n_units, n_boot, seed, n_jobs, chunk_size)
+    jackknife = statistic(data, jackknife_weights(n_units))
+
+    pct_low, pct_high = percentile_interval(replicates, alpha)
+    bca_low, bca_high = bca_interval(replicates, np.asarray(estimate, dtype=float), jackknife, alpha)
+    return pd.DataFrame({
+        'pct_low': pct_low,
+        'pct_high': pct_high,
+        'bca_low': bca_low,
+        'bca_high': bca_high,
+    })
@@ -0,0 +1,314 @@
+import argparse
+import importlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = os.path.join(tempfile.gettempdir(), f'coding-cli-{os.getuid()}.sock')
+STATUS_MARK = b'\0'  # separates a worker's output from the exit status it ends with
+
+
+def _bootstrap_defaults(args):
+    if args.n_boot is None:
+        from bootstrap import N_BOOT
+        args.n_boot = N_BOOT
+    return args
+
+
+def run_merge(args):
+    from analysis import load_merged
+
+    df = load_merged(args.workbooks)
+    df.to_csv(args.output)
+    print(f"Saved {df.shape[1]} documents x {df.shape[0]} properties to '{args.output}'")
+
+
+def run_freq(args):
+    from analysis import load_merged, write_averages, write_frequencies
+
+    df = load_merged(args.workbooks)
+    counts, letters, dfs = write_frequencies(df, args.workbooks)
+    write_averages(counts, letters, dfs['VIS'].index, args.averages)
+    print(f"Saved frequencies and '{args.averages}'")
+
+
+def run_plots(args):
+    from analysis import load_merged, normalized_tables, write_frequencies
+    from row_plots import render_rows
+
+    df = load_merged(args.workbooks)
+    counts, letters, dfs = write_frequencies(df, args.workbooks)
+    normalized_tables(counts, letters, dfs)
+    render_rows(dfs, args.output_dir, args.jobs)
+
+
+def run_kappa(args):
+    from kappa import data_preprocess, weighted_kappa_analysis
+
+    args = _bootstrap_defaults(args)
+    df1, df2 = data_preprocess()
+    weighted_kappa_analysis(df1, df2, args.n_boot, args.seed, args.jobs)
+
+
+def run_icc(args):
+    from kappa import data_preprocess, icc_analysis
+
+    args = _bootstrap_defaults(args)
+    df1, df2 = data_preprocess()
+    icc_analysis(df1, df2, args.n_boot, args.seed, args.jobs)
+
+
+def run_elements(args):
+    from irr_elements import calculate_binary_kappa, load_and_preprocess
+
+    args = _bootstrap_defaults(args)
+    df1, df2 = load_and_preprocess(*args.workbooks)
+    if df1 is not None:
+        calculate_binary_kappa(df1, df2, args.n_boot, args.seed, args.jobs, args.workbooks)
+
+
+def run_rejects(args):
+    from normalize import write_rejects
+
+    write_rejects(args.workbooks, args.output)
+
+
+def run_documents(args):
+    from hierarchy import write_summary
+
+    write_summary(args.workbooks, args.output)
+
+
+def run_mca(args):
+    from mcaCalc import fit_map, load_filtered, plot_map, write_loadings
+
+    ids, df_mca = load_filtered(args.data)
+    mca = fit_map(df_mca)
+    if args.plot:
+        plot_map(ids, mca.row_coordinates(df_mca), args.plot)
+        print(f"Saved map to '{args.plot}'")
+    write_loadings(mca, df_mca, [args.data])
+
+
+# Each subcommand imports its modules only when it runs; 'modules' lists what
+# that pulls in, for the import report and for preloading a resident worker.
+COMMANDS = {
+    'merge': {'run': run_merge, 'modules': ['analysis'],
+              'help': "Average the two raters' workbooks into full.csv"},
+    'freq': {'run': run_freq, 'modules': ['analysis', 'matplotlib.pyplot'],
+             'help': "Per-source rating frequencies and averages.png"},
+    'plots': {'run': run_plots, 'modules': ['analysis', 'matplotlib.pyplot'],
+              'help': "Redraw the per-property rating distributions that changed"},
+    'kappa': {'run': run_kappa, 'modules': ['kappa'],
+              'help': "Weighted Cohen's kappa with bootstrap CIs"},
+    'icc': {'run': run_icc, 'modules': ['kappa'],
+            'help': "ICC with bootstrap CIs"},
+    'elements': {'run': run_elements, 'modules': ['irr_elements'],
+                 'help': "Cohen's kappa on the Y/N element columns"},
+    'rejects': {'run': run_rejects, 'modules': ['normalize'],
+                'help': "Cells that do not parse as their property's kind, as rejects.csv"},
+    'documents': {'run': run_documents, 'modules': ['hierarchy', 'coding_matrix'],
+                  'help': "Per-document means, element presence and kappa, as document_summary.csv"},
+    'mca': {'run': run_mca, 'modules': ['mcaCalc'],
+            'help': "MCA loadings of filtered_df.csv (cached fit)"},
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Coding analyses behind one entry point; "
+                                                 "heavy modules load only for the subcommand that needs them.")
+    parser.add_argument('--worker', action='store_true',
+                        help="Run the command in the resident worker (see 'serve'), if one is listening")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Unix socket of the resident worker")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    commands = {name: sub.add_parser(name, help=spec['help']) for name, spec in COMMANDS.items()}
+    for name in ['merge', 'freq', 'plots']:
+        commands[name].add_argument('--workbooks', nargs='+', default=["Validation Study_Sophie.xlsx", "CN_processed.xlsx"])
+    commands['merge'].add_argument('--output', default='full.csv')
+    commands['freq'].add_argument('--averages', default='averages.png')
+    commands['plots'].add_argument('--output-dir', default='row_distributions')
+    commands['plots'].add_argument('--jobs', type=int, default=None, help="Worker processes (default: all CPUs)")
+    commands['elements'].add_argument('--workbooks', nargs=2, default=["Validation Study_Sophie.xlsx", "CN_processed_FIXED.xlsx"])
+    for name in ['kappa', 'icc', 'elements']:
+        commands[name].add_argument('--n-boot', type=int, default=None, help="Bootstrap resamples for the CIs (0 to skip)")
+        commands[name].add_argument('--seed', type=int, default=0)
+        commands[name].add_argument('--jobs', type=int, default=1, help="Worker processes for the bootstrap")
+    commands['rejects'].add_argument('--workbooks', nargs='+', default=["SS_Updated_Coding.xlsx", "CN_Updated_Coding.xlsx"])
+    commands['rejects'].add_argument('--output', default='rejects.csv')
+    commands['documents'].add_argument('--workbooks', nargs='+', default=["SS_Updated_Coding.xlsx", "CN_Updated_Coding.xlsx"])
+    commands['documents'].add_argument('--output', default='document_summary.csv')
+    commands['mca'].add_argument('--data', default='filtered_df.csv')
+    commands['mca'].add_argument('--plot', help="Also save the document map to this PNG")
+
+    serve = sub.add_parser('serve', help="Start a resident worker with every subcommand's modules imported")
+    serve.add_argument('--stop', action='store_true', help="Stop the running worker instead")
+    imports = sub.add_parser('imports', help="Report the cold-start import time of each subcommand")
+    imports.add_argument('names', nargs='*', metavar='command', help="Subcommands to report (default: all)")
+    return parser
+
+
+def run_command(argv):
+    """
+    Parses and runs one subcommand in this process. Returns its exit status.
+    """
+    try:
+        args = build_parser().parse_args(argv)
+        COMMANDS[args.command]['run'](args)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """
+    Serves one request in a child forked from the warm worker: the command's
+    stdout and stderr go back over the socket, then its exit status.
+    """
+
+    def handle(self):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        request = json.loads(self.rfile.readline())
+        if request.get('stop'):
+            os.kill(os.getppid(), signal.SIGTERM)
+            return
+
+        os.chdir(request['cwd'])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.connection.fileno(), 1)
+        os.dup2(self.connection.fileno(), 2)
+        status = run_command(request['argv'])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.connection.sendall(STATUS_MARK + str(status).encode())
+
+
+class WorkerServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def serve(socket_path=SOCKET_PATH):
+    """
+    Imports every subcommand's modules once, then forks a fresh child per
+    request, so each run starts warm but shares no state with earlier runs.
+    """
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    start = time.perf_counter()
+    for module in sorted({m for spec in COMMANDS.values() for m in spec['modules']}):
+        importlib.import_module(module)
+    print(f"Preloaded modules in {time.perf_counter() - start:.2f}s")
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with WorkerServer(socket_path, WorkerHandler) as server:
+        print(f"Worker listening on {socket_path} (stop with 'cli.py serve --stop')")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+
+
+def send_to_worker(message, socket_path=SOCKET_PATH):
+    """
+    Sends a request to the resident worker and streams its output to stdout.
+    Returns the command's exit status (None when the worker gave none).
+    Raises OSError when no worker is listening.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode() + b'\n')
+
+        status = None
+        while chunk := sock.recv(1 << 16):
+            if status is None:
+                output, mark, chunk = chunk.partition(STATUS_MARK)
+                sys.stdout.buffer.write(output)
+                sys.stdout.flush()
+                if not mark:
+                    continue
+                status = b''
+            status += chunk
+    return None if status is None else int(status)
+
+
+def import_times(modules):
+    """
+    Cold-start cost of importing `modules` in a fresh interpreter, from
+    python -X importtime, as (seconds, {package: seconds}). Each module's own
+    time is credited to its top-level package; what the interpreter imports
+    at startup anyway is left out.
+    """
+    def self_times(code):
+        env = dict(os.environ, MPLBACKEND='Agg')
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True)
+        times = {}
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and 'imported package' not in line:
+                own, _, name = line[len('import time:'):].split('|')
+                times[name.strip()] = int(own) / 1e6
+        return times
+
+    baseline = self_times('pass')
+    packages = {}
+    for name, t in self_times('; '.join(f'import {m}' for m in modules)).items():
+        if name not in baseline:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0.0) + t
+    return sum(packages.values()), packages
+
+
+def import_report(names):
+    print(f"{'command':<10} {'imports':>8}  slowest")
+    for name in names:
+        total, times = import_times(COMMANDS[name]['modules'])
+        slowest = sorted(times.items(), key=lambda item: -item[1])[:3]
+        print(f"{name:<10} {total:>7.2f}s  " + ", ".join(f"{m} {t:.2f}s" for m, t in slowest))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        if args.stop:
+            send_to_worker({'stop': True}, args.socket)
+        else:
+            serve(args.socket)
+        return 0
+    if args.command == 'imports':
+        unknown = [name for name in args.names if name not in COMMANDS]
+        if unknown:
+            parser.error(f"unknown command(s): {', '.join(unknown)}")
+        import_report(args.names or list(COMMANDS))
+        return 0
+
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    command_argv = argv[argv.index(args.command):]
+    if args.worker:
+        try:
+            status = send_to_worker({'argv': command_argv, 'cwd': os.getcwd()}, args.socket)
+            return 1 if status is None else status
+        except OSError:
+            print(f"No worker listening on {args.socket}; running here", file=sys.stderr)
+    return run_command(command_argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
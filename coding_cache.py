@@ -0,0 +1,359 @@
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import profiler
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+# pandas' Rust-based calamine reader when python-calamine is installed, else its default (openpyxl)
+EXCEL_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else None
+
+CACHE_DIR = '.coding_cache'
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+CACHE_VERSION = 1
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """
+    SHA-256 of the workbook bytes. Raises FileNotFoundError like read_excel would.
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_transposed(filename, engine=EXCEL_ENGINE):
+    """
+    Parses a coding workbook and transposes it so Rows=Documents and Columns=Properties.
+    Same frame the scripts used to build by hand with df.T / iloc[0].
+    """
+    with profiler.stage('read_excel', workbook=os.path.basename(filename)):
+        df = pd.read_excel(filename, engine=engine)
+    profiler.count('cells read', df.size)
+    return df.set_index(df.columns[0]).T
+
+
+def _cache_path(digest, cache_dir):
+    """
+    Cache file of a workbook's frame.
+    """
+    return os.path.join(cache_dir, f"{digest}-v{CACHE_VERSION}.feather")
+
+
+def _encode_column(values):
+    """
+    Turns an object column into something Arrow can store, plus a tag
+    describing how to rebuild the original Python values.
+    """
+    values = np.asarray(values, dtype=object).ravel()
+    missing = pd.isna(values).tolist()
+    values = values.tolist()
+    present = [v for v, m in zip(values, missing) if not m]
+
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in present):
+        return [np.nan if m else float(v) for v, m in zip(values, missing)], 'int'
+    if all(isinstance(v, (float, np.floating)) for v in present):
+        return [np.nan if m else float(v) for v, m in zip(values, missing)], 'float'
+    if {type(v) for v in present} == {str}:
+        return [None if m else v for v, m in zip(values, missing)], 'str'
+
+    # Mixed cell types: keep each value exact via JSON
+    encoded = [None if m else json.dumps(v.item() if hasattr(v, 'item') else v)
+               for v, m in zip(values, missing)]
+    return encoded, 'json'
+
+
+def _decode_column(values, kind):
+    missing = lambda v: v is None or v != v
+    if kind == 'int':
+        return [np.nan if missing(v) else int(v) for v in values]
+    if kind == 'float':
+        return [np.nan if missing(v) else float(v) for v in values]
+    if kind == 'str':
+        return [np.nan if missing(v) else v for v in values]
+    return [np.nan if missing(v) else json.loads(v) for v in values]
+
+
+def _write_cache(df, path):
+    columns = {'__index__': _encode_column(df.index)}
+    kinds = {'__index__': columns['__index__'][1]}
+    for i in range(df.shape[1]):
+        columns[f"c{i}"] = _encode_column(df.iloc[:, i])
+        kinds[f"c{i}"] = columns[f"c{i}"][1]
+
+    labels = [_encode_column([c]) for c in df.columns]
+    meta = {
+        'kinds': kinds,
+        'labels': [encoded[0] for encoded, _ in labels],
+        'label_kinds': [kind for _, kind in labels],
+        'index_name': df.index.name,
+        'columns_name': df.columns.name,
+    }
+
+    table = pa.table({name: pa.array(col, from_pandas=True) for name, (col, _) in columns.items()})
+    table = table.replace_schema_metadata({'coding_cache': json.dumps(meta)})
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"  # stages may cache the same workbook concurrently
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def _decode_array(column, kind):
+    """
+    _decode_column for a stored Arrow column: the 'int', 'float' and 'str'
+    kinds are converted as whole arrays; 'json' cells are decoded once per
+    distinct text.
+    """
+    missing = column.is_null().to_numpy(zero_copy_only=False)
+    if kind == 'json':
+        codes, uniques = pd.factorize(column.to_numpy(zero_copy_only=False)[~missing])
+        out = np.full(len(missing), np.nan, dtype=object)
+        decoded = np.empty(len(uniques), dtype=object)
+        for k, value in enumerate(_decode_column(uniques.tolist(), kind)):
+            decoded[k] = value
+        out[~missing] = decoded[codes]
+        return out
+    values = column.to_numpy()
+    if kind == 'int':
+        values = np.where(missing, 0, values).astype(np.int64)
+    out = values.astype(object)
+    out[missing | pd.isna(out)] = np.nan
+    return out
+
+
+def _read_cache(path):
+    table = feather.read_table(path, memory_map=True)
+    meta = json.loads(table.schema.metadata[b'coding_cache'])
+    kinds = meta['kinds']
+
+    index = _decode_array(table.column('__index__'), kinds['__index__'])
+    labels = [_decode_column([v], k)[0] for v, k in zip(meta['labels'], meta['label_kinds'])]
+
+    data = {}
+    for i in range(len(labels)):
+        name = f"c{i}"
+        data[i] = pd.Series(_decode_array(table.column(name), kinds[name]), dtype=object)
+
+    df = pd.DataFrame(data)
+    df.columns = pd.Index(labels, name=meta['columns_name'])
+    df.index = pd.Index(index, name=meta['index_name'])
+    return df
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Deletes least recently used cache files until the folder fits in max_bytes.
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.feather'):
+            path = os.path.join(cache_dir, name)
+            st = os.stat(path)
+            entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        removed.append(path)
+    return removed
+
+
+def invalidate(filename, cache_dir=CACHE_DIR):
+    """
+    Drops the cached frames for the current contents of one workbook.
+    """
+    if not os.path.isdir(cache_dir):
+        return False
+    digest = file_digest(filename)
+    removed = False
+    for name in os.listdir(cache_dir):
+        if name.startswith(digest) and name.endswith('.feather'):
+            os.remove(os.path.join(cache_dir, name))
+            removed = True
+    return removed
+
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """
+    Removes every cached frame.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    count = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith('.feather') or name.endswith('.tmp'):
+            os.remove(os.path.join(cache_dir, name))
+            count += 1
+    return count
+
+
+def _cached(path):
+    """
+    The frame cached at path, or None (a corrupt file is removed).
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        df = _read_cache(path)
+        os.utime(path)  # mark as recently used for eviction
+        return df
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        os.remove(path)
+        return None
+
+
+def _store(df, path, filename, cache_dir, max_bytes):
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        _write_cache(df, path)
+    except (TypeError, pa.ArrowException) as e:
+        print(f"Warning: could not cache {filename}: {e}")
+        return df
+    evict(cache_dir, max_bytes)
+    return df
+
+
+def load_coding(filename, use_cache=True, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Returns the transposed Documents x Properties frame for a coding workbook.
+    The parsed frame is cached on disk keyed by the SHA-256 of the file, so Excel
+    is only parsed again once the workbook changes. Falls back to plain
+    read_excel when pyarrow is not installed.
+    """
+    if not use_cache or feather is None:
+        return read_transposed(filename)
+
+    path = _cache_path(file_digest(filename), cache_dir)
+    df = _cached(path)
+    if df is None:
+        df = _store(read_transposed(filename), path, filename, cache_dir, max_bytes)
+    return df
+
+
+def _subset(df, documents=None, properties=None):
+    """
+    Rows of df for some documents and columns for some properties (None
+    keeps all), in sheet order.
+    """
+    rows = df.index.isin(documents) if documents is not None else slice(None)
+    cols = df.columns.isin(properties) if properties is not None else slice(None)
+    return df.loc[rows, cols]
+
+
+def workbook_header(filename, use_cache=True, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    Document IDs and property names of a coding workbook, in sheet order,
+    from its load_coding frame. Reading the labels alone saves nothing:
+    the Excel readers go through the whole sheet for the first column.
+    """
+    df = load_coding(filename, use_cache, cache_dir, max_bytes)
+    return df.index, df.columns
+
+
+def load_selected(filename, documents=None, properties=None, use_cache=True,
+                  cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    load_coding restricted to some documents and properties (None keeps
+    all), in sheet order. The whole frame is parsed (and cached) and then
+    subset: usecols / skiprows do not stop read_excel from loading every
+    cell, so parsing a selection is no faster.
+    """
+    return _subset(load_coding(filename, use_cache, cache_dir, max_bytes), documents, properties)
+
+
+def _load_task(task):
+    return load_selected(*task)
+
+
+def _pool_map(function, tasks, jobs):
+    """
+    function over tasks, in a process pool when there is more than one
+    workbook and more than one job (jobs=None: one per CPU).
+    """
+    jobs = min(len(tasks), jobs or os.cpu_count() or 1)
+    if jobs <= 1:
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(function, tasks))
+
+
+def load_workbooks(filenames, documents=None, properties=None, jobs=None, use_cache=True,
+                   cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    load_selected for several coders' workbooks at once, one process each.
+    """
+    tasks = [(f, documents, properties, use_cache, cache_dir, max_bytes) for f in filenames]
+    return _pool_map(_load_task, tasks, jobs)
+
+
+def load_common(filenames, properties=None, key=None, jobs=None, use_cache=True,
+                cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """
+    The coders' frames restricted to the documents every workbook has, and
+    to the given properties or else those every workbook has. Each
+    workbook is parsed once. key maps the document IDs (an Index) to what
+    makes two IDs the same document (e.g. normalize.clean_ids); each frame
+    keeps its own IDs, in sheet order.
+    """
+    key = key or (lambda ids: ids)
+    frames = load_workbooks(filenames, jobs=jobs, use_cache=use_cache, cache_dir=cache_dir, max_bytes=max_bytes)
+    keys = [pd.Index(key(df.index)) for df in frames]
+
+    shared_keys = None
+    shared_props = properties
+    for df, doc_keys in zip(frames, keys):
+        shared_keys = doc_keys if shared_keys is None else shared_keys.intersection(doc_keys)
+        if properties is None:
+            shared_props = df.columns if shared_props is None else shared_props.intersection(df.columns)
+
+    return [_subset(df, df.index[doc_keys.isin(shared_keys)], shared_props) for df, doc_keys in zip(frames, keys)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the coding workbook cache.")
+    parser.add_argument('files', nargs='*', help="Workbooks to warm (or invalidate with --invalidate)")
+    parser.add_argument('--clear', action='store_true', help="Remove every cached frame")
+    parser.add_argument('--invalidate', action='store_true', help="Drop the cached frames for the given files")
+    parser.add_argument('--max-mb', type=float, default=MAX_CACHE_BYTES / (1024 * 1024))
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+
+    if feather is None:
+        print("pyarrow is not installed; caching is disabled.")
+        sys.exit(1)
+
+    if args.clear:
+        print(f"Removed {clear_cache(args.cache_dir)} cached frames from {args.cache_dir}")
+    elif args.invalidate:
+        for f in args.files:
+            print(f"{f}: {'invalidated' if invalidate(f, args.cache_dir) else 'not cached'}")
+    else:
+        max_bytes = int(args.max_mb * 1024 * 1024)
+        for f in args.files:
+            df = load_coding(f, cache_dir=args.cache_dir, max_bytes=max_bytes)
+            print(f"Cached {f}: {df.shape[0]} documents x {df.shape[1]} properties")
+        for path in evict(args.cache_dir, max_bytes):
+            print(f"Evicted {path}")
@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+
+from agreement import MISSING
+from id_index import parse_ids
+from normalize import classify_properties, clean_ids
+from rating_hist import half_point_codes
+
+SOURCE_TYPES = ['VIS', 'BK', 'CS', 'WB']  # known sources first, in this order; others follow sorted
+INDEX_NAME = 'Document ID : Guideline ID'
+KINDS = ['ordinal', 'binary', 'categorical']
+
+
+def unit_keys(ids):
+    """
+    Alignment key of each ID: 'VIS-2:4' when it parses, otherwise the ID
+    without spaces (as kappa.py normalizes them).
+    """
+    sources, documents, guidelines = parse_ids(ids)
+    raw = clean_ids(ids)
+    return pd.Index([f"{s}-{d}:{g}" if s is not None else f"?{r}"
+                     for s, d, g, r in zip(sources, documents, guidelines, raw)])
+
+
+class CodingMatrix:
+    """
+    Typed, compact form of one or more coders' Documents x Properties frames,
+    aligned on the same units (document : guideline) and properties.
+
+    - ordinal: Raters x Units x P int8 half-point codes (rating * 2, as in
+      rating_hist), MISSING where a cell is blank or not on the grid
+    - binary_yes / binary_valid: Raters x Units x ceil(P / 8) uint8, one
+      little-endian bitset per unit with the Y cells / the Y or N cells set
+    - categorical: Raters x Units x P dictionary codes into `categories`
+
+    Units are sorted by source type, document and guideline, so every
+    source is a contiguous block: rater() and by_source() return views that
+    share these arrays instead of copying them.
+    """
+
+    def __init__(self, raters, unit_ids, source, document, guideline, sources, columns,
+                 ordinal, ordinal_names, binary_yes, binary_valid, binary_names,
+                 categorical, categorical_names, categories):
+        self.raters = list(raters)
+        self.unit_ids = unit_ids
+        self.source = source
+        self.document = document
+        self.guideline = guideline
+        self.sources = list(sources)
+        self.columns = list(columns)
+        self.ordinal = ordinal
+        self.ordinal_names = list(ordinal_names)
+        self.binary_yes = binary_yes
+        self.binary_valid = binary_valid
+        self.binary_names = list(binary_names)
+        self.categorical = categorical
+        self.categorical_names = list(categorical_names)
+        self.categories = [list(c) for c in categories]
+
+    @classmethod
+    def from_frames(cls, frames, raters=None):
+        """
+        Builds the matrix from Documents x Properties frames (one per rater,
+        as load_coding returns them). Documents and properties are the union
+        over raters; a rater's cells for units or properties it lacks are
+        missing. Repeated IDs within one frame keep their first row.
+        """
+        raters = list(range(len(frames))) if raters is None else list(raters)
+        keyed, ids = [], []
+        for df in frames:
+            keys = unit_keys(df.index)
+            first = ~keys.duplicated()
+            keyed.append(df.set_axis(keys)[first])
+            ids.append(df.index[first])
+
+        keys, labels, columns = pd.Index([]), [], pd.Index([])
+        for df, df_ids in zip(keyed, ids):
+            new = ~df.index.isin(keys)
+            keys = keys.append(df.index[new])
+            labels.extend(df_ids[new])
+            columns = columns.append(df.columns[~df.columns.isin(columns)])
+
+        names, document, guideline = parse_ids(labels)
+        seen = {s for s in names if s is not None}
+        present = [s for s in SOURCE_TYPES if s in seen] + sorted(seen - set(SOURCE_TYPES))
+        lookup = {s: i for i, s in enumerate(present)}
+        source = np.array([lookup.get(s, -1) for s in names], dtype=np.int8)
+        order = np.lexsort((guideline, document, np.where(source < 0, len(present), source)))
+
+        values = np.stack([df.reindex(index=keys[order], columns=columns).to_numpy(dtype=object)
+                           for df in keyed])
+        kinds, numeric, yes_no = classify_properties(values)
+        by_kind = {kind: [i for i, k in enumerate(kinds) if k == kind] for kind in KINDS}
+
+        ordinal = half_point_codes(numeric[..., by_kind['ordinal']])
+
+        answers = yes_no[..., by_kind['binary']]
+        binary_yes = np.packbits(answers == 1, axis=-1, bitorder='little')
+        binary_valid = np.packbits(~np.isnan(answers), axis=-1, bitorder='little')
+
+        n_cat = len(by_kind['categorical'])
+        categorical = np.full(values.shape[:2] + (n_cat,), MISSING, dtype=np.int16)
+        categories = []
+        for j, col in enumerate(by_kind['categorical']):
+            text = pd.Series(values[..., col].ravel()).astype('string').str.strip().replace('', pd.NA)
+            codes, uniques = pd.factorize(text, sort=True)
+            if len(uniques) > np.iinfo(np.int16).max:
+                categorical = categorical.astype(np.int32)
+            categorical[..., j] = codes.reshape(values.shape[:2])
+            categories.append(uniques.tolist())
+
+        return cls(raters, np.asarray(labels, dtype=object)[order], source[order], document[order],
+                   guideline[order], present, columns.tolist(),
+                   ordinal, columns[by_kind['ordinal']], binary_yes, binary_valid, columns[by_kind['binary']],
+                   categorical, columns[by_kind['categorical']], categories)
+
+    @classmethod
+    def from_workbooks(cls, filenames, raters=None):
+        from coding_cache import load_workbooks
+
+        return cls.from_frames(load_workbooks(filenames), raters or filenames)
+
+    def _subset(self, raters=slice(None), units=slice(None)):
+        """
+        The same matrix restricted to a slice of raters and of units. Basic
+        slicing only, so the arrays are views of this matrix's.
+        """
+        return CodingMatrix(self.raters[raters], self.unit_ids[units], self.source[units],
+                            self.document[units], self.guideline[units], self.sources, self.columns,
+                            self.ordinal[raters, units], self.ordinal_names,
+                            self.binary_yes[raters, units], self.binary_valid[raters, units], self.binary_names,
+                            self.categorical[raters, units], self.categorical_names, self.categories)
+
+    def rater(self, rater):
+        """
+        View of one rater, by position or name.
+        """
+        r = rater if isinstance(rater, (int, np.integer)) else self.raters.index(rater)
+        return self._subset(raters=slice(r, r + 1))
+
+    def source_slices(self):
+        """
+        {source type: slice of its units}, in unit order.
+        """
+        order = np.where(self.source < 0, len(self.sources), self.source)  # unparsed IDs sort last
+        bounds = np.searchsorted(order, np.arange(len(self.sources) + 1))
+        return {name: slice(int(bounds[i]), int(bounds[i + 1])) for i, name in enumerate(self.sources)}
+
+    def by_source(self, name):
+        """
+        View of the units of one source type ('VIS', 'BK', ...).
+        """
+        return self._subset(units=self.source_slices()[name])
+
+    @property
+    def shape(self):
+        return len(self.raters), len(self.unit_ids)
+
+    @property
+    def valid(self):
+        """
+        Mask of the ordinal cells that hold a rating.
+        """
+        return self.ordinal != MISSING
+
+    def ratings(self):
+        """
+        Raters x Units x P float ratings, NaN where missing.
+        """
+        return np.where(self.valid, self.ordinal / 2, np.nan)
+
+    def yes_no(self):
+        """
+        Raters x Units x P binary answers as 1/0, MISSING where blank.
+        """
+        n = len(self.binary_names)
+        yes = np.unpackbits(self.binary_yes, axis=-1, count=n, bitorder='little').astype(np.int8)
+        valid = np.unpackbits(self.binary_valid, axis=-1, count=n, bitorder='little').astype(bool)
+        return np.where(valid, yes, np.int8(MISSING))
+
+    def kind(self, name):
+        for kind, names in [('ordinal', self.ordinal_names), ('binary', self.binary_names),
+                            ('categorical', self.categorical_names)]:
+            if name in names:
+                return kind
+        raise KeyError(name)
+
+    def to_frame(self, rater=0):
+        """
+        One rater's Documents x Properties frame in the original column
+        order: ratings as floats, binary answers as 'Y'/'N', categories as text.
+        """
+        r = rater if isinstance(rater, (int, np.integer)) else self.raters.index(rater)
+        columns = {}
+        ratings = self.ratings()[r]
+        for j, name in enumerate(self.ordinal_names):
+            columns[name] = ratings[:, j]
+        answers = self.yes_no()[r]
+        for j, name in enumerate(self.binary_names):
+            columns[name] = np.where(answers[:, j] == MISSING, None, np.where(answers[:, j] == 1, 'Y', 'N'))
+        for j, name in enumerate(self.categorical_names):
+            labels = np.array(self.categories[j] + [None], dtype=object)
+            columns[name] = labels[self.categorical[r][:, j]]  # MISSING (-1) picks the trailing None
+
+        frame = pd.DataFrame(columns, index=pd.Index(self.unit_ids))[self.columns]
+        frame.columns.name = INDEX_NAME
+        return frame
+
+    @property
+    def nbytes(self):
+        arrays = [self.source, self.document, self.guideline, self.ordinal,
+                  self.binary_yes, self.binary_valid, self.categorical]
+        return sum(a.nbytes for a in arrays)
+
+    def __repr__(self):
+        return (f"CodingMatrix({len(self.raters)} raters x {len(self.unit_ids)} units; "
+                f"{len(self.ordinal_names)} ordinal, {len(self.binary_names)} binary, "
+                f"{len(self.categorical_names)} categorical properties; sources {', '.join(self.sources)})")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from coding_cache import load_workbooks
+
+    parser = argparse.ArgumentParser(description="Summarize coding workbooks as a typed CodingMatrix.")
+    parser.add_argument('workbooks', nargs='+', help="One coding workbook per coder")
+    args = parser.parse_args()
+
+    frames = load_workbooks(args.workbooks)
+    matrix = CodingMatrix.from_frames(frames, args.workbooks)
+    print(matrix)
+    for name, units in matrix.source_slices().items():
+        print(f"  {name}: {units.stop - units.start} units")
+    frame_bytes = sum(df.memory_usage(deep=True).sum() for df in frames)
+    print(f"Memory: {matrix.nbytes / 1024:.1f} KiB as arrays vs {frame_bytes / 1024:.1f} KiB as frames")
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from scipy import special
+
+from agreement import MISSING
+from results_store import record
+
+SOURCE_NAMES = {'VIS': 'VIS Papers', 'BK': 'Books', 'CS': 'Crowdsourced', 'WB': 'Web Blogs'}
+
+
+def contingency_tensor(matrix):
+    """
+    Properties x Coders x Sources x Categories counts of every categorical
+    property of a CodingMatrix, in one bincount over all coded cells.
+    Category axes are padded with zeros to the longest category list.
+    """
+    codes = matrix.categorical
+    n_coders, n_units, n_props = codes.shape
+    n_sources = len(matrix.sources)
+    n_cats = max([len(c) for c in matrix.categories], default=0)
+
+    prop = np.arange(n_props)[None, None, :]
+    coder = np.arange(n_coders)[:, None, None]
+    source = matrix.source.astype(np.int64)[None, :, None]
+    cell = (((prop * n_coders + coder) * n_sources + source) * n_cats) + codes
+    valid = (codes != MISSING) & (source >= 0)
+    counts = np.bincount(cell[valid], minlength=n_props * n_coders * n_sources * n_cats)
+    return counts.reshape(n_props, n_coders, n_sources, n_cats)
+
+
+def independence_tests(tables):
+    """
+    Pearson chi-square and G-test of independence for every table in the
+    last two axes. All-zero rows and columns add neither cells nor degrees
+    of freedom, so padded tables test like their trimmed versions.
+    Returns a dict of arrays: n, dof, chi2, p_chi2, g, p_g (NaN without any dof).
+    """
+    observed = np.asarray(tables, dtype=float)
+    n = observed.sum(axis=(-2, -1))
+    rows = observed.sum(axis=-1)
+    cols = observed.sum(axis=-2)
+    dof = np.maximum((rows > 0).sum(axis=-1) - 1, 0) * np.maximum((cols > 0).sum(axis=-1) - 1, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected = rows[..., :, None] * cols[..., None, :] / n[..., None, None]
+        chi2 = np.where(expected > 0, (observed - expected) ** 2 / expected, 0.0).sum(axis=(-2, -1))
+        g = 2 * np.where(observed > 0, observed * np.log(observed / expected), 0.0).sum(axis=(-2, -1))
+
+    tested = dof > 0
+    return {
+        'n': n,
+        'dof': dof,
+        'chi2': np.where(tested, chi2, np.nan),
+        'p_chi2': np.where(tested, special.chdtrc(np.maximum(dof, 1), chi2), np.nan),
+        'g': np.where(tested, g, np.nan),
+        'p_g': np.where(tested, special.chdtrc(np.maximum(dof, 1), g), np.nan),
+    }
+
+
+def association_tests(matrix, counts):
+    """
+    Long table of the tests on a contingency tensor: per property and coder,
+    whether the category distribution depends on the source type (Sources x
+    Categories), and per property whether the coders' distributions differ
+    (Coders x Categories, pooled over sources).
+    """
+    by_source = independence_tests(counts)
+    by_coder = independence_tests(counts.sum(axis=2))
+
+    rows = []
+    for p, prop in enumerate(matrix.categorical_names):
+        for r, coder in enumerate(matrix.raters):
+            rows.append({'Property': prop, 'Test': 'source', 'Coder': coder,
+                         **{key: values[p, r] for key, values in by_source.items()}})
+        rows.append({'Property': prop, 'Test': 'coder', 'Coder': 'all',
+                     **{key: values[p] for key, values in by_coder.items()}})
+    return pd.DataFrame(rows)
+
+
+def source_table(matrix, counts, prop, coder):
+    """
+    One coder's Sources x Categories counts for a property, with readable source names.
+    """
+    p = matrix.categorical_names.index(prop)
+    r = coder if isinstance(coder, (int, np.integer)) else matrix.raters.index(coder)
+    categories = matrix.categories[p]
+    index = pd.Index([SOURCE_NAMES.get(s, s) for s in matrix.sources])
+    return pd.DataFrame(counts[p, r, :, :len(categories)], index=index, columns=pd.Index(categories))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from coding_matrix import CodingMatrix
+
+    parser = argparse.ArgumentParser(description="Source-type and between-coder tests for every categorical field.")
+    parser.add_argument('workbooks', nargs='+', help="One coding workbook per coder")
+    parser.add_argument('--output', default='contingency_tests.csv')
+    args = parser.parse_args()
+
+    matrix = CodingMatrix.from_workbooks(args.workbooks)
+    tests = association_tests(matrix, contingency_tensor(matrix))
+    print(tests.to_string(index=False))
+    tests.to_csv(args.output, index=False)
+    record('categorical_tests', tests, args.workbooks)
+    print(f"\nSaved results to '{args.output}'")
@@ -1,18 +1,60 @@
 import pandas as pd
 
-df = pd.read_csv('full.csv')
+from correlation import METHODS, N_PERM, PERMUTED, correlation_analysis
+from hierarchy import document_means_frame
+from results_store import record
 
-df = df.set_index(df.columns[0])
-df = df.drop(columns=df.columns[0])
-df = df.T
 
-cols_to_drop = [c for c in df.columns if "EX:" in str(c) or "Other" in str(c) or "Goal" in str(c) or "Present" in str(c)]
-df = df.drop(columns=cols_to_drop)
+def load_full(path='full.csv'):
+    """
+    Properties x Units frame of the merged ratings written by analysis.py.
+    """
+    df = pd.read_csv(path)
 
+    df = df.set_index(df.columns[0])
+    return df.drop(columns=df.columns[0])
 
-df.to_csv('filtered_df.csv')
-#corr = df.corr()
 
-#print(corr)
+def filter_properties(df):
+    """
+    Units x Properties matrix of the ratings alone: the example, goal,
+    'Other' and element rows are dropped.
+    """
+    df = df.T
 
-#corr.to_csv('correlations.csv')
\ No newline at end of file
+    cols_to_drop = [c for c in df.columns if "EX:" in str(c) or "Other" in str(c) or "Goal" in str(c) or "Present" in str(c)]
+    return df.drop(columns=cols_to_drop)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Filtered property matrix plus correlations with permutation tests.")
+    parser.add_argument('--n-perm', type=int, default=N_PERM, help="Permutations for the p-values (0 to skip)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes for the permutations")
+    parser.add_argument('--methods', nargs='+', choices=METHODS, default=METHODS)
+    parser.add_argument('--polychoric-p', action='store_true',
+                        help="Permutation p-values for the polychoric correlations too (slow)")
+    parser.add_argument('--unit', choices=['guideline', 'document'], default='guideline',
+                        help="Unit of analysis: each guideline, or each document's mean ratings")
+    args = parser.parse_args()
+
+    df = load_full()
+    if args.unit == 'document':
+        # Means back on the half-point rating grid, so they stay categories for the MCA
+        df = (document_means_frame(df) * 2).round() / 2
+    df = filter_properties(df)
+
+
+    df.to_csv('filtered_df.csv')
+
+    # Pairwise-complete correlations; correlations.csv keeps the plain Pearson matrix
+    matrices, pairs = correlation_analysis(df, args.methods, args.n_perm, args.seed, args.jobs,
+                                           PERMUTED + ['polychoric'] if args.polychoric_p else PERMUTED)
+    print(pairs)
+
+    if 'pearson' in matrices:
+        matrices['pearson'].to_csv('correlations.csv')
+    pairs.to_csv('correlation_tests.csv', index=False)
+    record('correlation_tests', pairs, ['full.csv'])
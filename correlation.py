@@ -0,0 +1,305 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import special
+
+import profiler
+from normalize import parse_numbers
+
+METHODS = ['pearson', 'spearman', 'polychoric']
+PERMUTED = ['pearson', 'spearman']  # polychoric p-values are opt-in: its fits dominate the permutation time
+N_PERM = 2000
+CHUNK_SIZE = 100
+
+# 12-point Gauss-Legendre nodes on [0, 1] for the bivariate normal integral
+# (error below 1e-8 up to |rho| = 0.98)
+_GL_X, _GL_W = np.polynomial.legendre.leggauss(12)
+_GL_X, _GL_W = (_GL_X + 1) / 2, _GL_W / 2
+
+
+def encode_levels(df):
+    """
+    Properties' ratings as level codes (Units x Properties, -1 where missing)
+    against the sorted distinct values of the whole frame.
+    Returns (codes, level values).
+    """
+    values = parse_numbers(df)
+    levels = np.unique(values[~np.isnan(values)])
+    codes = np.full(values.shape, -1, dtype=np.int64)
+    valid = ~np.isnan(values)
+    codes[valid] = np.searchsorted(levels, values[valid])
+    return codes, levels
+
+
+def pair_tables(codes, n_levels):
+    """
+    Pairwise-complete contingency tables for every pair of properties,
+    P x P x L x L, from one product of the one-hot level matrix with itself.
+    A leading batch axis on codes (Batches x Units x Properties) gives one
+    tensor per batch. Every correlation below is computed from these
+    tables, so the level codes and ranks are shared by all methods.
+    """
+    codes = np.asarray(codes)
+    *batch, n_units, n_props = codes.shape
+    onehot = np.zeros((*batch, n_units, n_props, n_levels))
+    valid = codes >= 0
+    np.put_along_axis(onehot, np.where(valid, codes, 0)[..., None], valid[..., None].astype(float), axis=-1)
+    onehot = onehot.reshape(*batch, n_units, n_props * n_levels)
+    tables = np.einsum('...ui,...uj->...ij', onehot, onehot)
+    tables = tables.reshape(*batch, n_props, n_levels, n_props, n_levels)
+    return np.swapaxes(tables, -3, -2)
+
+
+def _weighted_pearson(tables, x, y):
+    """
+    Pearson correlation of every table, where x (... x L) and y (... x L)
+    are the scores given to the row and column levels.
+    """
+    n = tables.sum(axis=(-2, -1))
+    row = tables.sum(axis=-1)
+    col = tables.sum(axis=-2)
+    sx, sy = (row * x).sum(axis=-1), (col * y).sum(axis=-1)
+    sxx, syy = (row * x ** 2).sum(axis=-1), (col * y ** 2).sum(axis=-1)
+    sxy = np.einsum('...a,...ab,...b->...', x, tables, y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+
+
+def midranks(tables):
+    """
+    Average ranks of the row and column levels within each pair's complete
+    cases (what pandas assigns when it ranks the pair for Spearman).
+    """
+    row = tables.sum(axis=-1)
+    col = tables.sum(axis=-2)
+    row_ranks = np.cumsum(row, axis=-1) - row + (row + 1) / 2
+    col_ranks = np.cumsum(col, axis=-1) - col + (col + 1) / 2
+    return row_ranks, col_ranks
+
+
+def pearson_from_tables(tables, levels):
+    levels = np.asarray(levels, dtype=float)
+    return _weighted_pearson(tables, levels, levels)
+
+
+def spearman_from_tables(tables):
+    row_ranks, col_ranks = midranks(tables)
+    return _weighted_pearson(tables, row_ranks, col_ranks)
+
+
+def _limit_grid(h, k):
+    """
+    The rho-independent parts of the bivariate normal CDF at limits (h, k):
+    Phi(h) Phi(k), h^2 + k^2 and h k, plus the value wherever a limit is
+    infinite (the CDF then no longer depends on rho).
+    """
+    hf = np.where(np.isfinite(h), h, 0.0)
+    kf = np.where(np.isfinite(k), k, 0.0)
+    fixed = ~(np.isfinite(h) & np.isfinite(k))
+    fixed_value = np.where(np.isposinf(h), special.ndtr(k), special.ndtr(h))
+    fixed_value = np.where(np.isneginf(h) | np.isneginf(k), 0.0, fixed_value)
+    return {
+        'base': special.ndtr(h) * special.ndtr(k),
+        'sq': (hf ** 2 + kf ** 2)[..., None],
+        'cross': (2 * hf * kf)[..., None],
+        'fixed': fixed,
+        'fixed_value': fixed_value,
+    }
+
+
+def _grid_cdf(grid, rho):
+    """
+    Bivariate normal CDF on a limit grid for correlations rho (broadcast
+    against the grid's leading axes), by Gauss-Legendre quadrature of the
+    integral over asin(rho).
+    """
+    asin = np.arcsin(rho)[..., None]
+    theta = asin * _GL_X
+    sin, cos2 = np.sin(theta), np.cos(theta) ** 2
+    integrand = np.exp(-(grid['sq'] - grid['cross'] * sin) / (2 * cos2))
+    integral = asin[..., 0] * (integrand * _GL_W).sum(axis=-1) / (2 * np.pi)
+    cdf = np.where(grid['fixed'], grid['fixed_value'], grid['base'] + integral)
+    return np.clip(cdf, 0.0, 1.0)
+
+
+def bivariate_normal_cdf(h, k, rho):
+    """
+    P(X <= h, Y <= k) for standard normals with correlation rho.
+    Broadcasts over all arguments; infinite limits are allowed.
+    """
+    h, k, rho = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (h, k, rho)))
+    return _grid_cdf(_limit_grid(h, k), rho)
+
+
+def _thresholds(margins):
+    """
+    Normal thresholds (... x L+1) from level counts, -inf and +inf at the ends.
+    Empty levels give repeated thresholds, i.e. zero-probability cells.
+    """
+    n = margins.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cum = np.cumsum(margins, axis=-1) / n
+    inner = special.ndtri(np.clip(cum[..., :-1], 0.0, 1.0))
+    shape = margins.shape[:-1] + (1,)
+    return np.concatenate([np.full(shape, -np.inf), inner, np.full(shape, np.inf)], axis=-1)
+
+
+def _corner_differences(grid_values):
+    """
+    Per-cell mass from values at the cell corners (the threshold grid).
+    """
+    g = grid_values
+    return g[..., 1:, 1:] - g[..., :-1, 1:] - g[..., 1:, :-1] + g[..., :-1, :-1]
+
+
+def polychoric_from_tables(tables, n_iter=8):
+    """
+    Two-step polychoric correlation of every table: thresholds from the
+    margins, then Fisher scoring on rho for all tables at once, starting
+    from the Spearman correlation. The derivative of a cell probability is
+    the bivariate normal density at its corners, so each step costs one
+    CDF evaluation. Tables where either margin uses a single level are NaN.
+    """
+    tables = np.asarray(tables, dtype=float)
+    row_t = _thresholds(tables.sum(axis=-1))
+    col_t = _thresholds(tables.sum(axis=-2))
+    grid = _limit_grid(row_t[..., :, None], col_t[..., None, :])
+    n = tables.sum(axis=(-2, -1))
+
+    rho = np.clip(np.nan_to_num(spearman_from_tables(tables)), -0.99, 0.99)
+    for _ in range(n_iter):
+        r = rho[..., None, None]
+        one_minus = 1 - r ** 2
+        density = np.exp(-(grid['sq'][..., 0] - grid['cross'][..., 0] * r) / (2 * one_minus))
+        density = np.where(grid['fixed'], 0.0, density / (2 * np.pi * np.sqrt(one_minus)))
+
+        probs = _corner_differences(_grid_cdf(grid, r))
+        slopes = _corner_differences(density)
+        # Cells of (numerically) zero probability carry only rounding noise in their slope
+        probs = np.where(probs > 1e-15, probs, np.inf)
+        score = (tables * slopes / probs).sum(axis=(-2, -1))
+        info = n * (slopes ** 2 / probs).sum(axis=(-2, -1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = np.where(info > 0, score / info, 0.0)
+        rho = np.clip(rho + step, -0.9999, 0.9999)
+
+    varies = ((tables.sum(axis=-1) > 0).sum(axis=-1) > 1) & ((tables.sum(axis=-2) > 0).sum(axis=-1) > 1)
+    return np.where(varies, rho, np.nan)
+
+
+def correlations_from_tables(tables, levels, methods=METHODS):
+    """
+    {method: correlation of each L x L table} (any leading shape, e.g. Pairs
+    or Batches x Pairs).
+    """
+    out = {}
+    for method in methods:
+        if method == 'pearson':
+            out[method] = pearson_from_tables(tables, levels)
+        elif method == 'spearman':
+            out[method] = spearman_from_tables(tables)
+        elif method == 'polychoric':
+            out[method] = polychoric_from_tables(tables)
+        else:
+            raise ValueError(f"Unknown method '{method}'")
+    return out
+
+
+def _permutation_chunk(task):
+    """
+    Counts, per method and pair, how many of `size` permutations give a
+    correlation at least as large in absolute value as the observed one.
+    Each property's observed codes are shuffled independently in every
+    permutation, over the units that have one, so every pair keeps the
+    complete cases (and N) of the observed data.
+    """
+    codes, levels, observed, methods, size, seed_seq = task
+    rng = np.random.default_rng(seed_seq)
+    n_units, n_props = codes.shape
+    valid = codes >= 0
+    keys = rng.random((size, n_units, n_props))
+    keys[:, ~valid] = 2.0  # missing cells sort after the observed ones
+    order = np.argsort(keys, axis=1)
+    shuffled = np.take_along_axis(np.broadcast_to(codes, order.shape), order, axis=1)
+    # The k-th shuffled code goes to the k-th unit of the column (observed units first, in order)
+    slots = np.broadcast_to(np.argsort(~valid, axis=0, kind='stable'), order.shape)
+    permuted = np.empty_like(shuffled)
+    np.put_along_axis(permuted, slots, shuffled, axis=1)
+
+    i, j = np.triu_indices(n_props, k=1)
+    tables = pair_tables(permuted, len(levels))[:, i, j]
+    stats = correlations_from_tables(tables, levels, methods)
+    return {m: (np.abs(stats[m]) >= np.abs(observed[m]) - 1e-12).sum(axis=0) for m in methods}
+
+
+@profiler.timed
+def permutation_pvalues(codes, levels, observed, methods=METHODS, n_perm=N_PERM, seed=0,
+                        n_jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    Two-sided permutation p-values for each pair i < j (np.triu_indices
+    order), (1 + hits) / (1 + n_perm). observed holds the same pairs.
+    Chunks get child seeds spawned from `seed`, so the result does not
+    depend on n_jobs.
+    """
+    sizes = [min(chunk_size, n_perm - start) for start in range(0, n_perm, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(codes, levels, observed, methods, size, s) for size, s in zip(sizes, seeds)]
+
+    if n_jobs == 1:
+        results = [_permutation_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_permutation_chunk, tasks))
+    profiler.count('permutations', n_perm)
+    return {m: (1 + sum(r[m] for r in results)) / (1 + n_perm) for m in methods}
+
+
+def fdr_bh(pvals):
+    """
+    Benjamini-Hochberg adjusted p-values (q-values); NaNs are left out.
+    """
+    pvals = np.asarray(pvals, dtype=float)
+    q = np.full(pvals.shape, np.nan)
+    ok = ~np.isnan(pvals)
+    p = pvals[ok]
+    order = np.argsort(p)
+    ranked = p[order] * len(p) / np.arange(1, len(p) + 1)
+    adjusted = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    out = np.empty_like(p)
+    out[order] = adjusted
+    q[ok] = out
+    return q
+
+
+def correlation_analysis(df, methods=METHODS, n_perm=N_PERM, seed=0, n_jobs=1, permuted=PERMUTED):
+    """
+    Pairwise-complete correlations of the properties (columns of df) with
+    permutation p-values and BH q-values over all property pairs, for the
+    methods that are also in `permuted`.
+    Returns ({method: P x P DataFrame}, long table with one row per pair).
+    """
+    codes, levels = encode_levels(df)
+    names = df.columns
+    i, j = np.triu_indices(len(names), k=1)
+    tables = pair_tables(codes, len(levels))[i, j]
+    observed = correlations_from_tables(tables, levels, methods)
+    tested = [m for m in methods if m in permuted]
+    pvals = permutation_pvalues(codes, levels, observed, tested, n_perm, seed, n_jobs) if n_perm and tested else {}
+
+    pairs = pd.DataFrame({
+        'Property_A': names[i],
+        'Property_B': names[j],
+        'N': tables.sum(axis=(-2, -1)).astype(int),
+    })
+    matrices = {}
+    for m in methods:
+        pairs[m] = observed[m]
+        if m in pvals:
+            pairs[f'{m}_p'] = pvals[m]
+            pairs[f'{m}_q'] = fdr_bh(np.where(np.isnan(observed[m]), np.nan, pvals[m]))
+
+        matrix = np.eye(len(names))
+        matrix[i, j] = matrix[j, i] = observed[m]
+        matrices[m] = pd.DataFrame(matrix, index=names, columns=names)
+    return matrices, pairs
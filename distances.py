@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+import profiler
+from analysis import DESIRED_CODES, SOURCES
+from correlation import fdr_bh
+from id_index import source_letters
+from rating_hist import MISSING, N_CODES, encode_half_points, rating_counts
+from results_store import record
+
+METRICS = ['wasserstein', 'js', 'ks']
+N_PERM = 2000
+CHUNK_SIZE = 100
+
+
+def bin_codes(codes, kept=DESIRED_CODES):
+    """
+    Half-point codes as positions among the kept codes (the histogram bins);
+    ratings outside them become MISSING, as in the normalized tables.
+    """
+    lookup = np.full(N_CODES, MISSING, dtype=np.int64)
+    lookup[list(kept)] = np.arange(len(kept))
+    return np.where(codes != MISSING, lookup[np.maximum(codes, 0)], MISSING)
+
+
+def distribution_distances(counts_a, counts_b, scale):
+    """
+    Distances between the rating distributions in the last axis of two
+    count arrays (any matching leading shape), scale being the rating of
+    each bin:
+
+    - wasserstein: earth mover's distance on the rating scale
+    - js: Jensen-Shannon distance (base 2, so between 0 and 1)
+    - ks: Kolmogorov-Smirnov statistic, the largest gap between the CDFs
+
+    NaN where either side has no ratings.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = counts_a / counts_a.sum(axis=-1, keepdims=True)
+        q = counts_b / counts_b.sum(axis=-1, keepdims=True)
+        gap = np.abs(np.cumsum(p, axis=-1) - np.cumsum(q, axis=-1))
+
+        m = (p + q) / 2
+        kl_p = np.where(p > 0, p * np.log2(p / m), 0.0).sum(axis=-1)
+        kl_q = np.where(q > 0, q * np.log2(q / m), 0.0).sum(axis=-1)
+        js = np.sqrt(np.maximum((kl_p + kl_q) / 2, 0.0))
+
+    empty = (counts_a.sum(axis=-1) == 0) | (counts_b.sum(axis=-1) == 0)
+    return {
+        'wasserstein': np.where(empty, np.nan, (gap[..., :-1] * np.diff(scale)).sum(axis=-1)),
+        'js': np.where(empty, np.nan, js),
+        'ks': np.where(empty, np.nan, gap.max(axis=-1)),
+    }
+
+
+def _permutation_chunk(task):
+    """
+    Counts, per source pair, metric and property, how many of `size`
+    relabellings give a distance at least as large as the observed one.
+    Each relabelling shuffles the source labels of the pair's documents.
+    """
+    binned, groups, pairs, scale, observed, size, seed_seq = task
+    rng = np.random.default_rng(seed_seq)
+    n_props, n_bins = binned.shape[0], len(scale)
+    props = np.arange(n_props)[None, :, None]
+
+    hits = {m: np.zeros((len(pairs), n_props), dtype=np.int64) for m in METRICS}
+    for k, (a, b) in enumerate(pairs):
+        docs = np.nonzero((groups == a) | (groups == b))[0]
+        labels = (groups[docs] == b).astype(np.int64)
+        shuffled = labels[np.argsort(rng.random((size, len(docs))), axis=1)]
+
+        codes = binned[:, docs][None, :, :]
+        batch = np.arange(size)[:, None, None]
+        cell = ((batch * 2 + shuffled[:, None, :]) * n_props + props) * n_bins + codes
+        valid = np.broadcast_to(codes != MISSING, cell.shape)
+        counts = np.bincount(cell[valid], minlength=size * 2 * n_props * n_bins)
+        counts = counts.reshape(size, 2, n_props, n_bins)
+
+        null = distribution_distances(counts[:, 0], counts[:, 1], scale)
+        for m in METRICS:
+            hits[m][k] = (null[m] >= observed[m][k] - 1e-12).sum(axis=0)
+    return hits
+
+
+@profiler.timed
+def permutation_pvalues(binned, groups, pairs, scale, observed, n_perm=N_PERM, seed=0,
+                        n_jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    Label-permutation p-values, (1 + hits) / (1 + n_perm), for every pair,
+    metric and property. Chunks get child seeds spawned from `seed`, so the
+    result does not depend on n_jobs.
+    """
+    sizes = [min(chunk_size, n_perm - start) for start in range(0, n_perm, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(binned, groups, pairs, scale, observed, size, s) for size, s in zip(sizes, seeds)]
+
+    if n_jobs == 1:
+        results = [_permutation_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_permutation_chunk, tasks))
+    profiler.count('permutations', n_perm)
+    return {m: (1 + sum(r[m] for r in results)) / (1 + n_perm) for m in METRICS}
+
+
+def source_distance_tests(df, n_perm=N_PERM, seed=0, n_jobs=1):
+    """
+    Distances between the sources' rating distributions of every property
+    of a Properties x Documents frame (documents grouped by the first
+    letter of their source type, as in analysis.py), for every pair of sources, with
+    permutation p-values and BH q-values over all tests of a metric.
+    Returns a long table with one row per property and source pair.
+    """
+    names = list(SOURCES)
+    letters = [letter for _, letter in SOURCES.values()]
+    groups = pd.Index(letters).get_indexer(source_letters(df.columns))
+    binned = bin_codes(encode_half_points(df))
+    scale = np.array(DESIRED_CODES) / 2
+
+    counts = rating_counts(binned, groups, len(names))[..., :len(scale)]
+    pairs = list(combinations(range(len(names)), 2))
+    a, b = np.array(pairs).T
+    observed = distribution_distances(counts[a], counts[b], scale)
+    pvals = permutation_pvalues(binned, groups, pairs, scale, observed, n_perm, seed, n_jobs) if n_perm else {}
+
+    n_pairs, n_props = len(pairs), len(df.index)
+    table = pd.DataFrame({
+        'Property': np.tile(df.index, n_pairs),
+        'Source_A': np.repeat([names[i] for i in a], n_props),
+        'Source_B': np.repeat([names[i] for i in b], n_props),
+        'N_A': counts[a].sum(axis=-1).ravel(),
+        'N_B': counts[b].sum(axis=-1).ravel(),
+    })
+    for m in METRICS:
+        table[m] = observed[m].ravel()
+        if m in pvals:
+            p = np.where(np.isnan(observed[m]), np.nan, pvals[m]).ravel()
+            table[f'{m}_p'] = p
+            table[f'{m}_q'] = fdr_bh(p)
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Distances between the sources' rating distributions, with permutation tests.")
+    parser.add_argument('--data', default='full.csv', help="Properties x Documents ratings written by analysis.py")
+    parser.add_argument('--output', default='source_distances.csv')
+    parser.add_argument('--n-perm', type=int, default=N_PERM, help="Permutations for the p-values (0 to skip)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes for the permutations")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data, index_col=0)
+    table = source_distance_tests(df, args.n_perm, args.seed, args.jobs)
+    print(table.to_string(index=False))
+    table.to_csv(args.output, index=False)
+    record('source_distances', table, [args.data])
+    print(f"\nSaved results to '{args.output}'")
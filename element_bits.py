@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+from agreement import MISSING, kappa_from_confusion
+
+ELEMENTS = ["Example Present", "Counter-example Present", "Action Present", "Slogan Present"]
+
+
+def pack_units(mask):
+    """
+    Packs a boolean ... x Units array along the units axis into uint64 words
+    (little bit order, zero padded), so a set of documents is one bitset.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    packed = np.packbits(mask, axis=-1, bitorder='little')
+    pad = -packed.shape[-1] % 8
+    if pad:
+        packed = np.pad(packed, [(0, 0)] * (packed.ndim - 1) + [(0, pad)])
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def popcount(words):
+    """
+    Number of set bits in each bitset (summed over the last axis).
+    """
+    return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+
+
+class ElementBits:
+    """
+    Y/N elements of one or more coders as bitsets over documents:
+
+    - yes / valid: Raters x Elements x Words, the documents coded Y / coded Y or N
+    - source_masks: Sources x Words, the documents of each source type
+
+    Presence rates, co-occurrence, Jaccard similarity and Cohen's kappa all
+    come from AND + popcount over these words, 64 documents at a time.
+    """
+
+    def __init__(self, yes, valid, names, source_masks, sources, raters=None):
+        self.yes = yes
+        self.valid = valid
+        self.names = list(names)
+        self.source_masks = source_masks
+        self.sources = list(sources)
+        self.raters = list(range(len(yes))) if raters is None else list(raters)
+
+    @classmethod
+    def from_codes(cls, codes, names, source=None, sources=None, raters=None):
+        """
+        From Units x Elements code arrays (1 = Y, 0 = N, MISSING), one per
+        rater, as agreement.encode_yes_no returns them. source gives each
+        unit's position in sources (negative for none); without it every
+        unit belongs to a single source 'all'.
+        """
+        codes = np.stack([np.asarray(c) for c in codes]).transpose(0, 2, 1)
+        n_units = codes.shape[-1]
+        if source is None:
+            source, sources = np.zeros(n_units, dtype=np.int64), ['all']
+        source = np.asarray(source)
+        source_masks = pack_units(source[None, :] == np.arange(len(sources))[:, None])
+        return cls(pack_units(codes == 1), pack_units(codes != MISSING), names, source_masks, sources, raters)
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """
+        From the binary properties of a CodingMatrix (whose bitsets run over
+        elements, one per unit) by repacking them along the units.
+        """
+        answers = matrix.yes_no()
+        return cls.from_codes(list(answers), matrix.binary_names, matrix.source, matrix.sources, matrix.raters)
+
+    def counts(self):
+        """
+        Raters x Elements number of documents coded Y.
+        """
+        return popcount(self.yes)
+
+    def presence(self):
+        """
+        Raters x Sources x Elements share of each source's documents coded Y
+        (blank and N both count as absent); 0 for a source without documents.
+        """
+        present = popcount(self.yes[:, None, :, :] & self.source_masks[None, :, None, :])
+        sizes = popcount(self.source_masks)[None, :, None]
+        return np.where(sizes > 0, present / np.maximum(sizes, 1), 0.0)
+
+    def cooccurrence(self):
+        """
+        Raters x Elements x Elements number of documents coded Y for both
+        elements; the diagonal is counts().
+        """
+        return popcount(self.yes[:, :, None, :] & self.yes[:, None, :, :])
+
+    def jaccard(self):
+        """
+        Raters x Elements x Elements |A and B| / |A or B| of the documents
+        coded Y, NaN for two elements that never occur.
+        """
+        both = self.cooccurrence()
+        n = np.diagonal(both, axis1=1, axis2=2)
+        union = n[:, :, None] + n[:, None, :] - both
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(union > 0, both / union, np.nan)
+
+    def confusion(self, rater1=0, rater2=1):
+        """
+        Elements x 2 x 2 counts (N/Y of rater1 by N/Y of rater2) on the
+        documents both raters coded.
+        """
+        both = self.valid[rater1] & self.valid[rater2]
+        y1, y2 = self.yes[rater1] & both, self.yes[rater2] & both
+        yy, yn, ny = popcount(y1 & y2), popcount(y1 & ~y2), popcount(~y1 & y2)
+        nn = popcount(both) - yy - yn - ny
+        return np.stack([np.stack([nn, ny], axis=-1), np.stack([yn, yy], axis=-1)], axis=-2)
+
+    def kappa(self, rater1=0, rater2=1):
+        """
+        Unweighted Cohen's kappa per element, NaN where no document was coded by both.
+        """
+        return kappa_from_confusion(self.confusion(rater1, rater2))
+
+    def presence_frame(self, rater=0, source_names=None):
+        names = [(source_names or {}).get(s, s) for s in self.sources]
+        return pd.DataFrame(self.presence()[rater], index=pd.Index(names), columns=pd.Index(self.names))
+
+    def jaccard_frame(self, rater=0):
+        return pd.DataFrame(self.jaccard()[rater], index=pd.Index(self.names), columns=pd.Index(self.names))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from coding_matrix import CodingMatrix
+    from contingency import SOURCE_NAMES
+
+    parser = argparse.ArgumentParser(description="Presence, co-occurrence and kappa of the Y/N elements from bitsets.")
+    parser.add_argument('workbooks', nargs='+', help="One coding workbook per coder")
+    args = parser.parse_args()
+
+    bits = ElementBits.from_matrix(CodingMatrix.from_workbooks(args.workbooks))
+    for r, rater in enumerate(bits.raters):
+        print(f"\n{rater}: % of documents with each element")
+        print((bits.presence_frame(r, SOURCE_NAMES) * 100).round(1).to_string())
+        print(f"\n{rater}: Jaccard similarity between elements")
+        print(bits.jaccard_frame(r).round(3).to_string())
+    if len(bits.raters) >= 2:
+        print("\nCohen's kappa between the first two coders")
+        print(pd.Series(bits.kappa(), index=bits.names).to_string())
@@ -1,7 +1,9 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
+
+from agreement import encode_yes_no
+from coding_cache import load_selected
+from element_bits import ELEMENTS, ElementBits
+from id_index import source_letters
 
 def load_and_process_elements(filename, label):
     """
@@ -10,24 +12,17 @@ def load_and_process_elements(filename, label):
     """
     print(f"Processing {label}...")
     try:
-        df = pd.read_excel(filename)
+        df_T = load_selected(filename, properties=ELEMENTS)  # only the Y/N rows are parsed
     except FileNotFoundError:
         print(f"Error: Could not find {filename}")
         return None
 
-    # 1. Transpose
-    df_T = df.T
-    df_T.columns = df_T.iloc[0] # Header
-    df_T = df_T[1:].reset_index()
+    # 1. Transposed on load (Rows=Documents)
+    df_T = df_T.reset_index()
     df_T.rename(columns={'index': 'DocID'}, inplace=True)
     
     # 2. Filter for the Binary Columns only
-    target_cols = [
-        "Example Present", 
-        "Counter-example Present", 
-        "Action Present", 
-        "Slogan Present"
-    ]
+    target_cols = ELEMENTS
     
     # Check which columns actually exist in this file
     existing_cols = [c for c in target_cols if c in df_T.columns]
@@ -35,32 +30,34 @@ def load_and_process_elements(filename, label):
         print(f"Warning: No binary element columns found in {label}.")
         return None
 
-    # 3. Convert Y/N to 1/0
-    for col in existing_cols:
-        df_T[col] = df_T[col].astype(str).str.strip().str.upper().map({
-            'Y': 1, 'YES': 1, 'N': 0, 'NO': 0
-        }).fillna(0)
+    # 3. Y/N cells as bitsets over the documents (anything else counts as absent)
+    codes, = encode_yes_no([df_T[existing_cols]])
 
     # 4. Extract Source Type
-    df_T['SourceType'] = df_T['DocID'].astype(str).str[0].str.upper()
     name_map = {'V': 'VIS Papers', 'B': 'Books', 'C': 'Crowdsourced', 'W': 'Web Blogs'}
-    df_T['SourceName'] = df_T['SourceType'].map(name_map)
-
-    # 5. Group by Source and Calculate Mean (Percentage)
-    # We use mean() to get a fraction (0.5 = 50%), then multiply by 100 later
-    grouped = df_T.groupby('SourceName')[existing_cols].mean()
-    
-    # 6. Reindex to ensure all Sources appear (even if empty)
     all_sources = ['VIS Papers', 'Books', 'Crowdsourced', 'Web Blogs']
-    grouped = grouped.reindex(all_sources, fill_value=0)
-    
-    # 7. Melt for Seaborn plotting (Wide -> Long format)
+    source_names = pd.Series(source_letters(df_T['DocID'])).map(name_map)
+    source = pd.Index(all_sources).get_indexer(source_names)
+    bits = ElementBits.from_codes([codes], existing_cols, source, all_sources)
+
+    # 5. Share of each source's documents with the element, by popcount
+    # (a source without documents shows 0)
+    grouped = bits.presence_frame()
+    grouped.index.name = 'SourceName'
+
+    # 6. Melt for Seaborn plotting (Wide -> Long format)
     melted = grouped.reset_index().melt(id_vars='SourceName', var_name='Element', value_name='Percentage')
     melted['Percentage'] = melted['Percentage'] * 100 # Convert to %
+
+    print("Jaccard similarity between elements:")
+    print(bits.jaccard_frame().round(3).to_string())
     
     return melted
 
 def plot_side_by_side(df1, df2):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     print("Generating chart...")
     
     # Setup Plot
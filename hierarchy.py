@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+
+from agreement import kappa_from_confusion
+from coding_matrix import SOURCE_TYPES
+from id_index import parse_ids
+from normalize import parse_numbers
+from rating_hist import MISSING, N_CODES, rating_counts
+
+SUMMARY_FILE = 'document_summary.csv'
+
+
+def segment_sum(values, offsets):
+    """
+    Sums of the row segments values[offsets[i]:offsets[i + 1]] in one
+    np.add.reduceat pass; empty segments sum to 0.
+    """
+    values = np.asarray(values)
+    offsets = np.asarray(offsets)
+    starts = offsets[:-1]
+    if len(values) == 0:
+        return np.zeros((len(starts),) + values.shape[1:], dtype=values.dtype)
+    sums = np.add.reduceat(values, np.minimum(starts, len(values) - 1), axis=0)
+    sums[starts == offsets[1:]] = 0  # reduceat gives the start row for an empty segment
+    return sums
+
+
+def _ratio(total, count):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+class DocumentIndex:
+    """
+    Source -> document -> guideline hierarchy of a set of unit IDs
+    ('BK-3 : BK-GL-22'), in CSR form. The units are put in (source,
+    document, guideline) order once; after that
+
+    - order[unit_offsets[d]:unit_offsets[d + 1]] are the units of document d
+    - doc_offsets[s]:doc_offsets[s + 1] are the documents of source s
+
+    so per-document and per-source statistics are segment reductions over
+    contiguous rows, with no string splitting or groupby. IDs that do not
+    parse are left out; `dropped` holds their positions.
+    """
+
+    def __init__(self, ids):
+        self.ids = pd.Index(np.asarray(ids, dtype=object))
+        names, numbers, guidelines = parse_ids(self.ids)
+        parsed = np.array([s is not None for s in names], dtype=bool)
+        seen = {s for s in names if s is not None}
+        self.sources = [s for s in SOURCE_TYPES if s in seen] + sorted(seen - set(SOURCE_TYPES))
+        source = pd.Index(self.sources).get_indexer(pd.Index(names, dtype=object))
+
+        units = np.flatnonzero(parsed)
+        self.order = units[np.lexsort((guidelines[units], numbers[units], source[units]))]
+        self.dropped = np.flatnonzero(~parsed)
+
+        s, d = source[self.order], numbers[self.order]
+        starts = np.flatnonzero(np.r_[True, (s[1:] != s[:-1]) | (d[1:] != d[:-1])]) if len(s) else np.array([], dtype=np.int64)
+        self.unit_offsets = np.r_[starts, len(self.order)].astype(np.int64)
+        self.document_source = s[starts]
+        self.doc_offsets = np.searchsorted(self.document_source, np.arange(len(self.sources) + 1))
+        self.documents = pd.Index([f"{self.sources[a]}-{b}" for a, b in zip(self.document_source, d[starts])],
+                                  name='Document')
+        self.guideline = guidelines[self.order]
+        self.unit_document = np.repeat(np.arange(len(starts)), np.diff(self.unit_offsets))
+
+    @property
+    def n_documents(self):
+        return len(self.documents)
+
+    def sizes(self):
+        """
+        Number of guidelines of each document.
+        """
+        return np.diff(self.unit_offsets)
+
+    def gather(self, values):
+        """
+        Rows of a per-unit array (in the order of ids) in hierarchy order.
+        """
+        return np.asarray(values)[self.order]
+
+    def document_sums(self, values):
+        """
+        Documents x ... sums of a per-unit array.
+        """
+        return segment_sum(self.gather(values), self.unit_offsets)
+
+    def source_sums(self, document_values):
+        """
+        Sources x ... sums of a per-document array, the next level up.
+        """
+        return segment_sum(document_values, self.doc_offsets)
+
+    def _totals(self, ratings):
+        x = self.gather(np.asarray(ratings, dtype=float))
+        valid = ~np.isnan(x)
+        return (segment_sum(np.where(valid, x, 0.0), self.unit_offsets),
+                segment_sum(valid.astype(np.int64), self.unit_offsets))
+
+    def means(self, ratings):
+        """
+        Documents x Properties mean of each document's ratings (Units x
+        Properties floats, NaN where missing); NaN for a document without any.
+        """
+        return _ratio(*self._totals(ratings))
+
+    def source_means(self, ratings):
+        """
+        Sources x Properties mean over all ratings of each source, rolled up
+        from the document totals.
+        """
+        total, count = self._totals(ratings)
+        return _ratio(self.source_sums(total), self.source_sums(count))
+
+    def histograms(self, codes, n_codes=N_CODES):
+        """
+        Documents x Properties x Codes counts of Units x Properties codes
+        (e.g. half-point codes), MISSING left out, in one bincount pass.
+        """
+        return rating_counts(self.gather(codes).T, self.unit_document, self.n_documents)[..., :n_codes]
+
+    def presence(self, answers):
+        """
+        Documents x Elements share of each document's guidelines coded Y
+        (answers are Units x Elements 1 / 0 / MISSING; blank counts as absent).
+        """
+        yes = self.document_sums((np.asarray(answers) == 1).astype(np.int64))
+        return _ratio(yes, self.sizes()[:, None])
+
+    def confusion(self, codes1, codes2, n_labels):
+        """
+        Documents x Properties x K x K counts of two raters' Units x
+        Properties codes, over the guidelines both coded.
+        """
+        c1, c2 = self.gather(codes1), self.gather(codes2)
+        n_props = c1.shape[1]
+        doc = self.unit_document[:, None]
+        cell = ((doc * n_props + np.arange(n_props)[None, :]) * n_labels + c1) * n_labels + c2
+        valid = (c1 != MISSING) & (c2 != MISSING)
+        counts = np.bincount(cell[valid], minlength=self.n_documents * n_props * n_labels * n_labels)
+        return counts.reshape(self.n_documents, n_props, n_labels, n_labels)
+
+    def agreement(self, codes1, codes2, n_labels, weights=None):
+        """
+        Per document and property: number of guidelines both raters coded,
+        share coded identically and Cohen's kappa (NaN where none were coded by both).
+        Returns (n, agreement, kappa), each Documents x Properties.
+        """
+        confusion = self.confusion(codes1, codes2, n_labels)
+        n = confusion.sum(axis=(-2, -1))
+        same = np.trace(confusion, axis1=-2, axis2=-1)
+        return n, _ratio(same, n), kappa_from_confusion(confusion, weights)
+
+
+def document_means_frame(df):
+    """
+    Properties x Documents means of a Properties x Units ratings frame
+    (as in full.csv): documents as the unit of analysis. Text cells and
+    IDs that do not parse are left out.
+    """
+    index = DocumentIndex(df.columns)
+    means = index.means(parse_numbers(df).T)
+    return pd.DataFrame(means.T, index=df.index, columns=index.documents)
+
+
+def document_summary(matrix):
+    """
+    Long table with one row per document and property of a CodingMatrix:
+    source, number of guidelines and, per rater, the mean rating
+    (ordinal properties) or share of guidelines coded Y (binary ones). With
+    two raters or more, the first two raters' share of identical codes and
+    quadratic-weighted kappa per document are added.
+    """
+    index = DocumentIndex(matrix.unit_ids)
+    base = {'Document': index.documents, 'Source': [index.sources[s] for s in index.document_source],
+            'Guidelines': index.sizes()}
+    ratings, answers = matrix.ratings(), matrix.yes_no()
+    values = {'ordinal': [index.means(x) for x in ratings], 'binary': [index.presence(x) for x in answers]}
+    tables = []
+    for kind, names in [('ordinal', matrix.ordinal_names), ('binary', matrix.binary_names)]:
+        for j, name in enumerate(names):
+            table = pd.DataFrame({**base, 'Property': name, 'Kind': kind})
+            for r, by_rater in enumerate(values[kind]):
+                table[f'Value_{r + 1}'] = by_rater[:, j]
+            tables.append(table)
+    summary = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=list(base))
+
+    if len(matrix.raters) >= 2:
+        n, agree, kappa = [], [], []
+        if matrix.ordinal_names:
+            result = index.agreement(matrix.ordinal[0], matrix.ordinal[1], N_CODES, 'quadratic')
+            n.append(result[0]), agree.append(result[1]), kappa.append(result[2])
+        if matrix.binary_names:
+            result = index.agreement(answers[0], answers[1], 2)
+            n.append(result[0]), agree.append(result[1]), kappa.append(result[2])
+        # Same property order as the rows above: ordinal properties, then binary ones
+        summary['Both_Coded'] = np.concatenate([x.T.ravel() for x in n])
+        summary['Agreement'] = np.concatenate([x.T.ravel() for x in agree])
+        summary['Kappa'] = np.concatenate([x.T.ravel() for x in kappa])
+    return summary
+
+
+def write_summary(filenames, output=SUMMARY_FILE):
+    """
+    Prints and saves the document summary of the coders' workbooks and
+    stores it as the 'document_summary' statistic.
+    """
+    from coding_matrix import CodingMatrix
+    from results_store import record
+
+    summary = document_summary(CodingMatrix.from_workbooks(filenames))
+    with pd.option_context('display.width', 200):
+        print(summary.to_string(index=False))
+    summary.to_csv(output, index=False)
+    record('document_summary', summary, filenames)
+    print(f"\nSaved {summary['Document'].nunique()} documents to '{output}'")
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ratings, element presence and agreement rolled up to documents.")
+    parser.add_argument('workbooks', nargs='+', help="One coding workbook per coder")
+    parser.add_argument('--output', default=SUMMARY_FILE)
+    args = parser.parse_args()
+
+    write_summary(args.workbooks, args.output)
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+from scipy import special
+
+import profiler
+
+ICC_TYPES = ['ICC1', 'ICC2', 'ICC3', 'ICC1k', 'ICC2k', 'ICC3k']
+
+
+def mean_squares(ratings):
+    """
+    Two-way ANOVA mean squares for every label at once.
+    ratings is Labels x Targets x Raters; a target missing any rating for a
+    label is dropped for that label (listwise, like pingouin's nan_policy='omit').
+    Returns a dict of per-label arrays: n, k, msb (targets), msj (raters),
+    mse (residual) and msw (within targets).
+    """
+    ratings = np.asarray(ratings, dtype=float)
+    k = ratings.shape[-1]
+
+    complete = ~np.isnan(ratings).any(axis=-1)
+    y = np.where(complete[..., None], ratings, 0.0)
+    n = complete.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grand = y.sum(axis=(-2, -1)) / (n * k)
+        target_means = y.sum(axis=-1) / k
+        rater_means = y.sum(axis=-2) / n[:, None]
+
+        dev = np.where(complete[..., None], y - grand[:, None, None], 0.0)
+        ss_total = (dev ** 2).sum(axis=(-2, -1))
+        ss_targets = k * (np.where(complete, target_means - grand[:, None], 0.0) ** 2).sum(axis=-1)
+        ss_raters = n * ((rater_means - grand[:, None]) ** 2).sum(axis=-1)
+        ss_error = ss_total - ss_targets - ss_raters
+
+        return {
+            'n': n,
+            'k': k,
+            'msb': ss_targets / (n - 1),
+            'msj': ss_raters / (k - 1),
+            'mse': ss_error / ((n - 1) * (k - 1)),
+            'msw': (ss_raters + ss_error) / (n * (k - 1)),
+        }
+
+
+def weighted_mean_squares(ratings, unit_weights):
+    """
+    mean_squares for each row of unit_weights (Resamples x Targets), where a
+    weight is how many times the target is counted (bootstrap multiplicities,
+    or 0/1 for jackknife). Works from per-target sufficient statistics, so all
+    resamples cost a few matrix products. Arrays are Resamples x Labels.
+    """
+    ratings = np.asarray(ratings, dtype=float)
+    w = np.asarray(unit_weights, dtype=float)
+    k = ratings.shape[-1]
+
+    complete = ~np.isnan(ratings).any(axis=-1)
+    y = np.where(complete[..., None], ratings, 0.0)
+    target_sums = y.sum(axis=-1)
+
+    n = w @ complete.T
+    total = w @ target_sums.T
+    total_sq = w @ (y ** 2).sum(axis=-1).T
+    target_sq = w @ (target_sums ** 2).T
+    rater_sums = np.einsum('bt,ltr->blr', w, y)
+    return mean_squares_from_sums(n, total, total_sq, target_sq, rater_sums, k)
+
+
+def mean_squares_from_sums(n, total, total_sq, target_sq, rater_sums, k):
+    """
+    mean_squares from sums over the complete targets: their count n, the
+    sum of all ratings, of squared ratings, of squared target sums, and the
+    per-rater sums (last axis k). Any leading shape.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correction = total ** 2 / (n * k)
+        ss_total = total_sq - correction
+        ss_targets = target_sq / k - correction
+        ss_raters = (rater_sums ** 2).sum(axis=-1) / n - correction
+        ss_error = ss_total - ss_targets - ss_raters
+
+        return {
+            'n': n,
+            'k': k,
+            'msb': ss_targets / (n - 1),
+            'msj': ss_raters / (k - 1),
+            'mse': ss_error / ((n - 1) * (k - 1)),
+            'msw': (ss_raters + ss_error) / (n * (k - 1)),
+        }
+
+
+def icc_values(ms):
+    """
+    The six ICCs (dict of arrays) from mean squares of any shape.
+    """
+    n, k = ms['n'], ms['k']
+    msb, msj, mse, msw = ms['msb'], ms['msj'], ms['mse'], ms['msw']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'ICC1': (msb - msw) / (msb + (k - 1) * msw),
+            'ICC2': (msb - mse) / (msb + (k - 1) * mse + k * (msj - mse) / n),
+            'ICC3': (msb - mse) / (msb + (k - 1) * mse),
+            'ICC1k': (msb - msw) / msb,
+            'ICC2k': (msb - mse) / (msb + (msj - mse) / n),
+            'ICC3k': (msb - mse) / msb,
+        }
+
+
+def icc_replicates(data, unit_weights):
+    """
+    One ICC type for every label under each row of unit_weights.
+    data is (ratings, icc_type); used by bootstrap.py.
+    """
+    ratings, icc_type = data
+    return icc_values(weighted_mean_squares(ratings, unit_weights))[icc_type]
+
+
+def icc_from_mean_squares(ms, alpha=0.05):
+    """
+    The six Shrout & Fleiss ICCs with F tests and F-based confidence
+    intervals, computed with the same formulas pingouin uses.
+    Returns a DataFrame with one row per label.
+    """
+    n, k = ms['n'].astype(float), ms['k']
+    msb, msj, mse, msw = ms['msb'], ms['msj'], ms['mse'], ms['msw']
+    q = 1 - alpha / 2
+    iccs = icc_values(ms)
+    icc2 = iccs['ICC2']
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df1 = n - 1
+        df1kd = n * (k - 1)
+        df2kd = (n - 1) * (k - 1)
+        f1 = msb / msw
+        f3 = msb / mse
+        p1 = special.fdtrc(df1, df1kd, f1)
+        p3 = special.fdtrc(df1, df2kd, f3)
+
+        # Cases 1 and 3
+        f1l = f1 / special.fdtri(df1, df1kd, q)
+        f1u = f1 * special.fdtri(df1kd, df1, q)
+        f3l = f3 / special.fdtri(df1, df2kd, q)
+        f3u = f3 * special.fdtri(df2kd, df1, q)
+
+        # Case 2 (Satterthwaite degrees of freedom)
+        fj = msj / mse
+        vn = df2kd * (k * icc2 * fj + n * (1 + (k - 1) * icc2) - k * icc2) ** 2
+        vd = df1 * k ** 2 * icc2 ** 2 * fj ** 2 + (n * (1 + (k - 1) * icc2) - k * icc2) ** 2
+        v = vn / vd
+        f2u = special.fdtri(df1, v, q)
+        f2l = special.fdtri(v, df1, q)
+        l2 = n * (msb - f2u * mse) / (f2u * (k * msj + (k * n - k - n) * mse) + n * msb)
+        u2 = n * (f2l * msb - mse) / (k * msj + (k * n - k - n) * mse + n * f2l * msb)
+
+        table = {
+            'n': ms['n'],
+            **iccs,
+            'F1': f1, 'df1_1': df1, 'df2_1': df1kd, 'pval1': p1,
+            'F23': f3, 'df1_23': df1, 'df2_23': df2kd, 'pval23': p3,
+            'ICC1_low': (f1l - 1) / (f1l + (k - 1)), 'ICC1_high': (f1u - 1) / (f1u + (k - 1)),
+            'ICC2_low': l2, 'ICC2_high': u2,
+            'ICC3_low': (f3l - 1) / (f3l + (k - 1)), 'ICC3_high': (f3u - 1) / (f3u + (k - 1)),
+            'ICC1k_low': 1 - 1 / f1l, 'ICC1k_high': 1 - 1 / f1u,
+            'ICC2k_low': l2 * k / (1 + l2 * (k - 1)), 'ICC2k_high': u2 * k / (1 + u2 * (k - 1)),
+            'ICC3k_low': 1 - 1 / f3l, 'ICC3k_high': 1 - 1 / f3u,
+        }
+    return pd.DataFrame(table)
+
+
+@profiler.timed
+def icc_all(ratings, labels=None, alpha=0.05):
+    """
+    ICC table (one row per label) straight from a Labels x Targets x Raters array.
+    """
+    table = icc_from_mean_squares(mean_squares(ratings), alpha)
+    if labels is not None:
+        table.index = pd.Index(labels)
+    return table
@@ -0,0 +1,306 @@
+import hashlib
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+ID_PATTERN = re.compile(r'^\s*([A-Za-z]+)\s*-?\s*(\d+)\s*:\s*(?:[A-Za-z]+\s*-?\s*)?GL\s*-?\s*(\d+)\s*$', re.IGNORECASE)
+MAX_DISTANCE = 2
+
+# Canonical keys pack (source letters, document, guideline) into one int64:
+# the source type in base 27 (A = 1 ... Z = 26, up to 6 letters) and
+# 17 bits each for the document and guideline numbers
+SOURCE_LETTERS = 6
+NUMBER_BITS = 17
+
+
+def parse_ids(ids):
+    """
+    Splits 'VIS-2 : VIS-GL-4' style IDs into source type, document and
+    guideline numbers. IDs that do not parse get source None and -1 numbers.
+    Returns (sources, documents, guidelines).
+    """
+    parts = pd.Series(np.asarray(ids, dtype=object)).astype(str).str.extract(ID_PATTERN)
+    parsed = parts[0].notna().to_numpy()
+    sources = np.where(parsed, parts[0].str.upper().to_numpy(dtype=object), None)
+    documents = np.where(parsed, pd.to_numeric(parts[1]).fillna(-1).to_numpy(), -1).astype(np.int32)
+    guidelines = np.where(parsed, pd.to_numeric(parts[2]).fillna(-1).to_numpy(), -1).astype(np.int32)
+    return sources, documents, guidelines
+
+
+def compact_ids(ids):
+    """
+    IDs upper-cased without any whitespace: the text fuzzy matching
+    compares ('' for a missing ID).
+    """
+    text = pd.Index(np.asarray(ids, dtype=object)).astype(str).fillna('')
+    return text.str.replace(r'\s+', '', regex=True).str.upper()
+
+
+def _source_numbers(sources):
+    """
+    Base-27 number of each source type's letters (distinct types computed
+    once); -1 for None and for types longer than SOURCE_LETTERS.
+    """
+    codes, uniques = pd.factorize(np.asarray(sources, dtype=object))
+    numbers = np.full(len(uniques) + 1, -1, dtype=np.int64)
+    for i, source in enumerate(uniques):
+        if len(source) <= SOURCE_LETTERS:
+            numbers[i] = sum((ord(letter) - ord('A') + 1) * 27 ** k for k, letter in enumerate(reversed(source)))
+    return numbers[codes]  # code -1 (None) picks the trailing -1
+
+
+def _text_keys(texts):
+    """
+    Negative int64 keys hashed from text (64-bit BLAKE2b with the sign bit set).
+    """
+    keys = [int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), 'little') | (1 << 63)
+            for t in texts]
+    return np.array(keys, dtype=np.uint64).view(np.int64)
+
+
+def canonical_keys(ids, parsed=None):
+    """
+    int64 key of each ID. IDs that parse pack their source letters,
+    document and guideline numbers, so every spelling of a unit
+    ('VIS-6 : VIS-GL-15', 'VIS-6: VIS-GL-15', 'vis-6 : VIS-GL-15') has one
+    key; the guideline's own prefix is not part of it, as in
+    coding_matrix.unit_keys. Other IDs get a negative key hashed from their
+    compact text. parsed takes parse_ids' result when it is already known.
+    """
+    sources, documents, guidelines = parse_ids(ids) if parsed is None else parsed
+    source = _source_numbers(sources)
+    limit = 1 << NUMBER_BITS
+    packable = (source >= 0) & (documents >= 0) & (documents < limit) & (guidelines >= 0) & (guidelines < limit)
+
+    keys = ((source << (2 * NUMBER_BITS)) | (documents.astype(np.int64) << NUMBER_BITS)
+            | guidelines.astype(np.int64))
+    keys = np.where(packable, keys, -1)
+    if not packable.all():
+        keys[~packable] = _text_keys(compact_ids(np.asarray(ids, dtype=object)[~packable]))
+    return keys
+
+
+def source_letters(ids):
+    """
+    First letter of each ID's source type (V, C, W, B), the letter the
+    scripts group documents by; for IDs that do not parse, the first
+    character of their compact text. Each distinct ID is parsed once.
+    """
+    codes, uniques = pd.factorize(np.asarray(ids, dtype=object), use_na_sentinel=False)
+    sources, _, _ = parse_ids(uniques)
+    letters = [s[0] if s is not None else c[:1] for s, c in zip(sources, compact_ids(uniques))]
+    return pd.Index(np.array(letters, dtype=object)[codes])
+
+
+def edit_distance(a, b, limit=None):
+    """
+    Levenshtein distance between two strings; with a limit, stops early
+    and returns limit + 1 once the distance is known to exceed it.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletions(text, depth):
+    """
+    Every string reachable from text by deleting up to `depth` characters.
+    """
+    found = {text}
+    frontier = {text}
+    for _ in range(depth):
+        frontier = {t[:i] + t[i + 1:] for t in frontier for i in range(len(t))}
+        found |= frontier
+    return found
+
+
+class EditIndex:
+    """
+    Strings indexed by their deletion neighbourhoods (as in SymSpell): two
+    strings within k edits always share a string obtained by deleting at
+    most k characters from each. A lookup hashes the query's own
+    deletions and computes the exact distance only to the strings it
+    collides with, so it does not grow with the number of strings indexed.
+    """
+
+    def __init__(self, texts, max_distance=MAX_DISTANCE):
+        self.texts = list(texts)
+        self.max_distance = max_distance
+        self.table = defaultdict(list)
+        for i, text in enumerate(self.texts):
+            for deleted in _deletions(text, max_distance):
+                self.table[deleted].append(i)
+
+    def lookup(self, text, max_distance=None):
+        """
+        (distance, position) of the indexed strings within max_distance
+        edits of text, closest first.
+        """
+        k = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        candidates = {i for deleted in _deletions(text, k) for i in self.table.get(deleted, ())}
+        found = [(edit_distance(text, self.texts[i], k), i) for i in candidates]
+        return sorted((d, i) for d, i in found if d <= k)
+
+
+class IdIndex:
+    """
+    The unit IDs of one coder file with their structured keys (source
+    type, document and guideline numbers) and canonical int64 keys. Joins
+    with other files go through a hash table on the keys, so matching n
+    IDs costs O(n) however many files or guidelines there are.
+    A unit spelled more than once keeps its first row.
+    """
+
+    def __init__(self, ids):
+        self.ids = pd.Index(np.asarray(ids, dtype=object))
+        self.source, self.document, self.guideline = parse_ids(self.ids)
+        self.keys = canonical_keys(self.ids, (self.source, self.document, self.guideline))
+        table = pd.Index(self.keys)
+        self.duplicated = table.duplicated()
+        self._first = np.flatnonzero(~self.duplicated)
+        self._table = table[self._first]
+
+    @classmethod
+    def from_workbook(cls, filename):
+        from coding_cache import workbook_header
+
+        documents, _ = workbook_header(filename)
+        return cls(documents)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, keys):
+        """
+        Row of each canonical key in this file (its first spelling), -1 when absent.
+        """
+        found = self._table.get_indexer(np.asarray(keys, dtype=np.int64))
+        return np.where(found >= 0, self._first[found], -1)
+
+    def join(self, other):
+        """
+        Inner join with another file's index: (rows here, rows there) of the
+        units both have, in this file's order.
+        """
+        found = other.positions(self.keys)
+        rows = np.flatnonzero((found >= 0) & ~self.duplicated)
+        return rows, found[rows]
+
+    def unmatched(self, other):
+        """
+        Rows here whose unit the other file does not have.
+        """
+        return np.flatnonzero((other.positions(self.keys) < 0) & ~self.duplicated)
+
+    def respellings(self, other):
+        """
+        {ID here: the other file's spelling} for the units both have but spell differently.
+        """
+        rows, found = self.join(other)
+        mine, theirs = self.ids[rows], other.ids[found]
+        return {a: b for a, b in zip(mine, theirs) if a != b}
+
+    def near_misses(self, other, max_distance=MAX_DISTANCE):
+        """
+        Proposed matches for the IDs that do not join: every unmatched ID
+        here against the other file's unmatched IDs within max_distance
+        edits of their compact text, closest first.
+        Returns a table with ID, Match and Distance columns.
+        """
+        mine, theirs = self.unmatched(other), other.unmatched(self)
+        index = EditIndex(compact_ids(other.ids[theirs]), max_distance)
+        rows = []
+        for row, text in zip(mine, compact_ids(self.ids[mine])):
+            for distance, i in index.lookup(text):
+                rows.append({'ID': self.ids[row], 'Match': other.ids[theirs[i]], 'Distance': distance})
+        return pd.DataFrame(rows, columns=['ID', 'Match', 'Distance'])
+
+
+def _numbers(ids):
+    """
+    The digit runs of each ID's compact text, e.g. ('3', '22') for 'BK-3 : BK-GL-22'.
+    """
+    return [tuple(re.findall(r'\d+', text)) for text in compact_ids(ids)]
+
+
+def proposed_corrections(near_misses):
+    """
+    {ID: match} candidates for manual review among the near misses: the ID's
+    closest match is the only one at that distance, no other ID claims it,
+    and both have the same document and guideline numbers (a near miss that
+    changes a number is a different guideline, however few edits apart).
+    Nothing here is applied automatically.
+    """
+    if near_misses.empty:
+        return {}
+    near_misses = near_misses[[a == b for a, b in zip(_numbers(near_misses['ID']), _numbers(near_misses['Match']))]]
+    closest = near_misses[near_misses['Distance'] == near_misses.groupby('ID')['Distance'].transform('min')]
+    closest = closest[~closest['ID'].duplicated(keep=False) & ~closest['Match'].duplicated(keep=False)]
+    return dict(zip(closest['ID'], closest['Match']))
+
+
+def common_units(frames):
+    """
+    Documents x Properties frames restricted to the units all of them have,
+    matched on canonical keys, in the first frame's order. Each frame keeps
+    its own spelling of the IDs.
+    """
+    indexes = [IdIndex(df.index) for df in frames]
+    rows = indexes[0]._first
+    for other in indexes[1:]:
+        found = other.positions(indexes[0].keys[rows])
+        rows = rows[found >= 0]
+    return [df.iloc[other.positions(indexes[0].keys[rows])] for df, other in zip(frames, indexes)]
+
+
+def unify_ids(id_lists):
+    """
+    Each list of IDs with every spelling of a unit replaced by the first
+    spelling seen (going through the lists in order), so that frames can be
+    combined on their labels without keeping whitespace variants apart.
+    """
+    ids = [np.asarray(i, dtype=object) for i in id_lists]
+    everything = np.concatenate(ids) if ids else np.array([], dtype=object)
+    codes, _ = pd.factorize(canonical_keys(everything))
+    first = np.full(codes.max() + 1 if len(codes) else 0, -1, dtype=np.int64)
+    first[codes[::-1]] = np.arange(len(codes))[::-1]  # earliest position of each key
+    spelled = everything[first[codes]]
+    bounds = np.cumsum([0] + [len(i) for i in ids])
+    return [list(spelled[bounds[k]:bounds[k + 1]]) for k in range(len(ids))]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Join two coders' workbooks on their unit IDs and propose matches for near misses.")
+    parser.add_argument('workbooks', nargs=2, help="The two coders' workbooks")
+    parser.add_argument('--max-distance', type=int, default=MAX_DISTANCE, help="Edits allowed in a proposed match")
+    parser.add_argument('--output', default='id_matches.csv')
+    args = parser.parse_args()
+
+    first, second = (IdIndex.from_workbook(f) for f in args.workbooks)
+    rows, _ = first.join(second)
+    print(f"{len(rows)} units in both workbooks; {len(first.unmatched(second))} only in "
+          f"{args.workbooks[0]}, {len(second.unmatched(first))} only in {args.workbooks[1]}")
+    for a, b in first.respellings(second).items():
+        print(f"  same unit, spelled differently: '{a}' / '{b}'")
+
+    proposals = first.near_misses(second, args.max_distance)
+    if proposals.empty:
+        print("No near misses")
+    else:
+        print(proposals.to_string(index=False))
+    proposals.to_csv(args.output, index=False)
+    print(f"\nSaved proposed matches to '{args.output}'")
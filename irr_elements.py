@@ -1,83 +1,82 @@
 import pandas as pd
-from sklearn.metrics import cohen_kappa_score
 
+import profiler
+from agreement import encode_yes_no, kappa_replicates
+from bootstrap import N_BOOT, confidence_intervals
+from coding_cache import load_common
+from element_bits import ELEMENTS, ElementBits, popcount
+from id_index import canonical_keys, common_units
+from results_store import record
+
+RATER_FILES = ["Validation Study_Sophie.xlsx", "CN_processed_FIXED.xlsx"]
+
+@profiler.timed
 def load_and_preprocess(filename1, filename2):
     """
-    Loads the two Excel files, finds common documents, and transposes them.
+    Loads the Y/N element rows of the documents both Excel files have
+    (matched on their canonical unit keys), transposed and indexed by the
+    first file's IDs. Nothing else is parsed from the workbooks.
     """
     print("Loading data...")
     try:
-        r1 = pd.read_excel(filename1)
-        r2 = pd.read_excel(filename2)
+        r1, r2 = load_common([filename1, filename2], properties=ELEMENTS, key=canonical_keys)
     except FileNotFoundError:
         print("Error: Could not find one of the files.")
         return None, None
 
-    common_docs = r1.columns.intersection(r2.columns)
-    
-    def prepare_df(df, common_cols):
-        df_subset = df[common_cols]
-        
-        df_T = df_subset.T
-        
-        df_T.columns = df_T.iloc[0]
-        
-        df_T = df_T[1:]
-        
-        return df_T
-
-    df1 = prepare_df(r1, common_docs)
-    df2 = prepare_df(r2, common_docs)
+    df1, df2 = common_units([r1, r2])
+    df2.index = df1.index
     
     return df1, df2
 
-def calculate_binary_kappa(df1, df2):
+@profiler.timed
+def calculate_binary_kappa(df1, df2, n_boot=N_BOOT, seed=0, n_jobs=1, inputs=RATER_FILES):
     print("\n--- Binary Cohen's Kappa (Yes/No Elements) ---")
     
-    results = {}
-    
-    common_labels = df1.columns.intersection(df2.columns)
+    labels = [label for label in df1.columns.intersection(df2.columns)
+              if not (str(label).lower() in ['rater', 'id', 'nan'] or str(label).startswith("EX"))]
 
-    for label in common_labels:
-        if str(label).lower() in ['rater', 'id', 'nan'] or str(label).startswith("EX"):
-            continue
-            
-        s1 = df1[label].astype(str).str.strip().str.upper()
-        s2 = df2[label].astype(str).str.strip().str.upper()
-        
-        valid_values = {'Y', 'N', 'YES', 'NO'}
-        unique_vals = set(s1.unique()) | set(s2.unique())
-        
-        if not unique_vals.intersection(valid_values):
-            continue
+    codes1, codes2 = encode_yes_no([df1[labels], df2[labels]])
+    bits = ElementBits.from_codes([codes1, codes2], labels)
+    kappas = bits.kappa()
+
+    has_yes_no = popcount(bits.valid[0] | bits.valid[1]) > 0
+    has_pairs = popcount(bits.valid[0] & bits.valid[1]) > 0
 
-        mapping = {'Y': 1, 'YES': 1, 'N': 0, 'NO': 0}
-        
-        clean_s1 = s1.map(mapping)
-        clean_s2 = s2.map(mapping)
-        
-        temp_df = pd.DataFrame({'R1': clean_s1, 'R2': clean_s2}).dropna()
-        
-        if temp_df.empty:
+    results = {}
+    for label, k, yes_no, pairs in zip(labels, kappas, has_yes_no, has_pairs):
+        if not yes_no:
+            continue
+        if not pairs:
             print(f"Skipping {label} (No valid Y/N pairs found)")
             continue
-            
-        try:
-            k = cohen_kappa_score(temp_df['R1'], temp_df['R2'], weights=None)
-            results[label] = k
-        except Exception as e:
-            print(f"Error calculating {label}: {e}")
+        results[label] = k
 
     if not results:
         print("No Y/N columns found to analyze.")
     else:
         result_df = pd.DataFrame.from_dict(results, orient='index', columns=['Cohen_Kappa'])
+
+        if n_boot:
+            ci = confidence_intervals(kappa_replicates, (codes1, codes2, 2, None),
+                                      len(codes1), kappas, n_boot, seed, n_jobs)
+            ci.index = labels
+            result_df = result_df.join(ci)
         print(result_df)
         result_df.to_csv("output_elements_kappa.csv")
+        record('elements_kappa', result_df.rename_axis('Property'), inputs)
         print("\nSaved results to 'output_elements_kappa.csv'")
 
 if __name__ == "__main__":
-    df_sophie, df_cat = load_and_preprocess("Validation Study_Sophie.xlsx", "CN_processed_FIXED.xlsx")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cohen's kappa on the Y/N element columns.")
+    parser.add_argument('--n-boot', type=int, default=N_BOOT, help="Bootstrap resamples for the CIs (0 to skip)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes for the bootstrap")
+    args = parser.parse_args()
+
+    df_sophie, df_cat = load_and_preprocess(*RATER_FILES)
     
     if df_sophie is not None:
-        calculate_binary_kappa(df_sophie, df_cat)
\ No newline at end of file
+        calculate_binary_kappa(df_sophie, df_cat, args.n_boot, args.seed, args.jobs)
@@ -1,27 +1,36 @@
 import numpy as np
 import pandas as pd
-from sklearn.metrics import cohen_kappa_score
-import pingouin as pg
-import sys
 
-def data_preprocess():
-    r1 = pd.read_excel("SS_Updated_Coding.xlsx")
+import profiler
+from agreement import cohen_kappa_all, encode_ordinal, kappa_replicates
+from bootstrap import N_BOOT, confidence_intervals
+from coding_cache import load_common
+from icc import icc_all, icc_replicates
+from id_index import canonical_keys, common_units
+from normalize import clean_ids, parse_numbers, recode
+from results_store import record
 
-    r2 = pd.read_excel("CN_Updated_Coding.xlsx")
+RATER_FILES = ["SS_Updated_Coding.xlsx", "CN_Updated_Coding.xlsx"]
+ICC_RECODING = 'collapse'  # ratings merged before the ICC (normalize.RECODINGS)
 
-    r1.columns = r1.columns.astype(str).str.replace(' ', '').str.strip()
-    r2.columns = r2.columns.astype(str).str.replace(' ', '').str.strip()
+@profiler.timed
+def common_documents(filenames=RATER_FILES):
+    """
+    Both raters' frames on the documents and properties they both coded,
+    matched on their canonical unit keys (so 'VIS-6: VIS-GL-15' meets
+    'VIS-6 : VIS-GL-15') and indexed by the first rater's IDs without
+    spaces. Only those cells are parsed from the workbooks.
+    """
+    r1, r2 = load_common(filenames[:2], key=canonical_keys)
+    r1, r2 = common_units([r1, r2])
 
-    common_cols = r1.columns.intersection(r2.columns)
+    r1.index = r2.index = clean_ids(r1.index)
+    return r1, r2
 
-    # Subset both DataFrames to those columns
-    df1_common = r1[common_cols]
-    df2_common = r2[common_cols]
+def data_preprocess(filenames=RATER_FILES):
+    df1_common, df2_common = common_documents(filenames)
 
-    r1_file = df1_common.T
-
-    r1_file.columns = r1_file.iloc[0]
-    r1_file = r1_file[1:].reset_index(drop=True)
+    r1_file = df1_common.reset_index(drop=True)
 
 
 
@@ -31,9 +40,7 @@ def data_preprocess():
     r1_file['ID'] = r1_file.index
 
 
-    r2_file = df2_common.T
-    r2_file.columns = r2_file.iloc[0]
-    r2_file = r2_file[1:].reset_index(drop=True)
+    r2_file = df2_common.reset_index(drop=True)
     r2_file['rater'] = 2
     r2_file['ID'] = r2_file.index
 
@@ -41,100 +48,87 @@ def data_preprocess():
 
 
 
-def icc_analysis(df1_input, df2_input):
+@profiler.timed
+def icc_analysis(df1_input, df2_input, n_boot=N_BOOT, seed=0, n_jobs=1, inputs=RATER_FILES):
     r1_file = df1_input.copy()
     r2_file = df2_input.copy()
 
-    results = {}
-
     numeric_cols = r1_file.select_dtypes(include='number').columns
     print(numeric_cols)
 
-    for label in r1_file.columns:
-        if label ==  'ID' or label.startswith("EX"):
-            continue
-        cols = [label, 'rater', 'ID']
-        r1_file[label] = r1_file[label].fillna('missing').infer_objects()
-        r2_file[label] = r2_file[label].fillna('missing').infer_objects()
-
-        if r1_file[label].nunique() > 1 or r2_file[label].nunique() > 1:
-            r1_file[label] = r1_file[label].replace({4: 5, '4': '5', 2: 1, '2': '1'})
-            r2_file[label] = r2_file[label].replace({4: 5, '4': '5', 2: 1, '2': '1'})
-            class_df = pd.concat([r1_file[cols], r2_file[cols]])
-            class_df[label] = pd.to_numeric(class_df[label], errors='coerce')  # non-numbers become NaN
-
-            if class_df[label].dropna().empty:
-                print(f"Skipping '{label}' because it has no numeric values.")
-                results[label] = float('nan')
-            else:
-                icc = pg.intraclass_corr(
-                    data=class_df,
-                    targets='ID',
-                    raters='rater',
-                    ratings=label
-                )
-                icc_value = icc.loc[icc['Type'] == 'ICC3', 'ICC'].values[0]
-                results[label] = icc_value
-        else:
-            results[label] = float('nan')
+    labels = [label for label in r1_file.columns if not (label == 'ID' or label.startswith("EX"))]
 
+    # Only properties where at least one rater used more than one value
+    varies = ((r1_file[labels].nunique(dropna=False) > 1) |
+              (r2_file[labels].nunique(dropna=False) > 1))
+    varying = [label for label in labels if varies[label]]
 
-    df = pd.DataFrame.from_dict(results, orient='index').transpose()
+    s1 = recode(parse_numbers(r1_file[varying]), ICC_RECODING)  # non-numbers become NaN
+    s2 = recode(parse_numbers(r2_file[varying]), ICC_RECODING)
 
-    # Save to CSV
-    df.to_csv('output_icc_updated.csv', index=False)
-
-def weighted_kappa_analysis(df1_input, df2_input):
-    r1_file = df1_input.copy()
-    r2_file = df2_input.copy()
+    # Labels x Targets x Raters, all labels in one closed-form pass
+    ratings = np.stack([s1.T, s2.T], axis=-1)
+    iccs = icc_all(ratings, labels=varying)
 
-    results = {}
+    results = pd.DataFrame({'ICC3': float('nan')}, index=pd.Index(labels, name='Property'))
+    for i, label in enumerate(varying):
+        if np.isnan(ratings[i]).all():
+            print(f"Skipping '{label}' because it has no numeric values.")
+        else:
+            results.at[label, 'ICC3'] = iccs.at[label, 'ICC3']
 
-    for label in r1_file.columns:
-        if label == 'ID' or str(label).startswith("EX") or label == 'rater':
-            continue
+    # Bootstrap over guidelines, every label evaluated on each resample at once
+    if n_boot:
+        ci = confidence_intervals(icc_replicates, (ratings, 'ICC3'), ratings.shape[1],
+                                  results.loc[varying, 'ICC3'], n_boot, seed, n_jobs)
+        results = results.join(ci.set_index(pd.Index(varying, name='Property')))
 
-        # 1. Map Yes/No and ensure Numeric
-        s1 = pd.to_numeric(r1_file[label], errors='coerce')
-        s2 = pd.to_numeric(r2_file[label], errors='coerce')
+    # Save to CSV
+    results.to_csv('output_icc_updated.csv')
+    record('icc', results, inputs)
 
-        temp_df = pd.DataFrame({'R1': s1, 'R2': s2})
-        temp_df = temp_df.dropna()
+@profiler.timed
+def weighted_kappa_analysis(df1_input, df2_input, n_boot=N_BOOT, seed=0, n_jobs=1, inputs=RATER_FILES):
+    r1_file = df1_input.copy()
+    r2_file = df2_input.copy()
 
-        if temp_df.empty:
-            results[label] = float('nan')
-            continue
+    labels = [label for label in r1_file.columns
+              if not (label == 'ID' or str(label).startswith("EX") or label == 'rater')]
 
-        y1 = temp_df['R1'].astype(int)
-        y2 = temp_df['R2'].astype(int)
-        
-        unique_values = np.unique(np.concatenate([y1, y2]))
-        
-        if len(unique_values) < 2:
-             # Perfect agreement on a constant value (e.g. both voted 1 for everything)
-             # Kappa is technically 1.0, but sklearn might return 0 or nan if vectors are constant.
-             # Manual check:
-            if np.array_equal(y1, y2):
-                results[label] = 1.0
-            else:
-                results[label] = 0.0 # Disagreement on constants
-            continue
+    # All properties at once from one Properties x K x K confusion tensor.
+    # Properties with no numeric pairs come out NaN, and perfect agreement
+    # on a constant value comes out 1.0.
+    (codes1, codes2), values = encode_ordinal([r1_file[labels], r2_file[labels]])
+    kappas = cohen_kappa_all(codes1, codes2, len(values), weights='quadratic')
 
-        k = cohen_kappa_score(y1, y2, weights='quadratic')
-            
-        results[label] = k
+    results = pd.DataFrame({'Weighted_Kappa': kappas}, index=pd.Index(labels, name='Property'))
 
-    df = pd.DataFrame.from_dict(results, orient='index').transpose()
+    if n_boot:
+        ci = confidence_intervals(kappa_replicates, (codes1, codes2, len(values), 'quadratic'),
+                                  len(codes1), kappas, n_boot, seed, n_jobs)
+        results = results.join(ci.set_index(results.index))
 
     # Save to CSV
-    df.to_csv('output_kappa_updated.csv', index=False)
+    results.to_csv('output_kappa_updated.csv')
+    record('kappa', results, inputs)
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ICC and weighted kappa between the two coders.")
+    parser.add_argument('--n-boot', type=int, default=N_BOOT, help="Bootstrap resamples for the CIs (0 to skip)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jobs', type=int, default=1, help="Worker processes for the bootstrap")
+    parser.add_argument('--only', choices=['icc', 'kappa'], help="Run just one of the two analyses")
+    args = parser.parse_args()
+
     # 1. Get Data
     df1, df2 = data_preprocess()
     
     # 2. Run Original Analysis (Modified only to include Y/N columns)
-    icc_analysis(df1, df2)
+    if args.only != 'kappa':
+        icc_analysis(df1, df2, args.n_boot, args.seed, args.jobs)
     
     # 3. Run New Weighted Kappa Analysis
-    weighted_kappa_analysis(df1, df2)
\ No newline at end of file
+    if args.only != 'icc':
+        weighted_kappa_analysis(df1, df2, args.n_boot, args.seed, args.jobs)
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import linalg, sparse
+
+import profiler
+
+CACHE_DIR = '.mca_cache'
+MODEL_VERSION = 1
+
+
+def indicator_matrix(X, categories=None):
+    """
+    Complete disjunctive table of a categorical frame as a sparse CSR matrix,
+    built from each column's integer category codes. Missing values, and
+    values outside `categories` when those are given, get no indicator.
+    Returns (matrix, per-column categories).
+    """
+    if categories is None:
+        cats = [pd.Categorical(X[c]) for c in X.columns]
+    else:
+        cats = [pd.Categorical(X[c], categories=levels) for c, levels in zip(X.columns, categories)]
+    n_levels = np.array([len(c.categories) for c in cats])
+    offsets = np.concatenate(([0], np.cumsum(n_levels)[:-1]))
+
+    codes = np.column_stack([c.codes.astype(np.int64) for c in cats])
+    valid = codes >= 0
+    rows = np.nonzero(valid)[0]
+    cols = (codes + offsets[None, :])[valid]
+    Z = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(X), int(n_levels.sum())))
+    return Z, [c.categories.tolist() for c in cats]
+
+
+def randomized_svd(matmul, rmatmul, shape, n_components, n_oversamples=10, n_iter=3, random_state=None):
+    """
+    Truncated SVD of an operator given by A @ X (matmul) and A.T @ X (rmatmul).
+    Same steps and random draws as sklearn's randomized_svd (LU-normalized
+    power iterations, sign flip on U), so a fixed seed reproduces its output.
+    """
+    n_rows, n_cols = shape
+    transpose = n_rows < n_cols
+    if transpose:
+        matmul, rmatmul, n_cols = rmatmul, matmul, n_rows
+
+    rng = np.random.RandomState(random_state)
+    Q = rng.normal(size=(n_cols, n_components + n_oversamples))
+    if n_iter > 2:
+        normalize = lambda Y: linalg.lu(Y, permute_l=True, check_finite=False)[0]
+    else:
+        normalize = lambda Y: Y
+    for _ in range(n_iter):
+        Q = normalize(matmul(Q))
+        Q = normalize(rmatmul(Q))
+    Q, _ = linalg.qr(matmul(Q), mode='economic', check_finite=False)
+
+    Uhat, s, Vt = linalg.svd(rmatmul(Q).T, full_matrices=False)
+    U = Q @ Uhat
+
+    # Largest |entry| of each singular vector positive (U's, or V's when transposed)
+    basis = Vt.T if transpose else U
+    signs = np.sign(basis[np.argmax(np.abs(basis), axis=0), np.arange(basis.shape[1])])
+    U *= signs[None, :]
+    Vt *= signs[:, None]
+
+    if transpose:
+        return Vt[:n_components].T, s[:n_components], U[:, :n_components].T
+    return U[:, :n_components], s[:n_components], Vt[:n_components]
+
+
+class SparseMCA:
+    """
+    Multiple correspondence analysis on a sparse indicator matrix, with the
+    same conventions as prince.MCA (category labels, principal coordinates,
+    sklearn-style randomized SVD). The standardized residual matrix is never
+    formed: it is applied as the sparse scaled indicator minus a rank-one term.
+    """
+
+    def __init__(self, n_components=3, n_iter=3, n_oversamples=10, random_state=None, prefix_sep='__'):
+        self.n_components = n_components
+        self.n_iter = n_iter
+        self.n_oversamples = n_oversamples
+        self.random_state = random_state
+        self.prefix_sep = prefix_sep
+
+    def params(self):
+        return {'n_components': self.n_components, 'n_iter': self.n_iter,
+                'n_oversamples': self.n_oversamples, 'random_state': self.random_state,
+                'prefix_sep': self.prefix_sep}
+
+    @profiler.timed
+    def fit(self, X):
+        profiler.count('mca rows', len(X))
+        Z, self.categories_ = indicator_matrix(X)
+        self.variables_ = list(X.columns)
+        self.labels_ = [f"{var}{self.prefix_sep}{level}"
+                        for var, levels in zip(self.variables_, self.categories_) for level in levels]
+
+        total = Z.sum()
+        r = np.asarray(Z.sum(axis=1)).ravel() / total
+        c = np.asarray(Z.sum(axis=0)).ravel() / total
+        sqrt_r, sqrt_c = np.sqrt(r), np.sqrt(c)
+
+        # S = Dr^-1/2 (Z/N - r c^T) Dc^-1/2 = scaled - sqrt(r) sqrt(c)^T
+        scaled = sparse.diags(1 / (total * sqrt_r)) @ Z @ sparse.diags(1 / sqrt_c)
+        scaled_t = scaled.T.tocsr()
+        matmul = lambda M: scaled @ M - np.outer(sqrt_r, sqrt_c @ M)
+        rmatmul = lambda M: scaled_t @ M - np.outer(sqrt_c, sqrt_r @ M)
+
+        k = min(self.n_components, min(Z.shape) - 1)
+        U, s, Vt = randomized_svd(matmul, rmatmul, Z.shape, k, self.n_oversamples,
+                                  self.n_iter, self.random_state)
+
+        self.singular_values_ = s
+        # Row profiles @ row_projection_ are the row principal coordinates
+        self.row_projection_ = Vt.T / sqrt_c[:, None]
+        col_sums = np.asarray(Z.sum(axis=0)).ravel()
+        self.column_coordinates_ = (Z.T @ (U / sqrt_r[:, None])) / col_sums[:, None]
+        return self
+
+    @property
+    def eigenvalues_(self):
+        return self.singular_values_ ** 2
+
+    def transform(self, X):
+        """
+        Row principal coordinates of X (the fitted rows or new documents).
+        Categories not seen during fit are ignored.
+        """
+        Z, _ = indicator_matrix(X[self.variables_], self.categories_)
+        row_sums = np.asarray(Z.sum(axis=1)).ravel()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            coords = (Z @ self.row_projection_) / row_sums[:, None]
+        return pd.DataFrame(coords, index=X.index)
+
+    row_coordinates = transform
+
+    def column_coordinates(self):
+        """
+        Category principal coordinates (the MCA loadings), one row per category.
+        """
+        return pd.DataFrame(self.column_coordinates_, index=pd.Index(self.labels_))
+
+    def save(self, path):
+        meta = {'version': MODEL_VERSION, 'params': self.params(), 'variables': self.variables_,
+                'categories': self.categories_, 'labels': self.labels_}
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, meta=np.array(json.dumps(meta)), singular_values=self.singular_values_,
+                 row_projection=self.row_projection_, column_coordinates=self.column_coordinates_)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['version'] != MODEL_VERSION:
+                raise ValueError(f"{path} was saved by a different MCA version")
+            model = cls(**meta['params'])
+            model.variables_ = meta['variables']
+            model.categories_ = meta['categories']
+            model.labels_ = meta['labels']
+            model.singular_values_ = data['singular_values']
+            model.row_projection_ = data['row_projection']
+            model.column_coordinates_ = data['column_coordinates']
+        return model
+
+
+def data_digest(X, params):
+    """
+    SHA-256 of the frame's labels and values plus the fit parameters.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([MODEL_VERSION, params], sort_keys=True).encode())
+    h.update(X.to_csv().encode())
+    return h.hexdigest()
+
+
+def fit_cached(X, cache_dir=CACHE_DIR, **params):
+    """
+    Loads the model fitted on exactly this data and these parameters from
+    cache_dir, or fits and saves it.
+    """
+    model = SparseMCA(**params)
+    path = os.path.join(cache_dir, data_digest(X, model.params()) + '.npz')
+    if os.path.exists(path):
+        return SparseMCA.load(path)
+    model.fit(X)
+    os.makedirs(cache_dir, exist_ok=True)
+    model.save(path)
+    return model
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit (or reuse) the MCA map and place new documents on it.")
+    parser.add_argument('data', nargs='?', default='filtered_df.csv', help="Documents the map is fitted on")
+    parser.add_argument('--project', required=True, help="CSV of new documents with the same columns")
+    parser.add_argument('--output', default='projected.csv')
+    args = parser.parse_args()
+
+    dataset = pd.read_csv(args.data)
+    model = fit_cached(dataset.iloc[:, 1:], n_components=3, n_iter=3, random_state=42)
+
+    new_docs = pd.read_csv(args.project)
+    coords = model.transform(new_docs.iloc[:, 1:])
+    coords.index = new_docs.iloc[:, 0].rename(None)
+    print(coords)
+    coords.to_csv(args.output)
+    print(f"\nSaved coordinates to '{args.output}'")
@@ -1,65 +1,83 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
 
-dataset = pd.read_csv('filtered_df.csv')
-dataset.head()
+from id_index import source_letters
+from mca import fit_cached
+from results_store import record
 
-ids = dataset.iloc[:, 0]          # first column
-df_mca = dataset.iloc[:, 1:]    
 
-import prince
+def load_filtered(path='filtered_df.csv'):
+    dataset = pd.read_csv(path)
+    ids = dataset.iloc[:, 0]          # first column
+    df_mca = dataset.iloc[:, 1:]
+    return ids, df_mca
 
-mca = prince.MCA(
-    n_components=3,
-    n_iter=3,
-    copy=True,
-    check_input=True,
-    engine='sklearn',
-    random_state=42
-)
-mca = mca.fit(df_mca)
 
-coords = mca.row_coordinates(df_mca)
+def fit_map(df_mca):
+    # Sparse MCA with prince's settings; the fit is reused while filtered_df.csv is unchanged
+    return fit_cached(
+        df_mca,
+        n_components=3,
+        n_iter=3,
+        random_state=42
+    )
 
-# Get first letter of each ID
-first_letters = ids.str[0]
 
-# Turn letters into category → integer codes → colors
-first_letters = ids.str[0]
-cat = first_letters.astype("category")
-codes = cat.cat.codes
+def plot_map(ids, coords, file_path=None):
+    """
+    Documents on the first two components, coloured by the first letter of their source type.
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as mpatches
 
-# Scatterplot
-plt.figure(figsize=(8,6))
-scatter = plt.scatter(coords[0], coords[1], c=codes)
+    # Turn letters into category → integer codes → colors
+    first_letters = pd.Series(source_letters(ids), index=ids.index)
+    cat = first_letters.astype("category")
+    codes = cat.cat.codes
 
-cmap = scatter.cmap
-norm = scatter.norm
+    # Scatterplot
+    plt.figure(figsize=(8,6))
+    scatter = plt.scatter(coords[0], coords[1], c=codes)
+
+    cmap = scatter.cmap
+    norm = scatter.norm
+
+    handles = []
+    for letter, code in zip(cat.cat.categories, range(len(cat.cat.categories))):
+        color = cmap(norm(code))
+        handles.append(
+            mpatches.Patch(color=color, label=letter)
+        )
+
+    plt.legend(handles=handles, title="First Letter")
+    plt.xlabel("Component 1")
+    plt.ylabel("Component 2")
+
+    plt.grid(True)
+    #plt.show()
+
+    if file_path:
+        plt.savefig(file_path)
 
-handles = []
-for letter, code in zip(cat.cat.categories, range(len(cat.cat.categories))):
-    color = cmap(norm(code))
-    handles.append(
-        mpatches.Patch(color=color, label=letter)
-    )
 
-plt.legend(handles=handles, title="First Letter")
-plt.xlabel("Component 1")
-plt.ylabel("Component 2")
+def write_loadings(mca, df_mca, inputs=('filtered_df.csv',)):
+    column_loadings = mca.column_coordinates()
+    print("Column Loadings (MCA):")
+    print(column_loadings)
 
-plt.grid(True)
-#plt.show()
+    column_loadings.to_csv('loadings.csv')
+    record('mca_loadings', column_loadings.rename_axis('Category'), inputs)
 
-#plt.savefig('mcaPlot.png')
+    row_scores = mca.row_coordinates(df_mca)
+    print("\nRow Scores (MCA):")
+    print(row_scores)
+    return column_loadings, row_scores
 
-column_loadings = mca.column_coordinates(df_mca)
-print("Column Loadings (MCA):")
-print(column_loadings)
 
-column_loadings.to_csv('loadings.csv')
+if __name__ == "__main__":
+    ids, df_mca = load_filtered()
+    mca = fit_map(df_mca)
 
+    coords = mca.row_coordinates(df_mca)
+    plot_map(ids, coords)  # pass 'mcaPlot.png' to save it
 
-row_scores = mca.row_coordinates(df_mca)
-print("\nRow Scores (MCA):")
-print(row_scores)
\ No newline at end of file
+    write_loadings(mca, df_mca)
@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+
+MISSING = -1
+YES_NO = {'Y': 1, 'YES': 1, 'N': 0, 'NO': 0}
+RATING_RANGE = (1, 5)
+RATING_STEP = 0.5
+
+# Declared recodings of the ratings, {old rating: new rating}; other ratings pass through
+RECODINGS = {
+    'collapse': {4: 5, 2: 1},  # merged before the ICC in kappa.py
+}
+
+REJECT_COLUMNS = ['Document', 'Property', 'Kind', 'Value', 'Reason']
+REJECTS_FILE = 'rejects.csv'
+
+
+def clean_ids(ids):
+    """
+    Document IDs as text without spaces, as kappa.py matches them across raters.
+    """
+    return pd.Index(np.asarray(ids, dtype=object)).astype(str).str.replace(' ', '').str.strip()
+
+
+def _distinct_cells(values):
+    """
+    Codes of a flat object array into its distinct values (-1 for None and
+    NaN) and those values, so that parsing runs once per distinct value and
+    every cell takes its result by lookup.
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object).ravel())
+    return codes, pd.Series(uniques, dtype=object)
+
+
+def _lookup(table, codes, missing):
+    """
+    Each cell's entry of a per-distinct-value table; `missing` for code -1.
+    """
+    return np.append(table, missing)[codes]
+
+
+def blank_cells(values):
+    """
+    Mask of the empty cells of an object array: None, NaN and whitespace-only text.
+    """
+    values = np.asarray(values, dtype=object)
+    codes, uniques = _distinct_cells(values)
+    blank = (uniques.str.strip() == '').to_numpy(dtype=bool)  # non-text values are never blank
+    return _lookup(blank, codes, True).reshape(values.shape)
+
+
+def parse_numbers(values):
+    """
+    Floats of an array (or frame) of cells, NaN where a cell is blank or
+    not a number.
+    """
+    values = np.asarray(values, dtype=object)
+    codes, uniques = _distinct_cells(values)
+    numbers = pd.to_numeric(uniques, errors='coerce').to_numpy(dtype=float)
+    return _lookup(numbers, codes, np.nan).reshape(values.shape)
+
+
+def parse_yes_no(values):
+    """
+    1 / 0 for Y / N cells (or YES / NO, any case, surrounding spaces
+    ignored) through the YES_NO lookup; MISSING for everything else.
+    """
+    values = np.asarray(values, dtype=object)
+    codes, uniques = _distinct_cells(values)
+    answers = uniques.str.strip().str.upper().map(YES_NO).fillna(MISSING).to_numpy(dtype=np.int64)
+    return _lookup(answers, codes, MISSING).reshape(values.shape)
+
+
+def parse_labels(labels):
+    """
+    Labels as numbers where they parse (4.0 -> 4), otherwise as text, the
+    way analysis.py keys documents.
+    """
+    labels = np.asarray(labels, dtype=object)
+    numbers = parse_numbers(labels).tolist()
+    return [str(label) if np.isnan(x) else int(x) if x.is_integer() else x
+            for label, x in zip(labels, numbers)]
+
+
+def recode(ratings, scheme):
+    """
+    Applies a recoding (a name in RECODINGS or an {old: new} dict) to float
+    ratings with one sorted lookup; ratings it does not list, and NaN, pass through.
+    """
+    mapping = RECODINGS[scheme] if isinstance(scheme, str) else dict(scheme)
+    ratings = np.asarray(ratings, dtype=float)
+    if not mapping:
+        return ratings.copy()
+    old = np.array(sorted(mapping), dtype=float)
+    new = np.array([mapping[k] for k in sorted(mapping)], dtype=float)
+    pos = np.minimum(np.searchsorted(old, ratings), len(old) - 1)
+    return np.where(old[pos] == ratings, new[pos], ratings)
+
+
+def on_rating_grid(ratings, low=RATING_RANGE[0], high=RATING_RANGE[1], step=RATING_STEP):
+    """
+    Mask of the ratings between low and high on steps of `step` (NaN is off the grid).
+    """
+    ratings = np.asarray(ratings, dtype=float)
+    steps = (ratings - low) / step
+    with np.errstate(invalid='ignore'):
+        return np.isfinite(steps) & (steps == np.round(steps)) & (ratings >= low) & (ratings <= high)
+
+
+def classify_properties(values):
+    """
+    Kind of each column of a Raters x Units x Properties object array.
+    A property is binary when at least half of its filled cells are Y/N
+    (or YES/NO), ordinal when at least half are numbers, and categorical
+    otherwise; the minority cells of binary and ordinal properties count as
+    missing, as pd.to_numeric(errors='coerce') treats them.
+    Returns (kinds, numeric values, yes/no values), the last two as floats with NaN.
+    """
+    filled = ~blank_cells(values)
+    numeric = parse_numbers(values)
+    answers = parse_yes_no(values)
+    yes_no = np.where(answers == MISSING, np.nan, answers)
+
+    n_filled = filled.sum(axis=(0, 1))
+    n_numeric = (~np.isnan(numeric)).sum(axis=(0, 1))
+    n_yes_no = (answers != MISSING).sum(axis=(0, 1))
+    kinds = np.where((n_yes_no > 0) & (2 * n_yes_no >= n_filled), 'binary',
+                     np.where((n_numeric > 0) & (2 * n_numeric >= n_filled), 'ordinal', 'categorical'))
+    return kinds.tolist(), numeric, yes_no
+
+
+def normalize_sheet(df, scheme=None, kinds=None):
+    """
+    Canonical typed form of a Documents x Properties frame, parsed in one
+    pass over all cells (the form CodingMatrix.to_frame gives):
+
+    - ordinal properties: float ratings, recoded with `scheme` if given
+    - binary: 'Y' / 'N'
+    - categorical: stripped text
+
+    Kinds are classified as in classify_properties unless given as a list.
+    Filled cells that do not parse as their property's kind, and ratings
+    off the RATING_RANGE grid, become missing and are listed in the rejects
+    table instead (one row per cell, REJECT_COLUMNS).
+    Returns (typed frame, rejects).
+    """
+    values = df.to_numpy(dtype=object)
+    found, numeric, yes_no = classify_properties(values[None])
+    kinds = np.array(found if kinds is None else kinds)
+    numeric, yes_no = numeric[0], yes_no[0]
+    filled = ~blank_cells(values)
+
+    ordinal, binary = kinds == 'ordinal', kinds == 'binary'
+    not_number = ordinal & filled & np.isnan(numeric)
+    off_grid = ordinal & ~np.isnan(numeric) & ~on_rating_grid(numeric)
+    not_yes_no = binary & filled & np.isnan(yes_no)
+
+    ratings = np.where(off_grid, np.nan, numeric)
+    if scheme is not None:
+        ratings = recode(ratings, scheme)
+    answers = np.where(np.isnan(yes_no), None, np.where(yes_no == 1, 'Y', 'N'))
+    categorical = np.flatnonzero(kinds == 'categorical')
+    text = pd.Series(values[:, categorical].ravel()).astype('string').str.strip()
+    text = text.where(filled[:, categorical].ravel(), None).astype(object).to_numpy()
+    text = text.reshape(len(values), len(categorical))
+
+    columns = {}
+    for j, kind in enumerate(kinds):
+        if kind == 'ordinal':
+            columns[j] = ratings[:, j]
+        elif kind == 'binary':
+            columns[j] = answers[:, j]
+        else:
+            columns[j] = text[:, np.searchsorted(categorical, j)]
+    typed = pd.DataFrame(columns, index=df.index)
+    typed.columns = df.columns
+
+    low, high = RATING_RANGE
+    reasons = [(not_number, 'not a number'),
+               (off_grid, f'rating outside {low}-{high} in steps of {RATING_STEP:g}'),
+               (not_yes_no, 'not Y/N')]
+    rows = []
+    for mask, reason in reasons:
+        r, c = np.nonzero(mask)
+        rows.append(pd.DataFrame({'Document': df.index[r], 'Property': df.columns[c], 'Kind': kinds[c],
+                                  'Value': [str(v) for v in values[r, c]], 'Reason': reason}))
+    rejects = pd.concat(rows, ignore_index=True)[REJECT_COLUMNS]
+    return typed, rejects
+
+
+def workbook_rejects(filenames, scheme=None):
+    """
+    Rejected cells of every workbook, with a Workbook column in front.
+    """
+    from coding_cache import load_workbooks
+
+    tables = []
+    for filename, df in zip(filenames, load_workbooks(filenames)):
+        _, rejects = normalize_sheet(df, scheme)
+        rejects.insert(0, 'Workbook', filename)
+        tables.append(rejects)
+    return pd.concat(tables, ignore_index=True)
+
+
+def write_rejects(filenames, output=REJECTS_FILE):
+    """
+    Prints rejected cells per workbook, property and reason, saves the full
+    table and stores it as the 'rejects' statistic.
+    """
+    from results_store import record
+
+    rejects = workbook_rejects(filenames)
+    if rejects.empty:
+        print("Every filled cell parses as its property's kind")
+    else:
+        print(rejects.groupby(['Workbook', 'Property', 'Reason']).size().rename('Cells').to_string())
+    rejects.to_csv(output, index=False)
+    record('rejects', rejects, filenames)
+    print(f"\n{len(rejects)} rejected cells saved to '{output}'")
+    return rejects
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Normalize coding workbooks and report the cells that do not parse.")
+    parser.add_argument('workbooks', nargs='+', help="Coding workbooks to check")
+    parser.add_argument('--output', default=REJECTS_FILE)
+    args = parser.parse_args()
+
+    write_rejects(args.workbooks, args.output)
@@ -0,0 +1,323 @@
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from coding_cache import file_digest
+from profiler import TRACE_ENV, merge_traces
+from results_store import RUN_ENV, new_run_id
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = '.pipeline_state.json'
+LOG_DIR = '.pipeline_logs'
+INCOMPLETE = ('failed', 'skipped', 'missing input')  # stages whose outputs were not brought up to date
+
+# Each stage runs one script (from the working directory) and declares the
+# files it reads and writes. Stages that read another stage's output run after
+# it; the rest run side by side. The script and the repo modules it imports
+# are fingerprinted along with the inputs.
+STAGES = [
+    {'name': 'analysis', 'script': 'analysis.py', 'args': [],
+     'inputs': ['Validation Study_Sophie.xlsx', 'CN_processed.xlsx'],
+     'outputs': ['full.csv', 'vis_frequencies.csv', 'forum_frequencies.csv', 'blog_frequencies.csv',
+                 'book_frequencies.csv', 'averages.png', 'row_distributions/manifest.json']},
+    {'name': 'correl', 'script': 'correl.py', 'args': [],
+     'inputs': ['full.csv'],
+     'outputs': ['filtered_df.csv', 'correlations.csv', 'correlation_tests.csv']},
+    {'name': 'distances', 'script': 'distances.py', 'args': [],
+     'inputs': ['full.csv'],
+     'outputs': ['source_distances.csv']},
+    {'name': 'mca', 'script': 'mcaCalc.py', 'args': [],
+     'inputs': ['filtered_df.csv'],
+     'outputs': ['loadings.csv']},
+    {'name': 'icc', 'script': 'kappa.py', 'args': ['--only', 'icc'],
+     'inputs': ['SS_Updated_Coding.xlsx', 'CN_Updated_Coding.xlsx'],
+     'outputs': ['output_icc_updated.csv']},
+    {'name': 'kappa', 'script': 'kappa.py', 'args': ['--only', 'kappa'],
+     'inputs': ['SS_Updated_Coding.xlsx', 'CN_Updated_Coding.xlsx'],
+     'outputs': ['output_kappa_updated.csv']},
+    {'name': 'rejects', 'script': 'normalize.py', 'args': ['SS_Updated_Coding.xlsx', 'CN_Updated_Coding.xlsx'],
+     'inputs': ['SS_Updated_Coding.xlsx', 'CN_Updated_Coding.xlsx'],
+     'outputs': ['rejects.csv']},
+    {'name': 'documents', 'script': 'hierarchy.py', 'args': ['SS_Updated_Coding.xlsx', 'CN_Updated_Coding.xlsx'],
+     'inputs': ['SS_Updated_Coding.xlsx', 'CN_Updated_Coding.xlsx'],
+     'outputs': ['document_summary.csv']},
+    {'name': 'elements', 'script': 'irr_elements.py', 'args': [],
+     'inputs': ['Validation Study_Sophie.xlsx', 'CN_processed_FIXED.xlsx'],
+     'outputs': ['output_elements_kappa.csv']},
+    {'name': 'element_plot', 'script': 'element_breakdown.py', 'args': [],
+     'inputs': ['Validation Study_Sophie.xlsx', 'CN_processed_FIXED.xlsx'],
+     'outputs': ['elements_comparison.png']},
+    {'name': 'goals', 'script': 'analysis_sophie.py', 'args': [],
+     'inputs': ['Validation Study_Sophie - UPDATED.xlsx', 'v3_CN_processed.xlsx'],
+     'outputs': ['combined_goals_chart.png', 'categorical_tests.csv']},
+]
+
+
+def local_modules(script, repo_dir=REPO_DIR):
+    """
+    The script plus every repo module it imports, directly or indirectly.
+    """
+    seen = []
+    todo = [os.path.join(repo_dir, script)]
+    while todo:
+        path = todo.pop()
+        if path in seen or not os.path.exists(path):
+            continue
+        seen.append(path)
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                todo.append(os.path.join(repo_dir, name.split('.')[0] + '.py'))
+    return sorted(seen)
+
+
+def dependencies(stages):
+    """
+    Maps each stage name to the stages producing one of its inputs.
+    """
+    producer = {}
+    for stage in stages:
+        for out in stage['outputs']:
+            if out in producer:
+                raise ValueError(f"'{out}' is written by both {producer[out]} and {stage['name']}")
+            producer[out] = stage['name']
+    return {stage['name']: sorted({producer[i] for i in stage['inputs'] if i in producer} - {stage['name']})
+            for stage in stages}
+
+
+def topological_order(stages):
+    deps = dependencies(stages)
+    order, visiting = [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through stage '{name}'")
+        visiting.add(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for stage in stages:
+        visit(stage['name'])
+    return order
+
+
+def fingerprint(stage, workdir):
+    """
+    Hash of the stage's command, code and input bytes.
+    Returns None when an input is missing.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([stage['script'], stage['args']]).encode())
+    for path in local_modules(stage['script']):
+        h.update(os.path.basename(path).encode())
+        h.update(file_digest(path).encode())
+    for name in stage['inputs']:
+        path = os.path.join(workdir, name)
+        if not os.path.exists(path):
+            return None
+        h.update(name.encode())
+        h.update(file_digest(path).encode())
+    return h.hexdigest()
+
+
+def _load_state(workdir):
+    try:
+        with open(os.path.join(workdir, STATE_FILE)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_state(workdir, state):
+    path = os.path.join(workdir, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def _run_stage(stage, workdir, run_id=None, profile_dir=None):
+    """
+    Runs one stage's script in a subprocess and logs its output. Stages
+    given the same run_id store their results under that run. With a
+    profile_dir, the script is profiled into <profile_dir>/<stage>.json.
+    Returns (return code, seconds).
+    """
+    env = dict(os.environ, MPLBACKEND='Agg')
+    if run_id:
+        env[RUN_ENV] = run_id
+    if profile_dir:
+        env[TRACE_ENV] = os.path.abspath(os.path.join(profile_dir, stage['name'] + '.json'))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_DIR, env.get('PYTHONPATH')]))
+    cmd = [sys.executable, os.path.join(REPO_DIR, stage['script'])] + stage['args']
+
+    os.makedirs(os.path.join(workdir, LOG_DIR), exist_ok=True)
+    start = time.perf_counter()
+    with open(os.path.join(workdir, LOG_DIR, stage['name'] + '.log'), 'w') as log:
+        proc = subprocess.run(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return proc.returncode, time.perf_counter() - start
+
+
+def select(stages, names):
+    """
+    The named stages plus everything upstream of them (all stages if names is empty).
+    """
+    if not names:
+        return list(stages)
+    known = {s['name'] for s in stages}
+    unknown = [n for n in names if n not in known]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)}")
+
+    deps = dependencies(stages)
+    wanted, todo = set(), list(names)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(deps[name])
+    return [s for s in stages if s['name'] in wanted]
+
+
+def run_pipeline(names=(), workdir='.', jobs=None, force=False, dry_run=False, stages=STAGES, profile_dir=None):
+    """
+    Runs the selected stages whose fingerprint changed since their last
+    successful run (or whose outputs are missing), starting every stage as
+    soon as the stages it depends on are done. force reruns the named stages
+    (not their upstream) regardless. A failed stage skips everything
+    downstream of it. A stage with a missing input does not run, but the
+    stages reading its outputs still run on the files already there (e.g.
+    a committed full.csv). The stages that run
+    share one results-store run ID (RESULTS_RUN_ID if set, else a new one).
+    With a profile_dir, each stage that runs writes a Chrome trace there and
+    they are merged into <profile_dir>/trace.json.
+    Returns {stage name: (status, seconds)}.
+    """
+    forced = set(names) if names else {s['name'] for s in stages}
+    stages = select(stages, names)
+    by_name = {s['name']: s for s in stages}
+    deps = dependencies(stages)
+    order = topological_order(stages)
+    state = _load_state(workdir)
+    jobs = jobs or os.cpu_count() or 1
+    run_id = os.environ.get(RUN_ENV) or new_run_id()
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    results = {}
+    pending = list(order)
+    running = {}
+
+    def ready(name):
+        return all(d in results for d in deps[name])
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in [n for n in pending if ready(n)]:
+                if len(running) >= jobs:
+                    break
+                pending.remove(name)
+                stage = by_name[name]
+
+                blocked = [d for d in deps[name] if results[d][0] in ('failed', 'skipped')]
+                if blocked:
+                    results[name] = ('skipped', 0.0)
+                    print(f"[{name}] skipped: upstream {', '.join(blocked)} did not complete")
+                    continue
+
+                digest = fingerprint(stage, workdir)
+                if digest is None:
+                    missing = [i for i in stage['inputs'] if not os.path.exists(os.path.join(workdir, i))]
+                    results[name] = ('missing input', 0.0)
+                    print(f"[{name}] missing input: {', '.join(missing)}")
+                    continue
+                stale = [d for d in deps[name] if results[d][0] == 'missing input']
+                if stale:
+                    print(f"[{name}] upstream {', '.join(stale)} could not run; using its existing outputs")
+
+                outputs_present = all(os.path.exists(os.path.join(workdir, o)) for o in stage['outputs'])
+                if not (force and name in forced) and outputs_present and state.get(name) == digest:
+                    results[name] = ('up to date', 0.0)
+                    print(f"[{name}] up to date")
+                    continue
+
+                if dry_run:
+                    results[name] = ('would run', 0.0)
+                    print(f"[{name}] would run")
+                    continue
+
+                print(f"[{name}] running {stage['script']} {' '.join(stage['args'])}".rstrip())
+                running[pool.submit(_run_stage, stage, workdir, run_id, profile_dir)] = (name, digest)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, digest = running.pop(future)
+                code, seconds = future.result()
+                if code == 0:
+                    state[name] = digest
+                    _write_state(workdir, state)
+                    results[name] = ('ran', seconds)
+                    print(f"[{name}] done in {seconds:.2f}s")
+                else:
+                    state.pop(name, None)
+                    _write_state(workdir, state)
+                    results[name] = ('failed', seconds)
+                    print(f"[{name}] FAILED (exit {code}) after {seconds:.2f}s, "
+                          f"see {os.path.join(workdir, LOG_DIR, name + '.log')}")
+
+    print("\nStage timings:")
+    for name in order:
+        status, seconds = results[name]
+        print(f"  {name:<14} {status:<14} {seconds:8.2f}s")
+    incomplete = [name for name in order if results[name][0] in INCOMPLETE]
+    if incomplete:
+        print(f"\n{len(incomplete)} of {len(order)} stage(s) did not complete: {', '.join(incomplete)}")
+
+    if profile_dir:
+        traces = [os.path.join(profile_dir, name + '.json') for name in order if results[name][0] == 'ran']
+        traces = [t for t in traces if os.path.exists(t)]
+        if traces:
+            merge_traces(traces, os.path.join(profile_dir, 'trace.json'))
+            print(f"Trace of {len(traces)} stage(s) saved to '{os.path.join(profile_dir, 'trace.json')}'")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the analysis scripts, redoing only stages whose inputs changed.")
+    parser.add_argument('stages', nargs='*', help="Stages to bring up to date (default: all), plus what they depend on")
+    parser.add_argument('--workdir', default='.', help="Folder holding the workbooks and outputs")
+    parser.add_argument('--jobs', type=int, default=None, help="Stages run at the same time (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="Rerun the named stages (all if none named) even if up to date")
+    parser.add_argument('--dry-run', action='store_true', help="Only report which stages would run")
+    parser.add_argument('--list', action='store_true', help="Print the stages and their dependencies")
+    parser.add_argument('--profile', metavar='DIR', help="Profile the stages that run; Chrome traces go to DIR")
+    args = parser.parse_args()
+
+    if args.list:
+        deps = dependencies(STAGES)
+        for name in topological_order(STAGES):
+            print(f"{name:<14} after: {', '.join(deps[name]) or '-'}")
+        sys.exit(0)
+
+    results = run_pipeline(args.stages, args.workdir, args.jobs, args.force, args.dry_run,
+                           profile_dir=args.profile)
+    sys.exit(1 if any(status in INCOMPLETE for status, _ in results.values()) else 0)
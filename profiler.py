@@ -0,0 +1,249 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import nullcontext
+
+TRACE_ENV = 'PROFILE_TRACE'  # path of the trace to write at exit; setting it turns the profiler on
+MEMORY_ENV = 'PROFILE_MEMORY'  # '1' to also trace Python allocations (slows the run down)
+TOP_ALLOCATIONS = 5  # allocation sites listed per top-level stage with memory tracing
+
+# Off by default: stage() hands back one shared no-op context, timed
+# functions and count() return after a single flag check
+_enabled = False
+_memory = False
+_trace_path = None
+_events = []
+_counters = defaultdict(int)
+_stack = []
+_NULL = nullcontext()
+_origin = (0.0, 0.0)
+_PAGE_BYTES = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _now_us():
+    """
+    Microseconds since the epoch, measured with perf_counter from the
+    moment the profiler was enabled, so traces of several processes line up.
+    """
+    wall, perf = _origin
+    return (wall + time.perf_counter() - perf) * 1e6
+
+
+def _rss_mb():
+    """
+    Current resident set size of the process, from /proc/self/statm (None
+    where there is no /proc, e.g. macOS and Windows).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_BYTES / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Span:
+    """
+    One timed stage; written as a Chrome 'complete' event with the RSS at
+    its end and how much RSS grew over it and, with memory tracing, its
+    peak traced memory and top allocation sites.
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = dict(args)
+        self.peak = 0
+        self.snapshot = None
+
+    def __enter__(self):
+        if _memory:
+            if _stack:  # the parent's peak so far, before the reset below clears it
+                _stack[-1].peak = max(_stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            else:
+                self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+        _stack.append(self)
+        self.rss = _rss_mb()
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        end = _now_us()
+        _stack.pop()
+        args = self.args
+        rss = _rss_mb()
+        args['rss_mb'] = rss
+        args['rss_growth_mb'] = rss - self.rss if rss is not None and self.rss is not None else None
+        if _memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if _stack:
+                _stack[-1].peak = max(_stack[-1].peak, self.peak)
+            args['peak_traced_mb'] = self.peak / 2 ** 20
+            if self.snapshot is not None:
+                grown = tracemalloc.take_snapshot().compare_to(self.snapshot, 'lineno')[:TOP_ALLOCATIONS]
+                args['top_allocations'] = [f"{s.traceback[0].filename}:{s.traceback[0].lineno} "
+                                           f"{s.size_diff / 2 ** 10:+.0f} KB" for s in grown]
+        _events.append({'name': self.name, 'cat': 'stage', 'ph': 'X', 'ts': self.start, 'dur': end - self.start,
+                        'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+        return False
+
+
+def enabled():
+    return _enabled
+
+
+def enable(trace_path=None, memory=False):
+    """
+    Starts recording stages and counters. With a trace_path, the Chrome
+    trace is written and the summary printed when the process exits.
+    """
+    global _enabled, _memory, _trace_path, _origin
+    if _enabled:
+        return
+    _enabled, _memory, _trace_path = True, memory, trace_path
+    _origin = (time.time(), time.perf_counter())
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if trace_path:
+        atexit.register(finish)
+
+
+def stage(name, **args):
+    """
+    Context manager timing a block as one stage (nested stages show up
+    inside it); keyword arguments are stored with the event.
+    """
+    if not _enabled:
+        return _NULL
+    return _Span(name, args)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function as a stage, named
+    module.function unless a name is given. Works as @timed or @timed('name').
+    """
+    def decorate(func):
+        label = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(label, {}):
+                return func(*args, **kwargs)
+        return wrapper
+
+    if callable(name):
+        func, name = name, None
+        return decorate(func)
+    return decorate
+
+
+def count(name, n=1):
+    """
+    Adds n to a counter (rows, cells, figures, ...), recorded as a Chrome counter event.
+    """
+    if not _enabled:
+        return
+    _counters[name] += n
+    _events.append({'name': name, 'cat': 'counter', 'ph': 'C', 'ts': _now_us(), 'pid': os.getpid(),
+                    'args': {name: _counters[name]}})
+
+
+def counters():
+    return dict(_counters)
+
+
+def trace():
+    """
+    The recorded events in Chrome trace format (load the JSON in
+    chrome://tracing or Perfetto), with the process named after the script.
+    """
+    name = os.path.basename(sys.argv[0]) or 'python'
+    meta = {'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': name}}
+    return {'traceEvents': [meta] + _events, 'displayTimeUnit': 'ms'}
+
+
+def write_trace(path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(trace(), f)
+    os.replace(path + '.tmp', path)
+
+
+def merge_traces(paths, output):
+    """
+    Combines the traces of several processes (e.g. one per pipeline stage) into one file.
+    """
+    events = []
+    for path in paths:
+        with open(path) as f:
+            events += json.load(f)['traceEvents']
+    with open(output, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def summary():
+    """
+    One row per stage name: calls, total / mean / max seconds, the largest
+    RSS growth over one call and the highest peak traced memory (MB),
+    slowest first.
+    """
+    rows = {}
+    for event in _events:
+        if event['ph'] != 'X':
+            continue
+        row = rows.setdefault(event['name'], {'stage': event['name'], 'calls': 0, 'total_s': 0.0, 'max_s': 0.0,
+                                              'rss_growth_mb': None, 'peak_traced_mb': None})
+        seconds = event['dur'] / 1e6
+        row['calls'] += 1
+        row['total_s'] += seconds
+        row['max_s'] = max(row['max_s'], seconds)
+        for key in ['rss_growth_mb', 'peak_traced_mb']:
+            value = event['args'].get(key)
+            if value is not None:
+                row[key] = value if row[key] is None else max(row[key], value)
+    for row in rows.values():
+        row['mean_s'] = row['total_s'] / row['calls']
+    return sorted(rows.values(), key=lambda r: -r['total_s'])
+
+
+def print_summary(file=None):
+    file = file or sys.stdout
+    rows = summary()
+    if not rows and not _counters:
+        return
+    mb = lambda x: f"{x:10.1f}" if x is not None else f"{'-':>10}"
+    print("\nProfile:", file=file)
+    print(f"  {'stage':<34} {'calls':>6} {'total s':>9} {'mean s':>9} {'max s':>9} {'RSS +MB':>10} {'traced MB':>10}",
+          file=file)
+    for r in rows:
+        print(f"  {r['stage'][:34]:<34} {r['calls']:6d} {r['total_s']:9.3f} {r['mean_s']:9.3f} {r['max_s']:9.3f} "
+              f"{mb(r['rss_growth_mb'])} {mb(r['peak_traced_mb'])}", file=file)
+    for name, n in sorted(_counters.items()):
+        print(f"  {name:<34} {n:>6}", file=file)
+
+
+def finish():
+    """
+    Writes the trace (if a path was given) and prints the summary.
+    """
+    if not _enabled:
+        return
+    if _trace_path:
+        write_trace(_trace_path)
+    print_summary()
+    if _trace_path:
+        print(f"Trace saved to '{_trace_path}'")
+
+
+if os.environ.get(TRACE_ENV):
+    import multiprocessing
+
+    if multiprocessing.parent_process() is None:  # worker processes leave the trace to their parent
+        enable(os.environ[TRACE_ENV], os.environ.get(MEMORY_ENV, '') not in ('', '0'))
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+import profiler
+from normalize import parse_numbers
+
+
+def _convert_numeric_columns(block):
+    """
+    Converts columns whose every cell is a digit string (e.g. '4') to numbers,
+    like the old per-column astype(str).str.isnumeric() check did.
+    """
+    if block.empty:
+        return block
+    as_text = block.astype(str).to_numpy(dtype=str)
+    all_numeric = np.char.isnumeric(as_text).all(axis=0)
+    if all_numeric.any():
+        block = block.copy()
+        cols = block.columns[all_numeric]
+        block[cols] = block[cols].apply(pd.to_numeric)
+    return block
+
+
+@profiler.timed
+def merge_raters(frames):
+    """
+    Combines the raters' Properties x Documents frames into one frame.
+    Documents coded by more than one rater get the mean of the available
+    numeric ratings (text cells become NaN). Documents coded by a single
+    rater are passed through unchanged. Rows follow the first rater.
+    """
+    index = frames[0].index
+
+    # Union of documents, in order of first appearance
+    columns = pd.Index(pd.unique(np.concatenate(
+        [np.asarray(f.columns, dtype=object) for f in frames])))
+
+    coverage = np.zeros(len(columns), dtype=np.int64)
+    for f in frames:
+        coverage[columns.get_indexer(f.columns)] += 1
+    shared_cols = columns[coverage > 1]
+
+    # Mean of the available ratings for documents several raters coded
+    total = np.zeros((len(index), len(shared_cols)))
+    count = np.zeros((len(index), len(shared_cols)), dtype=np.int64)
+    for f in frames:
+        values = parse_numbers(f.reindex(index=index, columns=shared_cols))  # text -> NaN
+        valid = ~np.isnan(values)
+        total += np.where(valid, values, 0.0)
+        count += valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+
+    pieces = [pd.DataFrame(mean, index=index, columns=shared_cols)]
+
+    # Documents only one rater coded are kept as they are
+    for f in frames:
+        solo_cols = f.columns[coverage[columns.get_indexer(f.columns)] == 1]
+        block = _convert_numeric_columns(f[solo_cols])
+        pieces.append(block.reindex(index=index))
+
+    merged = pd.concat(pieces, axis=1)
+    profiler.count('documents merged', len(columns))
+    return merged[columns]
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+from normalize import parse_numbers
+
+# Ratings are stored as half-point codes: code = rating * 2, so 1..5 -> 2..10
+N_CODES = 11
+MISSING = -1
+
+
+def code_label(code):
+    """
+    Column label for a half-point code, formatted like the old
+    normalize_value strings (2 -> 1, 3 -> 1.5).
+    """
+    return code // 2 if code % 2 == 0 else code / 2
+
+
+def encode_half_points(df):
+    """
+    Encodes a Properties x Documents frame as int8 half-point codes.
+    Anything that is not a rating on the 0.5 grid between 1 and 5 (text,
+    blanks, 4.25, ...) becomes MISSING.
+    """
+    return half_point_codes(parse_numbers(df))
+
+
+def half_point_codes(values):
+    """
+    int8 half-point codes for an array of floats (NaN and off-grid values -> MISSING).
+    """
+    doubled = np.asarray(values, dtype=float) * 2
+    valid = np.isfinite(doubled) & (doubled == np.round(doubled)) & (doubled >= 2) & (doubled < N_CODES)
+    codes = np.full(doubled.shape, MISSING, dtype=np.int8)
+    codes[valid] = doubled[valid].astype(np.int8)
+    return codes
+
+
+def rating_counts(codes, groups, n_groups):
+    """
+    Builds the Groups x Properties x Codes count tensor in one bincount pass.
+    codes is Properties x Documents, groups gives the group number of each document.
+    """
+    n_props = codes.shape[0]
+    groups = np.asarray(groups, dtype=np.int64)
+
+    cell = (groups[None, :] * n_props + np.arange(n_props)[:, None]) * N_CODES + codes
+    valid = (codes != MISSING) & (groups[None, :] >= 0)
+    counts = np.bincount(cell[valid], minlength=n_groups * n_props * N_CODES)
+    return counts.reshape(n_groups, n_props, N_CODES)
+
+
+def group_rating_counts(df, labels):
+    """
+    Encodes df and counts its ratings per group label (one label per document).
+    Returns (tensor, group labels in order of first appearance).
+    """
+    groups, uniques = pd.factorize(labels)
+    return rating_counts(encode_half_points(df), groups, len(uniques)), list(uniques)
+
+
+def frequency_table(counts, index, codes=range(2, N_CODES)):
+    """
+    Properties x Ratings table for one group's slice of the tensor.
+    Ratings that never occur in the group are integer zeros and the rest
+    floats, which keeps the *_frequencies.csv files formatted as before.
+    """
+    codes = list(codes)
+    sub = counts[:, codes]
+    table = pd.DataFrame(sub.astype(float), index=index,
+                         columns=[str(code_label(c)) for c in codes])
+    for j, col in enumerate(table.columns):
+        if not sub[:, j].any():
+            table[col] = 0
+    return table
+
+
+def normalized(counts):
+    """
+    Per-property rating distribution (rows sum to 1; properties with no ratings are NaN).
+    """
+    totals = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return counts / totals
+
+
+def row_averages(counts, codes=range(2, N_CODES)):
+    """
+    Mean rating per property from the counts (NaN where nothing was rated).
+    """
+    codes = np.asarray(list(codes))
+    sub = counts[..., codes]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sub * (codes / 2)).sum(axis=-1) / sub.sum(axis=-1)
+
+
+def average_table(counts, groups, index, codes=range(2, N_CODES)):
+    """
+    Properties x Groups mean ratings plus an 'Overall' column (mean of the
+    groups), leaving out properties nobody rated. Input of averages.png.
+    """
+    avg_df = pd.DataFrame({name: pd.Series(row_averages(counts[g], codes), index=index)
+                           for g, name in enumerate(groups)})
+    avg_df = avg_df.loc[(avg_df != 0).any(axis=1)]
+    avg_df = avg_df.dropna(how='all')
+    avg_df['Overall'] = avg_df.mean(axis=1)
+    return avg_df
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+from agreement import MISSING
+from coding_matrix import CodingMatrix
+from rating_hist import N_CODES
+from results_store import record
+
+METRICS = ['nominal', 'ordinal', 'interval']
+
+
+def encode_raters(matrix, binary=False):
+    """
+    Raters x Units x Properties label codes of a CodingMatrix, with the label
+    values and property names. Ratings keep their half-point codes (label
+    value = code / 2); with binary=True the Y/N properties are coded 0/1.
+    """
+    if binary:
+        return matrix.yes_no(), np.array([0.0, 1.0]), matrix.binary_names
+    return matrix.ordinal, np.arange(N_CODES) / 2, matrix.ordinal_names
+
+
+def value_counts(codes, n_labels):
+    """
+    Units x Properties x K tensor: how many raters gave each label to each unit.
+    One bincount over all raters, so the cost is linear in the number of ratings.
+    """
+    n_raters, n_units, n_props = codes.shape
+    cell = (np.arange(n_units)[:, None] * n_props + np.arange(n_props)[None, :]) * n_labels
+    valid = codes != MISSING
+    flat = np.broadcast_to(cell, codes.shape)[valid] + codes[valid]
+    counts = np.bincount(flat, minlength=n_units * n_props * n_labels)
+    return counts.reshape(n_units, n_props, n_labels)
+
+
+def coincidence_matrices(counts):
+    """
+    Properties x K x K coincidence matrices (Krippendorff) from the value
+    counts. Each pairable unit (two or more ratings) contributes its m(m-1)
+    ordered rating pairs with weight 1/(m-1); other units are left out.
+    """
+    counts = np.asarray(counts, dtype=float)
+    m = counts.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(m >= 2, 1.0 / (m - 1), 0.0)
+    pairs = np.einsum('up,upc,upk->pck', scale, counts, counts)
+    self_pairs = np.einsum('up,upc->pc', scale, counts)
+    idx = np.arange(counts.shape[-1])
+    pairs[:, idx, idx] -= self_pairs
+    return pairs
+
+
+def distance_matrices(coincidence, values, metric='nominal'):
+    """
+    Per-property squared distances between labels.
+    Ordinal distances depend on each property's label frequencies.
+    """
+    n_props, k, _ = coincidence.shape
+    if metric == 'nominal':
+        return np.broadcast_to(1.0 - np.eye(k), (n_props, k, k))
+    if metric == 'interval':
+        values = np.asarray(values, dtype=float)
+        return np.broadcast_to((values[:, None] - values[None, :]) ** 2, (n_props, k, k))
+    if metric == 'ordinal':
+        n_c = coincidence.sum(axis=-1)
+        cum = np.cumsum(n_c, axis=-1)
+        lo = np.minimum.outer(np.arange(k), np.arange(k))
+        hi = np.maximum.outer(np.arange(k), np.arange(k))
+        # sum of n_g for lo <= g <= hi, minus half of the two end labels
+        between = cum[:, hi] - cum[:, lo] + n_c[:, lo]
+        return (between - (n_c[:, :, None] + n_c[:, None, :]) / 2) ** 2
+    raise ValueError(f"Unknown metric '{metric}'")
+
+
+def krippendorff_alpha(coincidence, values, metric='nominal'):
+    """
+    Krippendorff's alpha for every property of a coincidence tensor.
+    Properties with fewer than two pairable ratings are NaN; when every
+    rating is the same label (no expected disagreement) alpha is 1.0, as
+    kappa_from_confusion does for two raters.
+    """
+    coincidence = np.asarray(coincidence, dtype=float)
+    delta = distance_matrices(coincidence, values, metric)
+    n_c = coincidence.sum(axis=-1)
+    n = n_c.sum(axis=-1)
+
+    observed = (coincidence * delta).sum(axis=(-2, -1))
+    expected = (n_c[:, :, None] * n_c[:, None, :] * delta).sum(axis=(-2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        alpha = 1 - (n - 1) * observed / expected
+    alpha = np.where(expected == 0, np.where(observed == 0, 1.0, 0.0), alpha)
+    return np.where(n >= 2, alpha, np.nan)
+
+
+def fleiss_kappa(counts):
+    """
+    Fleiss' kappa per property from Units x Properties x K value counts.
+    Units with fewer than two ratings are dropped, and units may have
+    different numbers of raters: each unit's agreement is over its own
+    m(m-1) rating pairs and label shares are pooled over all ratings.
+    """
+    counts = np.asarray(counts, dtype=float)
+    m = counts.sum(axis=-1)
+    rated = m >= 2
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        unit_agreement = (counts * (counts - 1)).sum(axis=-1) / (m * (m - 1))
+        p_bar = np.where(rated, unit_agreement, 0.0).sum(axis=0) / rated.sum(axis=0)
+
+        pooled = np.where(rated[..., None], counts, 0.0).sum(axis=0)
+        shares = pooled / pooled.sum(axis=-1, keepdims=True)
+        p_e = (shares ** 2).sum(axis=-1)
+        kappa = (p_bar - p_e) / (1 - p_e)
+
+    kappa = np.where(p_e == 1, 1.0, kappa)
+    return np.where(rated.any(axis=0), kappa, np.nan)
+
+
+def reliability_table(frames, binary=False, metrics=METRICS):
+    """
+    Fleiss' kappa and Krippendorff's alpha (one column per metric) for every
+    ordinal (or, with binary=True, Y/N) property. frames is a CodingMatrix
+    or the Documents x Properties frames of the raters, one per rater.
+    """
+    matrix = frames if isinstance(frames, CodingMatrix) else CodingMatrix.from_frames(frames)
+    codes, values, names = encode_raters(matrix, binary)
+    counts = value_counts(codes, len(values))
+    coincidence = coincidence_matrices(counts)
+
+    table = pd.DataFrame({
+        'Units': (counts.sum(axis=-1) >= 2).sum(axis=0),
+        'Raters': (codes != MISSING).any(axis=1).sum(axis=0),
+        'Fleiss_Kappa': fleiss_kappa(counts),
+    }, index=pd.Index(names, name='Property'))
+    for metric in metrics:
+        table[f'Alpha_{metric}'] = krippendorff_alpha(coincidence, values, metric)
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fleiss' kappa and Krippendorff's alpha across any number of coders.")
+    parser.add_argument('workbooks', nargs='+', help="One coding workbook per coder")
+    parser.add_argument('--binary', action='store_true', help="Score the Y/N element columns instead of the ratings")
+    parser.add_argument('--output', default='output_reliability.csv')
+    args = parser.parse_args()
+
+    matrix = CodingMatrix.from_workbooks(args.workbooks)
+    results = reliability_table(matrix, args.binary)
+    results = results[results['Units'] > 0]
+    print(results)
+    results.to_csv(args.output)
+    record('reliability_binary' if args.binary else 'reliability', results, args.workbooks)
+    print(f"\nSaved results to '{args.output}'")
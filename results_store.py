@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+
+import pandas as pd
+
+from coding_cache import file_digest
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+STORE_DIR = 'results'
+RUN_ENV = 'RESULTS_RUN_ID'  # set by pipeline.py so all stages of one run share an ID
+KEY_COLUMNS = ['run_id', 'coding_version']
+
+_run_id = None
+
+
+def new_run_id():
+    return time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+
+
+def run_id():
+    """
+    ID of the current run: RESULTS_RUN_ID when set, otherwise one fresh ID
+    per process (sortable by start time).
+    """
+    global _run_id
+    if os.environ.get(RUN_ENV):
+        return os.environ[RUN_ENV]
+    if _run_id is None:
+        _run_id = new_run_id()
+    return _run_id
+
+
+def coding_version(filenames):
+    """
+    Short digest of the files a statistic was computed from (names and
+    bytes), so runs on the same coding share a version. Missing files are
+    left out; '' when there are none.
+    """
+    present = sorted(f for f in filenames if os.path.exists(f))
+    if not present:
+        return ''
+    h = hashlib.sha256()
+    for name in present:
+        h.update(os.path.basename(name).encode())
+        h.update(file_digest(name).encode())
+    return h.hexdigest()[:12]
+
+
+def _path(statistic, run, store_dir):
+    return os.path.join(store_dir, statistic, f"{run}.arrow")
+
+
+def record(statistic, frame, inputs=(), store_dir=STORE_DIR, run=None):
+    """
+    Saves one statistic's results for the current run (or `run`) as an
+    uncompressed Arrow file, results/<statistic>/<run_id>.arrow, with run_id
+    and coding_version columns in front. A named or non-default index becomes
+    a column. Recording the same statistic again in a run replaces it.
+    Returns the path, or None when pyarrow is not installed.
+    """
+    if pa is None:
+        print(f"pyarrow is not installed; '{statistic}' was not added to the results store")
+        return None
+
+    table = frame
+    if table.index.name is not None or not isinstance(table.index, pd.RangeIndex):
+        table = table.reset_index()
+    table = table.rename(columns=str)
+    run = run or run_id()
+    table.insert(0, 'coding_version', coding_version(inputs))
+    table.insert(0, 'run_id', run)
+
+    arrow = pa.Table.from_pandas(table, preserve_index=False)
+    meta = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'script': os.path.basename(sys.argv[0]),
+            'inputs': json.dumps([os.path.basename(f) for f in inputs])}
+    arrow = arrow.replace_schema_metadata({**(arrow.schema.metadata or {}), **meta})
+
+    path = _path(statistic, run, store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    feather.write_feather(arrow, path + '.tmp', compression='uncompressed')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Reading the results store needs pyarrow")
+
+
+def statistics(store_dir=STORE_DIR):
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(d for d in os.listdir(store_dir) if os.path.isdir(os.path.join(store_dir, d)))
+
+
+def _metadata(path):
+    with pa.memory_map(path) as source:
+        schema = pa.ipc.open_file(source).schema
+    return {k.decode(): v.decode() for k, v in (schema.metadata or {}).items()}
+
+
+def _stored_runs(statistic, store_dir=STORE_DIR):
+    """
+    Run IDs stored for a statistic, in the order they were recorded.
+    """
+    folder = os.path.join(store_dir, statistic)
+    if not os.path.isdir(folder):
+        return []
+    found = [name[:-len('.arrow')] for name in os.listdir(folder) if name.endswith('.arrow')]
+    return sorted(found, key=lambda r: (_metadata(_path(statistic, r, store_dir)).get('created', ''), r))
+
+
+def runs(store_dir=STORE_DIR):
+    """
+    One row per stored result: statistic, run_id, coding_version, created,
+    script, inputs and row count, in the order they were recorded. Only
+    schemas and one column are read.
+    """
+    _require_pyarrow()
+    rows = []
+    for statistic in statistics(store_dir):
+        for run in _stored_runs(statistic, store_dir):
+            path = _path(statistic, run, store_dir)
+            table = feather.read_table(path, columns=['coding_version'], memory_map=True)
+            meta = _metadata(path)
+            rows.append({'statistic': statistic, 'run_id': run,
+                         'coding_version': table.column(0)[0].as_py() if len(table) else '',
+                         'created': meta.get('created'), 'script': meta.get('script'),
+                         'inputs': ', '.join(json.loads(meta.get('inputs', '[]'))), 'rows': len(table)})
+    columns = ['statistic', 'run_id', 'coding_version', 'created', 'script', 'inputs', 'rows']
+    return pd.DataFrame(rows, columns=columns).sort_values(['created', 'statistic'], ignore_index=True)
+
+
+def load(statistic, run='all', columns=None, store_dir=STORE_DIR):
+    """
+    A statistic's stored results: for one run ID, 'latest' (most recently
+    recorded), a list of run IDs or 'all'. The files are memory-mapped and only the requested
+    columns (plus run_id and coding_version) are read.
+    """
+    _require_pyarrow()
+    available = _stored_runs(statistic, store_dir)
+    if not available:
+        raise KeyError(f"No results stored for '{statistic}'")
+
+    if run == 'all':
+        selected = available
+    elif run == 'latest':
+        selected = available[-1:]
+    else:
+        selected = [run] if isinstance(run, str) else list(run)
+        missing = [r for r in selected if r not in available]
+        if missing:
+            raise KeyError(f"No '{statistic}' results for run(s) {', '.join(missing)}")
+
+    wanted = None if columns is None else KEY_COLUMNS + [c for c in columns if c not in KEY_COLUMNS]
+    tables = [feather.read_table(_path(statistic, r, store_dir), columns=wanted, memory_map=True)
+              for r in selected]
+    return pa.concat_tables(tables, promote_options='default').to_pandas()
+
+
+def compare(statistic, value, run_a, run_b, key='Property', store_dir=STORE_DIR):
+    """
+    One value column of a statistic side by side for two runs, keyed by
+    `key`, with their difference (run_b - run_a).
+    """
+    frames = load(statistic, [run_a, run_b], [key, value], store_dir)
+    wide = frames.pivot_table(index=key, columns='run_id', values=value, aggfunc='first', dropna=False)
+    wide = wide.reindex(columns=[run_a, run_b])
+    wide['difference'] = wide[run_b] - wide[run_a]
+    return wide
+
+
+def import_csv(path, statistic, run, value='Value', store_dir=STORE_DIR):
+    """
+    Adds an old CSV output (e.g. from Old_Analysis_Output/) to the store under
+    a run ID of your choice, so it can be compared with new runs. The old
+    one-row files with a column per property (what make_vertical in
+    output_tables.ipynb turned around) become a Property column and a
+    `value` column.
+    """
+    frame = pd.read_csv(path)
+    if len(frame) == 1 and frame.shape[1] > 1:
+        frame = frame.T.set_axis([value], axis=1).rename_axis('Property')
+    else:
+        frame = frame.set_index(frame.columns[0])
+    return record(statistic, frame, [], store_dir, run)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="List, show and compare runs in the results store.")
+    parser.add_argument('--store', default=STORE_DIR)
+    parser.add_argument('--show', metavar='STATISTIC', help="Print a statistic (latest run unless --run is given)")
+    parser.add_argument('--run', default='latest', help="Run ID for --show, or 'all'")
+    parser.add_argument('--compare', nargs=4, metavar=('STATISTIC', 'VALUE', 'RUN_A', 'RUN_B'),
+                        help="Put one value column of two runs side by side")
+    parser.add_argument('--key', default='Property', help="Column matching rows in --compare")
+    parser.add_argument('--import-csv', nargs=3, metavar=('CSV', 'STATISTIC', 'RUN'),
+                        help="Store an old CSV output under the given run ID")
+    parser.add_argument('--value', default='Value', help="Value column name of an imported one-row CSV")
+    args = parser.parse_args()
+
+    pd.set_option('display.width', 200)
+    if args.import_csv:
+        print(f"Stored {import_csv(*args.import_csv, args.value, args.store)}")
+    elif args.show:
+        print(load(args.show, args.run, store_dir=args.store).to_string(index=False))
+    elif args.compare:
+        print(compare(*args.compare, key=args.key, store_dir=args.store).to_string())
+    else:
+        print(runs(args.store).to_string(index=False))
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import profiler
+
+MANIFEST = 'manifest.json'
+RENDER_VERSION = 1  # bump when the figure style changes so every PNG is redrawn
+
+
+def safe_file_name(row_name):
+    """
+    File name for a row's PNG (letters, digits, spaces and underscores only).
+    """
+    return "".join(c for c in str(row_name) if c.isalnum() or c in (" ", "_")).rstrip() + ".png"
+
+
+def numeric_columns(df):
+    return [c for c in df.columns if isinstance(c, (int, float))]
+
+
+def row_payloads(dfs):
+    """
+    One plot description per row: (file name, title, [(label, x, y), ...]).
+    dfs maps a series label (VIS, FORUM, ...) to a Properties x Ratings frame.
+    """
+    rows = next(iter(dfs.values())).index  # assume same index across all dfs
+    series = {}
+    for label, df in dfs.items():
+        num_cols = numeric_columns(df)
+        series[label] = ([float(c) for c in num_cols], df.loc[rows, num_cols].to_numpy(dtype=float))
+
+    payloads = []
+    for i, row_name in enumerate(rows):
+        lines = [(label, x, y[i].tolist()) for label, (x, y) in series.items()]
+        payloads.append((safe_file_name(row_name), f"Scores for: {row_name}", lines))
+    return payloads
+
+
+def payload_hash(payload, dpi):
+    blob = json.dumps([RENDER_VERSION, dpi, payload], sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def _render_chunk(args):
+    """
+    Renders a batch of rows on one reused figure, only swapping line data and titles.
+    """
+    payloads, output_folder, dpi = args
+
+    import matplotlib
+    matplotlib.use('Agg')  # avoid GUI issues
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    lines = {}
+    for label, x, y in payloads[0][2]:
+        lines[label], = ax.plot(x, y, marker="o", label=label)
+    ax.set_xlabel("Rating")
+    ax.set_ylabel("Frequency")
+    ax.legend()
+    ax.grid(True)
+
+    saved = []
+    for file_name, title, series in payloads:
+        for label, x, y in series:
+            lines[label].set_data(x, y)
+        ax.set_title(title)
+        ax.relim()
+        ax.autoscale_view()
+        fig.tight_layout()
+
+        file_path = os.path.join(output_folder, file_name)
+        fig.savefig(file_path, dpi=dpi)
+        saved.append(file_path)
+
+    plt.close(fig)
+    return saved
+
+
+def plot_averages(avg_df, file_path='averages.png', dpi=150):
+    """
+    Bar chart of the 'Overall' mean rating per property.
+    """
+    import matplotlib
+    matplotlib.use('Agg')  # avoid GUI issues
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    avg_df['Overall'].plot(kind='bar')
+    plt.ylabel("Average Rating")
+    plt.xlabel("Row / Item")
+    plt.title("Average Rating per Code Across All Guidelines")
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+    plt.savefig(file_path, dpi=dpi)
+    plt.close()
+    profiler.count('figures saved')
+
+
+def _load_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_manifest(output_folder, manifest):
+    path = os.path.join(output_folder, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def render_rows(dfs, output_folder='row_distributions', n_jobs=None, dpi=150):
+    """
+    Draws one line chart per row of the frames in dfs into output_folder.
+    PNGs whose input data hash matches the manifest from the last run are
+    skipped, the rest are split across n_jobs worker processes (each reuses a
+    single figure), and PNGs no longer produced are deleted.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    old_manifest = _load_manifest(output_folder)
+
+    manifest = {}
+    pending = []
+    for payload in row_payloads(dfs):
+        file_name = payload[0]
+        digest = payload_hash(payload, dpi)
+        manifest[file_name] = digest
+        up_to_date = (old_manifest.get(file_name) == digest and
+                      os.path.exists(os.path.join(output_folder, file_name)))
+        if not up_to_date:
+            pending.append(payload)
+
+    # Two rows that sanitize to the same name: the last one wins, as before
+    pending = list({p[0]: p for p in pending}.values())
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = max(1, min(n_jobs, len(pending)))
+    chunks = [([pending[i] for i in idx], output_folder, dpi)
+              for idx in np.array_split(np.arange(len(pending)), n_jobs) if len(idx)]
+
+    with profiler.stage('savefig rows', plots=len(pending), jobs=n_jobs):
+        if n_jobs == 1:
+            saved = [path for chunk in chunks for path in _render_chunk(chunk)]
+        else:
+            # Fork so workers start with the caller's modules already imported
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork') if 'fork' in methods else None
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as pool:
+                saved = [path for paths in pool.map(_render_chunk, chunks) for path in paths]
+    profiler.count('figures saved', len(saved))
+
+    for file_path in saved:
+        print(f"Saved: {file_path}")
+    print(f"Skipped {len(manifest) - len(saved)} unchanged plots")
+
+    # Prune PNGs from older runs or other naming schemes
+    for name in sorted(os.listdir(output_folder)):
+        if name.endswith('.png') and name not in manifest:
+            os.remove(os.path.join(output_folder, name))
+            print(f"Removed stale: {os.path.join(output_folder, name)}")
+
+    _write_manifest(output_folder, manifest)
+    return saved
@@ -0,0 +1,253 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from id_index import canonical_keys, source_letters
+from rating_hist import N_CODES, MISSING, average_table, frequency_table, half_point_codes
+from results_store import record
+
+# Columns of a long-format export: one row per (document, property[, rater]) cell
+LONG_COLUMNS = {'document': 'document', 'property': 'property', 'value': 'value', 'rater': 'rater'}
+CHUNK_ROWS = 500_000
+
+FREQUENCY_FILES = {'V': 'vis_frequencies.csv', 'C': 'forum_frequencies.csv',
+                   'W': 'blog_frequencies.csv', 'B': 'book_frequencies.csv'}
+ELEMENTS = ["Example Present", "Counter-example Present", "Action Present", "Slogan Present"]
+YES = {'Y', 'YES'}
+INDEX_NAME = 'Document ID : Guideline ID'  # header of the property column in the workbooks
+
+
+def wide_to_long(df, rater=None):
+    """
+    Turns a Documents x Properties coding frame (as load_coding returns it)
+    into long-format rows, e.g. to write an export from existing workbooks.
+    """
+    long = df.rename_axis(index='document', columns='property').stack(future_stack=True).rename('value').reset_index()
+    if rater is not None:
+        long['rater'] = rater
+    return long
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS, columns=LONG_COLUMNS):
+    """
+    Yields the export in frames of at most chunk_rows rows, renamed to the
+    keys of `columns`. CSV goes through pandas; Parquet needs pyarrow.
+    """
+    rename = {source: key for key, source in columns.items()}
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        pf = pq.ParquetFile(path)
+        wanted = [c for c in pf.schema_arrow.names if c in rename]
+        for batch in pf.iter_batches(batch_size=chunk_rows, columns=wanted):
+            yield batch.to_pandas().rename(columns=rename)
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=False, na_values=['']):
+            yield chunk.rename(columns=rename)
+
+
+class StreamingAggregator:
+    """
+    Accumulates the per-source rating histograms (Groups x Properties x
+    Codes, as in rating_hist) and element presence counts from long-format
+    chunks, so memory does not grow with the number of cells.
+
+    Documents are matched on their canonical keys (id_index), so every
+    spelling of a unit is one document, as analysis.load_merged merges them
+    with unify_ids. A cell rated by several raters gets the mean of their
+    numeric ratings before it is binned, like merge_raters. Cells are only binned once
+    their document is complete: with sorted_by_document (rows of a
+    document are contiguous) just the last document of a chunk is held
+    back; otherwise every partial cell is kept until finish().
+    """
+
+    def __init__(self, elements=ELEMENTS, sorted_by_document=True):
+        self.elements = list(elements)
+        self.sorted_by_document = sorted_by_document
+        self.properties = {}
+        self.groups = {}
+        self.counts = np.zeros((0, 0, N_CODES), dtype=np.int64)
+        self.element_yes = np.zeros((0, len(self.elements)), dtype=np.int64)
+        self.element_rows = np.zeros((0, len(self.elements)), dtype=np.int64)
+        self.open_cells = None
+        self.closed_documents = set()
+        self.spellings = {}
+        self.rows = 0
+
+    def _ids(self, names, registry):
+        """
+        Integer ids for names, registering new ones in order of first appearance.
+        """
+        uniques = pd.unique(names)
+        for name in uniques:
+            registry.setdefault(name, len(registry))
+        lookup = np.array([registry[name] for name in uniques], dtype=np.int64)
+        return lookup[pd.Index(uniques).get_indexer(names)]
+
+    def _unify(self, documents):
+        """
+        Each document as the first spelling seen of its unit (canonical key),
+        parsing every distinct spelling of the chunk once.
+        """
+        codes, uniques = pd.factorize(np.asarray(documents, dtype=object))
+        spelled = [self.spellings.setdefault(key, name) for key, name in zip(canonical_keys(uniques).tolist(), uniques)]
+        return np.asarray(spelled, dtype=object)[codes]
+
+    def _grow(self):
+        n_groups, n_props = len(self.groups), len(self.properties)
+        g, p, _ = self.counts.shape
+        if (g, p) != (n_groups, n_props):
+            self.counts = np.pad(self.counts, ((0, n_groups - g), (0, n_props - p), (0, 0)))
+        pad = ((0, n_groups - self.element_yes.shape[0]), (0, 0))
+        self.element_yes = np.pad(self.element_yes, pad)
+        self.element_rows = np.pad(self.element_rows, pad)
+
+    def _count_elements(self, chunk):
+        col = pd.Index(self.elements).get_indexer(chunk['property'])
+        rows = col >= 0
+        if not rows.any():
+            return
+        groups = self._ids(source_letters(chunk['document']).to_numpy()[rows], self.groups)
+        self._grow()
+        yes = chunk['value'][rows].astype(str).str.strip().str.upper().isin(YES).to_numpy()
+
+        cell = groups * len(self.elements) + col[rows]
+        size = self.element_rows.size
+        self.element_rows += np.bincount(cell, minlength=size).reshape(self.element_rows.shape)
+        self.element_yes += np.bincount(cell[yes], minlength=size).reshape(self.element_yes.shape)
+
+    def _bin_cells(self, cells):
+        """
+        Adds finished (document, property) -> (sum, count) cells to the histogram.
+        """
+        if cells.empty:
+            return
+        documents = cells.index.get_level_values('document')
+        groups = self._ids(source_letters(documents).to_numpy(), self.groups)
+        props = self._ids(cells.index.get_level_values('property').to_numpy(), self.properties)
+        self._grow()
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            codes = half_point_codes(cells['sum'].to_numpy() / cells['count'].to_numpy())
+        valid = codes != MISSING
+        flat = (groups * len(self.properties) + props) * N_CODES + codes
+        self.counts += np.bincount(flat[valid], minlength=self.counts.size).reshape(self.counts.shape)
+
+    def update(self, chunk):
+        """
+        Folds one long-format chunk (document, property, value[, rater]) into the totals.
+        """
+        chunk = chunk.dropna(subset=['document', 'property'])
+        chunk = chunk.assign(document=self._unify(chunk['document'].astype(str)), property=chunk['property'].astype(str))
+        self.rows += len(chunk)
+
+        # Register properties in file order even if they never carry a rating
+        self._ids(chunk['property'].to_numpy(), self.properties)
+        self._grow()
+        self._count_elements(chunk)
+
+        numeric = pd.to_numeric(chunk['value'], errors='coerce')
+        cells = pd.DataFrame({
+            'document': chunk['document'].to_numpy(),
+            'property': chunk['property'].to_numpy(),
+            'sum': numeric.fillna(0.0).to_numpy(),
+            'count': numeric.notna().to_numpy(dtype=np.int64),
+        }).groupby(['document', 'property'], sort=False)[['sum', 'count']].sum()
+
+        if self.open_cells is not None:
+            cells = pd.concat([self.open_cells, cells]).groupby(level=[0, 1], sort=False).sum()
+
+        if not self.sorted_by_document:
+            self.open_cells = cells
+            return
+
+        documents = cells.index.get_level_values('document')
+        # Set lookups for the chunk's own documents only, so the check does not grow with the documents closed so far
+        reopened = [d for d in pd.unique(documents) if d in self.closed_documents]
+        if reopened:
+            raise ValueError(f"Document '{reopened[0]}' appears again after its rows ended; "
+                             "use sorted_by_document=False for exports not grouped by document")
+
+        last = chunk['document'].iloc[-1] if len(chunk) else None
+        hold = documents == last
+        self._bin_cells(cells[~hold])
+        self.closed_documents.update(pd.unique(documents[~hold]))
+        self.open_cells = cells[hold]
+
+    def finish(self):
+        if self.open_cells is not None:
+            self._bin_cells(self.open_cells)
+            self.closed_documents.update(pd.unique(self.open_cells.index.get_level_values('document')))
+            self.open_cells = None
+        return self
+
+    @property
+    def property_index(self):
+        return pd.Index(list(self.properties), name=INDEX_NAME)
+
+    def frequency_tables(self, codes=range(2, 10)):
+        """
+        {group letter: Properties x Ratings table}, formatted like analysis.py's.
+        """
+        return {letter: frequency_table(self.counts[g], self.property_index, codes)
+                for letter, g in self.groups.items()}
+
+    def averages(self, codes=range(2, 10)):
+        return average_table(self.counts, list(self.groups), self.property_index, codes)
+
+    def element_rates(self):
+        """
+        Groups x Elements share of rows marked Y/YES (blank or other values count as no).
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = self.element_yes / self.element_rows
+        return pd.DataFrame(rates, index=pd.Index(list(self.groups), name='Source'), columns=self.elements)
+
+
+def aggregate_export(path, chunk_rows=CHUNK_ROWS, columns=LONG_COLUMNS, sorted_by_document=True):
+    """
+    Streams a long-format CSV/Parquet export through a StreamingAggregator.
+    """
+    agg = StreamingAggregator(sorted_by_document=sorted_by_document)
+    for chunk in read_chunks(path, chunk_rows, columns):
+        agg.update(chunk)
+    return agg.finish()
+
+
+def write_outputs(agg, output_dir='.', inputs=()):
+    """
+    Writes the *_frequencies.csv files, averages.png and element_presence.csv,
+    and stores the frequencies and element rates in the results store.
+    """
+    from row_plots import plot_averages
+
+    os.makedirs(output_dir, exist_ok=True)
+    for letter, table in agg.frequency_tables().items():
+        if letter in FREQUENCY_FILES:
+            table.to_csv(os.path.join(output_dir, FREQUENCY_FILES[letter]))
+    plot_averages(agg.averages(), os.path.join(output_dir, 'averages.png'))
+    agg.element_rates().to_csv(os.path.join(output_dir, 'element_presence.csv'))
+
+    record('frequencies', pd.concat(agg.frequency_tables(), names=['Source', 'Property']), inputs)
+    record('element_presence', agg.element_rates(), inputs)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Frequencies and averages from a long-format coding export, in chunks.")
+    parser.add_argument('export', help="CSV or Parquet with document, property, value (and optionally rater) columns")
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--unsorted', action='store_true', help="Rows of a document are not contiguous")
+    for key in LONG_COLUMNS:
+        parser.add_argument(f'--{key}-column', default=LONG_COLUMNS[key])
+    args = parser.parse_args()
+
+    columns = {key: getattr(args, f'{key}_column') for key in LONG_COLUMNS}
+    agg = aggregate_export(args.export, args.chunk_rows, columns, not args.unsorted)
+    print(f"Read {agg.rows} rows: {len(agg.closed_documents)} documents, "
+          f"{len(agg.properties)} properties, groups {', '.join(agg.groups)}")
+    write_outputs(agg, args.output_dir, [args.export])
+    print(f"Saved frequencies, averages.png and element_presence.csv to {args.output_dir}")